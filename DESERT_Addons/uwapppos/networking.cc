@@ -113,3 +113,184 @@ void PositionListener::Run()
 		LOG_MSG_ERROR("Node " << p_Owner->GetNodeID() << ": caught exception in listening thread: " << e.what() << " - " << std::strerror(errno));
 	}
 }
+
+std::mutex BatchPositionListener::s_ListenersMutex;
+std::map<uint16_t, BatchPositionListener *> BatchPositionListener::s_Listeners;
+
+BatchPositionListener::BatchPositionListener(uint16_t port, timeval timeout)
+{
+	m_Port = port;
+	m_ReadTimeout = timeout;
+}
+
+BatchPositionListener::~BatchPositionListener()
+{
+	if (m_SocketFD)
+		::close(m_SocketFD);
+}
+
+bool BatchPositionListener::Register(uwAppPosModule *module, uint16_t port, timeval read_timeout)
+{
+	std::lock_guard<std::mutex> lock(s_ListenersMutex);
+	BatchPositionListener *listener = nullptr;
+	auto it = s_Listeners.find(port);
+	if (it == s_Listeners.end())
+	{
+		listener = new BatchPositionListener(port, read_timeout);
+		listener->m_DebugLevel = module->GetDebugLevel();
+		if (!listener->Start())
+		{
+			delete listener;
+			return false;
+		}
+		s_Listeners[port] = listener;
+	}
+	else
+		listener = it->second;
+	std::lock_guard<std::mutex> nodes_lock(listener->m_NodesMutex);
+	listener->m_Nodes[module->GetNodeID()] = module;
+	return true;
+}
+
+void BatchPositionListener::Unregister(uwAppPosModule *module, uint16_t port)
+{
+	std::lock_guard<std::mutex> lock(s_ListenersMutex);
+	auto it = s_Listeners.find(port);
+	if (it == s_Listeners.end())
+		return;
+	BatchPositionListener *listener = it->second;
+	{
+		std::lock_guard<std::mutex> nodes_lock(listener->m_NodesMutex);
+		auto node = listener->m_Nodes.find(module->GetNodeID());
+		if (node != listener->m_Nodes.end() && node->second == module)
+			listener->m_Nodes.erase(node);
+		if (!listener->m_Nodes.empty())
+			return;
+	}
+	s_Listeners.erase(it);
+	listener->Stop(true);
+	delete listener;
+}
+
+bool BatchPositionListener::Parse(const char *data, std::size_t size, std::vector<PositionRecord> &records)
+{
+	records.clear();
+	if (size < POSITION_BATCH_HEADER_SIZE || data[0] != POSITION_BATCH_MAGIC[0] || data[1] != POSITION_BATCH_MAGIC[1] ||
+		(unsigned char)data[2] != POSITION_BATCH_VERSION)
+		return false;
+	unsigned char flags = (unsigned char)data[3];
+	uint16_t count;
+	std::memcpy(&count, data + 4, sizeof(count));
+	std::size_t record_size = POSITION_BATCH_RECORD_SIZE;
+	if (flags & POSITION_BATCH_FLAG_TIMESTAMP)
+		record_size += POSITION_BATCH_TIMESTAMP_SIZE;
+	if (size < POSITION_BATCH_HEADER_SIZE + count * record_size)
+		return false;
+	records.resize(count);
+	const char *p = data + POSITION_BATCH_HEADER_SIZE;
+	for (auto &record : records)
+	{
+		// packed little endian fields, copied to avoid unaligned access
+		uint16_t node_id;
+		std::memcpy(&node_id, p, sizeof(node_id));
+		record.node_id = node_id;
+		record.position.geodetic = p[2] != 0;
+		std::memcpy(&record.position.x, p + 3, sizeof(double));
+		std::memcpy(&record.position.y, p + 11, sizeof(double));
+		std::memcpy(&record.position.z, p + 19, sizeof(double));
+		record.timestamp = 0.0;
+		if (flags & POSITION_BATCH_FLAG_TIMESTAMP)
+			std::memcpy(&record.timestamp, p + POSITION_BATCH_RECORD_SIZE, sizeof(double));
+		p += record_size;
+	}
+	return true;
+}
+
+bool BatchPositionListener::ReadyToRead()
+{
+	fd_set fdset;
+	FD_ZERO(&fdset);
+	FD_SET(m_SocketFD, &fdset);
+
+	// select() may modify the timeout
+	timeval timeout = m_ReadTimeout;
+	int ret = select((int)m_SocketFD + 1, &fdset, NULL, NULL, &timeout);
+	if (ret == SOCKET_ERROR)
+	{
+		LOG_MSG_ERROR("Batch position listener on port " << m_Port << ": error on select: " << ret);
+	}
+	return ret == 1;
+}
+
+void BatchPositionListener::Dispatch(const std::vector<PositionRecord> &records)
+{
+	std::lock_guard<std::mutex> lock(m_NodesMutex);
+	for (const auto &record : records)
+	{
+		auto it = m_Nodes.find(record.node_id);
+		if (it == m_Nodes.end())
+		{
+			if (m_DebugLevel >= 1)
+				LOG_MSG_WARN_ONCE("Batch position listener on port " << m_Port << ": position for unknown node " << record.node_id);
+			continue;
+		}
+		if (m_DebugLevel >= 3)
+			LOG_MSG_INFO("Node " << record.node_id << ": position with time stamp " << record.timestamp);
+		it->second->setPosition(record.position);
+	}
+}
+
+void BatchPositionListener::Run()
+{
+	try
+	{
+		if (m_DebugLevel > 0) LOG_MSG_INFO("Starting batch position data listener on port " << m_Port);
+		m_SocketFD = socket(AF_INET, SOCK_DGRAM, IPPROTO_UDP);
+		if (m_SocketFD < 0)
+			throw std::runtime_error("BatchPositionListener::Run()::socket()");
+
+		int reuse = 1;
+		if (setsockopt(m_SocketFD, SOL_SOCKET, SO_REUSEADDR, (SET_SOCKOPT_TYPE)&reuse, sizeof(reuse)) == -1)
+			throw std::runtime_error("BatchPositionListener::Run()::setsockopt::reuse");
+
+		// one batch per update interval for all nodes, keep room for several
+		int rx_buffer_size = 64 * 1024 * 28;
+		if (setsockopt(m_SocketFD, SOL_SOCKET, SO_RCVBUF, (SET_SOCKOPT_TYPE)&rx_buffer_size, sizeof(rx_buffer_size)) == -1)
+			throw std::runtime_error("BatchPositionListener::Run()::setsockopt::rcvbuf");
+
+		struct sockaddr_in dg_addr;
+		memset(&dg_addr, 0, sizeof(dg_addr));
+		dg_addr.sin_family = AF_INET;
+		dg_addr.sin_addr.s_addr = htonl(INADDR_ANY);
+		dg_addr.sin_port = htons(m_Port);
+
+		if (bind(m_SocketFD, (struct sockaddr *)&dg_addr, sizeof(dg_addr)) == -1)
+			throw std::runtime_error("BatchPositionListener::Run()::bind");
+
+		// largest UDP payload
+		std::vector<char> incoming_buffer(65507);
+		std::vector<PositionRecord> records;
+		while (!StopRequested())
+		{
+			if (!ReadyToRead())
+				continue;
+			int num_bytes_read = recvfrom(m_SocketFD, incoming_buffer.data(), incoming_buffer.size(), 0, 0, 0);
+			if (num_bytes_read < 0)
+			{
+				LOG_MSG_ERROR("Batch position listener on port " << m_Port << ": error reading from UDP port: " << num_bytes_read);
+				continue;
+			}
+			if (!Parse(incoming_buffer.data(), num_bytes_read, records))
+			{
+				LOG_MSG_ERROR_ONCE("Batch position listener on port " << m_Port << ": ignoring invalid batch datagram of " << num_bytes_read << " bytes");
+				continue;
+			}
+			Dispatch(records);
+		}
+		if (m_DebugLevel > 0) LOG_MSG_INFO("Stopping batch position data listener on port " << m_Port);
+	}
+	catch (const std::exception &e)
+	{
+		LOG_MSG_ERROR("Batch position listener on port " << m_Port << ": caught exception in listening thread: " << e.what() << " - " << std::strerror(errno));
+	}
+}
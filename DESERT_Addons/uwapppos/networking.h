@@ -21,7 +21,13 @@
 #define SENDTO_TYPE const char *
 #define SOCKET_ERROR -1
 
+#include <map>
+#include <mutex>
+#include <unordered_map>
+#include <vector>
+
 #include "stoppable_thread.h"
+#include "position_data.h"
 
 class uwAppPosModule;
 
@@ -45,4 +51,41 @@ protected:
 	uwAppPosModule *p_Owner;
 };
 
+/** Shared position listener thread with one UDP socket for the batch
+ *  datagrams of all nodes (see position_data.h), the records are handed
+ *  to the module registered for their node id
+ *
+ */
+class BatchPositionListener : public StoppableThread
+{
+public:
+	/** Register the module for its node id on the listener of port, the listener is started with the first module */
+	static bool Register(uwAppPosModule *module, uint16_t port, timeval read_timeout);
+	/** Unregister the module, the listener is stopped with the last module */
+	static void Unregister(uwAppPosModule *module, uint16_t port);
+	/** Parse a batch datagram into records, returns false if it is not a valid batch */
+	static bool Parse(const char *data, std::size_t size, std::vector<PositionRecord> &records);
+
+	virtual ~BatchPositionListener();
+	virtual void Run();
+
+protected:
+	BatchPositionListener(uint16_t port, timeval read_timeout);
+	bool ReadyToRead();
+	void Dispatch(const std::vector<PositionRecord> &records);
+
+	SOCKET_TYPE m_SocketFD{0};
+	timeval m_ReadTimeout;
+	uint16_t m_Port;
+	int m_DebugLevel{0};
+
+	/** Modules by node id, locked while records are dispatched */
+	std::mutex m_NodesMutex;
+	std::unordered_map<int, uwAppPosModule *> m_Nodes;
+
+	/** Listeners by port */
+	static std::mutex s_ListenersMutex;
+	static std::map<uint16_t, BatchPositionListener *> s_Listeners;
+};
+
 #endif // _NETWORKING_HH_
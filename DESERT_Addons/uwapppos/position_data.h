@@ -10,6 +10,7 @@
 #ifndef POSITION_DATA_H
 #define POSITION_DATA_H
 
+#include <cstddef>
 // C++ serialization code
 #include "archive.h"
 // Serialization in Python:
@@ -34,4 +35,25 @@ struct PositionData
     }
 };
 
+// Batch of position records of several nodes in one datagram, sent to the
+// shared listener on BatchPositionPort. All values are little endian and packed:
+//   header: char magic[2] = "PB", uint8 version, uint8 flags, uint16 record count
+//   record: uint16 node_id, bool geodetic, double x, y, z[, double timestamp if flags & POSITION_BATCH_FLAG_TIMESTAMP]
+// Serialization in Python: see pack_position_batches() in sample/mobility.py
+constexpr char POSITION_BATCH_MAGIC[2] = {'P', 'B'};
+constexpr unsigned char POSITION_BATCH_VERSION = 1;
+constexpr unsigned char POSITION_BATCH_FLAG_TIMESTAMP = 0x01;
+constexpr std::size_t POSITION_BATCH_HEADER_SIZE = 6;
+constexpr std::size_t POSITION_BATCH_RECORD_SIZE = 27;
+constexpr std::size_t POSITION_BATCH_TIMESTAMP_SIZE = 8;
+
+struct PositionRecord
+{
+    /** Node id of the uwAppPosModule the position is for */
+    int node_id;
+    /** Time stamp of the position sent by the source, 0.0 if not sent */
+    double timestamp;
+    PositionData position;
+};
+
 #endif /* POSITION_DATA_H */
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the Python harness (test_sockets.py / test_sockets_UDP.py) on top
+of the ns stand-in (ns_standin.py), no DESERT build needed.
+
+Measures per scenario (protocol, engine, number of nodes): delivered messages/s,
+CPU time of the harness per message, latency overhead (the stand-in forwards
+without delay, so the measured latency is the cost of the harness and the
+loopback sockets) and delivery ratio. Results are appended to a JSON lines file
+and compared to the previous run to show regressions.
+
+python3 benchmark.py -n 1,4,16,64 -p tcp,udp -e asyncio,threads
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+
+import psutil
+
+from process_utils import get_child_process_by_name
+
+SCRIPTS = {"tcp": "test_sockets.py", "udp": "test_sockets_UDP.py"}
+
+# opt(start) of the tcl templates, the nodes send between start and run time
+START_TIME = 1.0
+
+# metric -> (True if higher is better, smallest absolute change counted as regression)
+# sub-ms latency differences on the loopback are noise
+METRICS = {
+    "throughput": (True, 0.0),
+    "cpu_per_msg_us": (False, 0.0),
+    "latency_p50_us": (False, 1000.0),
+    "latency_p99_us": (False, 1000.0),
+    "delivery_ratio": (True, 0.0),
+}
+
+
+def _cpu_time(proc: psutil.Process) -> float:
+    t = proc.cpu_times()
+    return t.user + t.system
+
+
+def run_benchmark(protocol: str, engine: str, nodes: int, run_time: int, offered_load: float,
+                  sample_dir: str, poll_interval: float = 0.05) -> dict:
+    """
+    Run the harness once with the stand-in and return the measured metrics.
+    The CPU time is measured between the start and the stop time of the
+    script only, so the start up of the interpreter is not counted.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        stats_file = os.path.join(tmp, "stats.json")
+        cmd = [sys.executable, SCRIPTS[protocol], "--ns-standin",
+               "-n", str(nodes), "-t", str(run_time), "-e", engine,
+               "--offered-load", str(offered_load),
+               "--no-echo", "--profile-interval", "0", "--stats-json", stats_file,
+               "--standin-mode", "sink", "--standin-sound-speed", "0", "--standin-linger", "0"]
+        start = time.monotonic()
+        proc = subprocess.Popen(cmd, cwd=sample_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        harness = psutil.Process(proc.pid)
+        harness_cpu = 0.0
+        cpu_start = None
+        cpu_stop = None
+        ns_cpu = 0.0
+        ns = None
+        while proc.poll() is None:
+            try:
+                harness_cpu = _cpu_time(harness)
+                elapsed = time.monotonic() - start
+                if cpu_start is None and elapsed >= START_TIME:
+                    cpu_start = harness_cpu
+                if cpu_stop is None and elapsed >= run_time:
+                    cpu_stop = harness_cpu
+                if ns is None:
+                    ns = get_child_process_by_name(proc.pid, "ns")
+                if ns is not None:
+                    ns_cpu = _cpu_time(ns)
+            except psutil.NoSuchProcess:
+                pass
+            time.sleep(poll_interval)
+        wall_time = time.monotonic() - start
+        if proc.returncode != 0 or not os.path.exists(stats_file):
+            raise RuntimeError(f"{' '.join(cmd)} failed with exit code {proc.returncode}")
+        with open(stats_file, "rt") as f:
+            stats = json.load(f)
+
+    messages = stats["sent"] + stats["received"]
+    active_cpu = (cpu_stop if cpu_stop is not None else harness_cpu) - (cpu_start or 0.0)
+    return {
+        "protocol": protocol,
+        "engine": engine,
+        "nodes": nodes,
+        "offered_load": offered_load,
+        "wall_time": wall_time,
+        "sent": stats["sent"],
+        "received": stats["received"],
+        "throughput": stats["received"] / (run_time - START_TIME),
+        "harness_cpu_s": harness_cpu,
+        "ns_cpu_s": ns_cpu,
+        "cpu_per_msg_us": 1e6 * active_cpu / messages if messages else None,
+        "latency_p50_us": stats["latency"]["p50_us"],
+        "latency_p99_us": stats["latency"]["p99_us"],
+        "delivery_ratio": stats["received"] / stats["sent"] if stats["sent"] else None,
+    }
+
+
+def _key(result: dict) -> tuple:
+    return result["protocol"], result["engine"], result["nodes"], result["offered_load"]
+
+
+def load_previous(filename: str):
+    """Last saved run or None"""
+    if not os.path.exists(filename):
+        return None
+    last = None
+    with open(filename, "rt") as f:
+        for line in f:
+            if line.strip():
+                last = json.loads(line)
+    return last
+
+
+def save_run(filename: str, results: list) -> None:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    run = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "host": platform.node(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    with open(filename, "at") as f:
+        f.write(json.dumps(run) + "\n")
+
+
+def compare(results: list, previous: dict, threshold: float) -> list:
+    """Return the (scenario, metric, old, new) which are worse than the previous run by more than threshold"""
+    if previous is None:
+        return []
+    old_results = {_key(r): r for r in previous["results"]}
+    regressions = []
+    for r in results:
+        old = old_results.get(_key(r))
+        if old is None:
+            continue
+        for metric, (higher_is_better, min_change) in METRICS.items():
+            a, b = old.get(metric), r.get(metric)
+            if not a or b is None:
+                continue
+            worse = a - b if higher_is_better else b - a
+            if worse > min_change and worse / a > threshold:
+                regressions.append((_key(r), metric, a, b))
+    return regressions
+
+
+def print_results(results: list) -> None:
+    print(f"{'proto':<5} {'engine':<8} {'nodes':>5} {'msg/s':>8} {'cpu/msg':>9} {'p50':>8} {'p99':>8} {'delivery':>8}")
+    for r in results:
+        ratio = f"{100.0 * r['delivery_ratio']:.1f} %" if r["delivery_ratio"] is not None else "-"
+        cpu = f"{r['cpu_per_msg_us']:.0f} us" if r["cpu_per_msg_us"] is not None else "-"
+        print(f"{r['protocol']:<5} {r['engine']:<8} {r['nodes']:>5} {r['throughput']:>8.1f} {cpu:>9} "
+              f"{r['latency_p50_us'] / 1e3:>5.2f} ms {r['latency_p99_us'] / 1e3:>5.2f} ms {ratio:>8}")
+
+
+def main():
+    argparser = ArgumentParser(description='Benchmark the Python harness on top of the ns stand-in.')
+    argparser.add_argument('-n', '--nodes', default='1,4,16', help='Comma separated numbers of sending nodes')
+    argparser.add_argument('-p', '--protocols', default='tcp,udp', help='Comma separated protocols (tcp, udp)')
+    argparser.add_argument('-e', '--engines', default='asyncio,threads', help='Comma separated node drivers')
+    argparser.add_argument('-t', '--run-time', type=int, default=10, help='Run time of each scenario in [s]')
+    argparser.add_argument('-L', '--offered-load', type=float, default=50.0,
+                           help='Aggregate offered load of all sending nodes in [msg/s]')
+    argparser.add_argument('-o', '--output', default='benchmark_results.jsonl',
+                           help='JSON lines file the results are appended to')
+    argparser.add_argument('--threshold', type=float, default=0.2,
+                           help='Report metrics worse than the previous run by more than this fraction')
+    args = argparser.parse_args()
+
+    sample_dir = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for protocol in args.protocols.split(','):
+        for engine in args.engines.split(','):
+            for nodes in (int(n) for n in args.nodes.split(',')):
+                print(f"Running {protocol} {engine} with {nodes} nodes ...", flush=True)
+                results.append(run_benchmark(protocol, engine, nodes, args.run_time, args.offered_load, sample_dir))
+    print_results(results)
+
+    regressions = compare(results, load_previous(args.output), args.threshold)
+    for (protocol, engine, nodes, _), metric, old, new in regressions:
+        print(f"REGRESSION {protocol} {engine} {nodes} nodes: {metric} {old:.6g} -> {new:.6g}")
+    save_run(args.output, results)
+    print(f"Results appended to {args.output}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
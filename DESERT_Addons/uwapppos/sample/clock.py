@@ -0,0 +1,349 @@
+"""
+Clocks of the harness.
+
+WallClock: time.monotonic(), for ns running under Scheduler/RealTime, the
+default.
+
+VirtualClock: simulation time of ns running with the default (non real-time)
+scheduler and the lock-step synchronization block (see
+template_substitutions()). ns and the harness proceed in lock-step
+(SyncServer): at every synchronization point ns reports its simulation time on
+the sync socket and blocks until the harness answers with the time of the next
+one. The harness advances the virtual clock, lets every participant (traffic
+scheduler, position worker) do the work due until then and answers when all
+of them wait for a later time: the earliest of these times, at most sync_step
+later. A scenario without hardware in the loop then runs as fast as ns and the
+harness can go, messages received from ns are timestamped with the simulation
+time of the last synchronization point.
+"""
+
+import logging
+import select
+import socket
+import threading
+import time
+
+from scenario import CustomTemplate
+
+logger = logging.getLogger(__name__)
+
+# TMPL_SCHEDULER of uwAppPos.tmpl with the wall clock
+REALTIME_SCHEDULER = """\
+Scheduler/RealTime set slop_warning           0 ;# if > 0, print warning message when slop exceeds slop_
+$ns use-scheduler RealTime"""
+
+# TMPL_SYNC of uwAppPos.tmpl with the virtual clock:
+# At every synchronization point ns reports its simulation time to the harness
+# and blocks until the harness has sent the messages and positions due until
+# then. The harness answers with the time of the next synchronization point.
+SYNC_BLOCK = """
+#############################
+# Lock-step synchronization #
+#############################
+set opt(sync_host)  "%$%{SYNC_HOST}" ;# Address of the harness
+set opt(sync_port)  %$%{SYNC_PORT}  ;# TCP port of the lock-step synchronization with the harness
+set opt(sync_step)  %$%{SYNC_STEP}  ;# Longest simulated time between two synchronization points in [s]
+set sync_chan [socket $opt(sync_host) $opt(sync_port)]
+fconfigure $sync_chan -buffering line -translation lf
+
+proc sync_point {} {
+    global ns opt sync_chan
+    set now [$ns now]
+    puts $sync_chan "T $now"
+    if {[gets $sync_chan reply] < 0 || [lindex $reply 0] != "GO"} {
+        puts "Harness closed the sync socket, halting"
+        $ns halt
+        return
+    }
+    set next [lindex $reply 1]
+    if {$next <= $now} {
+        set next [expr $now + $opt(sync_step)]
+    }
+    $ns at $next "sync_point"
+}
+$ns at 0 "sync_point"
+"""
+
+
+class WallClock(object):
+    virtual = False
+
+    def now(self) -> float:
+        return time.monotonic()
+
+    def now_ns(self) -> int:
+        return time.monotonic_ns()
+
+    def join(self, name: str) -> 'WallClock':
+        """Waits on the wall clock need no registration, the clock is its own participant"""
+        return self
+
+    def leave(self) -> None:
+        pass
+
+    def wait_until(self, t: float, event: threading.Event) -> bool:
+        """Wait until t [s] on this clock (None for ever) or until event is set, True if it is set"""
+        return event.wait(None if t is None else max(0.0, t - self.now()))
+
+    def stop(self) -> None:
+        pass
+
+
+WALL_CLOCK = WallClock()
+
+
+class ClockEvent(threading.Event):
+    """Event which also wakes up the waits of a VirtualClock for it on set()"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        # conditions of the clocks waiting for the event
+        self._waiters = []
+
+    def set(self) -> None:
+        super().set()
+        for cond in list(self._waiters):
+            with cond:
+                cond.notify_all()
+
+
+class _Participant(object):
+    def __init__(self, clock: 'VirtualClock', name: str) -> None:
+        self.clock = clock
+        self.name = name
+        self.virtual = True
+        # (deadline, event) while waiting, None while busy
+        self.waiting = None
+
+    def now(self) -> float:
+        return self.clock.now()
+
+    def now_ns(self) -> int:
+        return self.clock.now_ns()
+
+    def wait_until(self, t: float, event: threading.Event) -> bool:
+        return self.clock.wait_until(t, event, self)
+
+    def leave(self) -> None:
+        self.clock.leave(self)
+
+
+class VirtualClock(object):
+    virtual = True
+
+    def __init__(self) -> None:
+        """Simulation time [s] of ns, advanced by the SyncServer"""
+        self.time = 0.0
+        self.stopping = False
+        self._participants = []
+        self._cond = threading.Condition()
+
+    def now(self) -> float:
+        return self.time
+
+    def now_ns(self) -> int:
+        return int(self.time * 1e9)
+
+    def join(self, name: str) -> _Participant:
+        """
+        Register a worker which does its work at virtual times, the clock only
+        advances when every participant waits for a later time. A participant
+        is busy until its first wait_until(), join before the worker is started.
+        """
+        participant = _Participant(self, name)
+        with self._cond:
+            self._participants.append(participant)
+        return participant
+
+    def leave(self, participant: _Participant) -> None:
+        with self._cond:
+            if participant in self._participants:
+                self._participants.remove(participant)
+            self._cond.notify_all()
+
+    def wait_until(self, t: float, event: ClockEvent, participant: _Participant = None) -> bool:
+        """
+        Wait until the virtual time reaches t (None for ever) or until event is set, True if it is set.
+        event is a ClockEvent, its set() wakes up the wait.
+        """
+        if not isinstance(event, ClockEvent):
+            raise TypeError("The virtual clock waits for a ClockEvent")
+        with self._cond:
+            event._waiters.append(self._cond)
+            if participant is not None:
+                participant.waiting = (t, event)
+                self._cond.notify_all()
+            try:
+                while not (self.stopping or event.is_set() or (t is not None and self.time >= t)):
+                    self._cond.wait()
+            finally:
+                event._waiters.remove(self._cond)
+                if participant is not None:
+                    participant.waiting = None
+            return event.is_set()
+
+    def _quiet(self) -> bool:
+        for participant in self._participants:
+            if participant.waiting is None:
+                return False
+            t, event = participant.waiting
+            if event.is_set() or (t is not None and t <= self.time):
+                return False
+        return True
+
+    def advance(self, t: float, barrier: bool = True):
+        """
+        Set the virtual time to t and with barrier wait until every participant
+        waits for a later time. Returns the earliest time a participant waits
+        for, None if there is none or the clock is stopped.
+        """
+        with self._cond:
+            self.time = max(self.time, t)
+            self._cond.notify_all()
+            if not barrier:
+                return None
+            # every change of _quiet() notifies: waits, leave(), ClockEvent.set() and stop()
+            while not (self.stopping or self._quiet()):
+                self._cond.wait()
+            deadlines = [p.waiting[0] for p in self._participants if p.waiting is not None and p.waiting[0] is not None]
+            return min(deadlines) if deadlines and not self.stopping else None
+
+    def stop(self) -> None:
+        """Release all waits, can be called from any thread"""
+        with self._cond:
+            self.stopping = True
+            self._cond.notify_all()
+
+
+class SyncServer(threading.Thread):
+    def __init__(self, clock: VirtualClock,
+                 step: float = 0.1,
+                 settle: float = 0.001,
+                 start: float = 0.0,
+                 host: str = "127.0.0.1",
+                 port: int = 0) -> None:
+        """
+        Lock-step synchronization with ns (see SYNC_BLOCK), ns connects to
+        host:port, port 0 binds any free port (see self.port).
+
+        step: longest simulated time between two synchronization points in [s]
+        settle: wall time in [s] the uwAppPos socket threads get to read the messages
+            of a synchronization point before ns goes on
+        start: simulation time the nodes open their sockets (opt(start)), from there
+            on ns is held until release() is called, e.g. when every node is ready
+        """
+        super().__init__(name="SyncServer")
+        self.clock = clock
+        self.host = host
+        self.step = step
+        self.settle = settle
+        self.start_time = start
+        self.steps = 0
+        self.barrier_time = 0.0
+        self.wall_start = None
+        self.wall_end = None
+        self._released = threading.Event()
+        self._stopping = threading.Event()
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(1)
+        self.port = self._server.getsockname()[1]
+
+    def release(self) -> None:
+        """Let ns run past the start time, the participants of the clock are started"""
+        self._released.set()
+
+    def stop(self):
+        """stop the thread."""
+        self._stopping.set()
+        self._released.set()
+        self.clock.stop()
+
+    def _accept(self):
+        while not self._stopping.is_set():
+            readable, _, _ = select.select([self._server], [], [], 0.1)
+            if readable:
+                conn, _ = self._server.accept()
+                return conn
+        return None
+
+    def run(self):
+        conn = self._accept()
+        self._server.close()
+        if conn is None:
+            return
+        logger.info("ns connected to the sync socket, running in lock-step on the virtual clock")
+        self.wall_start = time.monotonic()
+        with conn, conn.makefile("rwb", buffering=0) as f:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            while not self._stopping.is_set():
+                line = f.readline()
+                if not line:
+                    break
+                try:
+                    t = float(line.split()[1])
+                except (IndexError, ValueError):
+                    logger.warning(f"Invalid sync message from ns: {line!r}")
+                    continue
+                if t >= self.start_time and not self._released.is_set():
+                    self._released.wait()
+                start = time.monotonic()
+                next_t = self.clock.advance(t, barrier=self._released.is_set())
+                if self.settle > 0.0:
+                    time.sleep(self.settle)
+                self.barrier_time += time.monotonic() - start
+                self.steps += 1
+                if self._stopping.is_set():
+                    break
+                next_t = t + self.step if next_t is None else min(next_t, t + self.step)
+                try:
+                    f.write(f"GO {next_t:.9f}\n".encode())
+                except OSError:
+                    break
+        self.wall_end = time.monotonic()
+        logger.info(f"Sync socket closed at simulation time {self.clock.now():.3f} s")
+
+    def print_summary(self) -> None:
+        if self.wall_start is None:
+            print("Virtual clock: ns did not connect to the sync socket")
+            return
+        wall = (self.wall_end or time.monotonic()) - self.wall_start
+        simulated = self.clock.now()
+        print(f"Virtual clock: {simulated:.1f} s simulated in {wall:.1f} s ({simulated / max(wall, 1e-9):.1f}x real time), "
+              f"{self.steps} sync points, harness {1e3 * self.barrier_time / max(1, self.steps):.2f} ms per sync point")
+
+
+def add_clock_arguments(argparser) -> None:
+    group = argparser.add_argument_group('clock')
+    group.add_argument('--clock', choices=('wall', 'virtual'), default='wall',
+                       help='wall: ns runs in real time, virtual: ns runs without the real-time scheduler '
+                            'in lock-step with the harness, as fast as possible')
+    group.add_argument('--sync-step', type=float, default=0.1,
+                       help='Virtual clock: longest simulated time between two synchronization points in [s], '
+                            'the resolution of the receive timestamps')
+    group.add_argument('--sync-settle', type=float, default=0.001,
+                       help='Virtual clock: wall time in [s] ns waits at a synchronization point for its socket '
+                            'threads to read the messages of the harness')
+
+
+def clock_from_args(args):
+    """WALL_CLOCK or a new VirtualClock, raises ValueError for options the virtual clock does not support"""
+    if args.clock == 'wall':
+        return WALL_CLOCK
+    if args.sync_step <= 0.0 or args.sync_settle < 0.0:
+        raise ValueError("The sync step must be > 0 and the settle time >= 0")
+    if args.engine != 'asyncio' or getattr(args, 'workers', 1) > 1:
+        raise ValueError("--clock virtual needs the asyncio engine in a single process")
+    if args.replay or args.journal:
+        raise ValueError("--journal and --replay are not supported with --clock virtual")
+    return VirtualClock()
+
+
+def template_substitutions(clock, sync: SyncServer = None) -> dict:
+    """TMPL_SCHEDULER and TMPL_SYNC of uwAppPos.tmpl, sync is the SyncServer of a VirtualClock"""
+    if not clock.virtual:
+        return dict(TMPL_SCHEDULER=REALTIME_SCHEDULER, TMPL_SYNC="")
+    sync_block = CustomTemplate(SYNC_BLOCK).substitute(SYNC_HOST=sync.host, SYNC_PORT=sync.port, SYNC_STEP=sync.step)
+    return dict(TMPL_SCHEDULER="# no Scheduler/RealTime: ns runs as fast as possible in lock-step with the harness",
+                TMPL_SYNC=sync_block)
@@ -0,0 +1,36 @@
+from argparse import ArgumentParser
+
+import pytest
+
+# the harness scripts start ns and open sockets, they are no test modules
+collect_ignore = ["test_sockets.py", "test_sockets_UDP.py"]
+
+
+class FakeClock(object):
+    """Clock with the time set by the test, see clock.py"""
+    virtual = False
+
+    def __init__(self) -> None:
+        self.time = 0.0
+
+    def now(self) -> float:
+        return self.time
+
+    def now_ns(self) -> int:
+        return round(self.time * 1e9)
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def parse(request):
+    """parse(*argv): parse a command line with the argument groups of ADD_ARGUMENTS of the test module"""
+    def parse(*argv):
+        argparser = ArgumentParser()
+        for add_arguments in request.module.ADD_ARGUMENTS:
+            add_arguments(argparser)
+        return argparser.parse_args(argv)
+    return parse
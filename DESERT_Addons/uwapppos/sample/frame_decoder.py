@@ -0,0 +1,110 @@
+import logging
+import socket
+
+logger = logging.getLogger(__name__)
+
+FRAME_START = 68  # 'D'
+HEADER_SIZE = 2   # start byte + payload length byte
+MAX_FRAME_SIZE = HEADER_SIZE + 255
+
+
+class FrameDecoder(object):
+    def __init__(self, capacity: int = 64 * 1024) -> None:
+        """
+        Incremental decoder for the 'D' + length byte + payload TCP stream of ns2.
+
+        Data is read with recv_into() into a preallocated buffer and complete
+        frames are returned as memoryview slices of that buffer, so no payload
+        is copied. A partial frame at the end of the buffer is moved to the front
+        once the free space gets smaller than a frame (at most 257 bytes are copied).
+        Bytes which do not start a frame are skipped until the next 'D'.
+
+        capacity: buffer size in bytes, at least one maximum size frame
+        """
+        if capacity < MAX_FRAME_SIZE:
+            raise ValueError(f"capacity must be at least {MAX_FRAME_SIZE} bytes")
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # first unprocessed byte
+        self.end = 0    # end of valid data
+        self.closed = False
+        self.frames_decoded = 0
+        self.resyncs = 0
+        self.bytes_skipped = 0
+
+    def pending(self) -> int:
+        """Number of buffered bytes not yet returned as frame"""
+        return self.end - self.start
+
+    def _compact(self) -> None:
+        if self.start == 0:
+            return
+        remaining = self.end - self.start
+        if remaining:
+            self.buffer[:remaining] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = remaining
+
+    def get_buffer(self, sizehint: int = -1) -> memoryview:
+        """Writable view of the free buffer space (asyncio.BufferedProtocol interface)"""
+        if len(self.buffer) - self.end < MAX_FRAME_SIZE or self.start == self.end:
+            self._compact()
+        return self.view[self.end:]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        """Mark nbytes written into the view returned by get_buffer() as valid"""
+        self.end += nbytes
+
+    def recv_into(self, s: socket.socket) -> int:
+        """
+        Read all bytes available on the non-blocking socket s (until EAGAIN or the
+        buffer is full) and return the number of bytes read. Sets closed if the
+        peer closed the connection.
+        """
+        total = 0
+        while True:
+            free = self.get_buffer()
+            if len(free) == 0:
+                break
+            try:
+                n = s.recv_into(free)
+            except BlockingIOError:
+                break
+            except InterruptedError:
+                continue
+            if n == 0:
+                self.closed = True
+                break
+            self.buffer_updated(n)
+            total += n
+            if n < len(free):
+                # socket drained
+                break
+        return total
+
+    def frames(self):
+        """
+        Generator returning the payload of every complete frame in the buffer as
+        memoryview. A view is only valid until the next call of recv_into() or
+        get_buffer(), convert it with bytes() to keep it.
+        """
+        buf = self.buffer
+        while self.end - self.start >= HEADER_SIZE:
+            if buf[self.start] != FRAME_START:
+                # corrupt header, skip to next frame start
+                pos = buf.find(b'D', self.start + 1, self.end)
+                if pos < 0:
+                    pos = self.end
+                self.resyncs += 1
+                self.bytes_skipped += pos - self.start
+                logger.warning(f"Frame decoder: invalid header, skipped {pos - self.start} bytes")
+                self.start = pos
+                continue
+            size = buf[self.start + 1]
+            frame_end = self.start + HEADER_SIZE + size
+            if frame_end > self.end:
+                break
+            payload = self.view[self.start + HEADER_SIZE:frame_end]
+            self.start = frame_end
+            self.frames_decoded += 1
+            yield payload
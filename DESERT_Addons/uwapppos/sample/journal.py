@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Binary traffic journal of the harness and its replay.
+
+The journal records every sent application payload, every received frame and
+every position datagram with monotonic time, node and bytes:
+
+    header  4s magic "UWJ1", uint32 version
+    record  int64 t_ns, uint8 kind, pad, uint16 node, uint32 size, size bytes
+
+little endian. Records are appended to a memory mapped file which grows in
+chunks, so recording is one memcpy per message. The mapped space after the
+last record is zero (kind 0), a journal of a crashed run is read up to there.
+
+Position records of batch datagrams (see mobility.pack_position_batches) have node 0.
+
+python3 journal.py ns_run.journal          # summary
+python3 test_sockets.py --replay ns_run.journal --replay-rate 10
+"""
+
+import collections
+import logging
+import mmap
+import socket
+import struct
+import threading
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_MAGIC = b"UWJ1"
+JOURNAL_VERSION = 1
+JOURNAL_HEADER_STRUCT = struct.Struct("<4sI")
+JOURNAL_RECORD_STRUCT = struct.Struct("<qBxHI")
+
+# record kinds, same values as the event kinds of log_pipeline
+JOURNAL_SENT = 1
+JOURNAL_RECEIVED = 2
+JOURNAL_POSITION = 3
+JOURNAL_KINDS = {JOURNAL_SENT: "sent", JOURNAL_RECEIVED: "received", JOURNAL_POSITION: "position"}
+
+
+class JournalWriter(object):
+    def __init__(self, filename: str, chunk_size: int = 1 << 24) -> None:
+        """
+        Append journal records to filename through a memory mapping which grows
+        by chunk_size [bytes] (doubling up to 256 MiB), can be called from any thread
+        """
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.records = 0
+        self._lock = threading.Lock()
+        self._file = open(filename, "w+b")
+        self._file.truncate(chunk_size)
+        self._map = mmap.mmap(self._file.fileno(), chunk_size)
+        JOURNAL_HEADER_STRUCT.pack_into(self._map, 0, JOURNAL_MAGIC, JOURNAL_VERSION)
+        self._offset = JOURNAL_HEADER_STRUCT.size
+
+    def _grow(self, end: int) -> None:
+        size = len(self._map)
+        while size < end:
+            size += min(size, 1 << 28)
+        self._map.resize(size)
+
+    def append(self, kind: int, node: int, data) -> None:
+        """Append a record, data is a bytes-like object or a list of them (e.g. the buffers of sendmsg())"""
+        t_ns = time.monotonic_ns()
+        parts = data if isinstance(data, (list, tuple)) else (data,)
+        size = sum(len(part) for part in parts)
+        with self._lock:
+            if self._map is None:
+                return
+            offset = self._offset
+            end = offset + JOURNAL_RECORD_STRUCT.size + size
+            if end > len(self._map):
+                self._grow(end)
+            JOURNAL_RECORD_STRUCT.pack_into(self._map, offset, t_ns, kind, node, size)
+            offset += JOURNAL_RECORD_STRUCT.size
+            for part in parts:
+                self._map[offset:offset + len(part)] = part
+                offset += len(part)
+            self._offset = end
+            self.records += 1
+
+    def close(self) -> None:
+        """Unmap and truncate the file to the written records"""
+        with self._lock:
+            if self._map is None:
+                return
+            self._map.flush()
+            self._map.close()
+            self._map = None
+            self._file.truncate(self._offset)
+            self._file.close()
+
+
+def read_journal(filename: str):
+    """
+    Read a journal, returns (records, payloads): records is a structured array
+    with t_ns, kind, node and size, payloads the list of record payloads (bytes)
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    if len(data) < JOURNAL_HEADER_STRUCT.size:
+        raise ValueError(f"{filename}: not a journal")
+    magic, version = JOURNAL_HEADER_STRUCT.unpack_from(data)
+    if magic != JOURNAL_MAGIC or version != JOURNAL_VERSION:
+        raise ValueError(f"{filename}: unsupported journal {magic!r} version {version}")
+    fields = []
+    payloads = []
+    offset = JOURNAL_HEADER_STRUCT.size
+    end = len(data) - JOURNAL_RECORD_STRUCT.size
+    while offset <= end:
+        t_ns, kind, node, size = JOURNAL_RECORD_STRUCT.unpack_from(data, offset)
+        offset += JOURNAL_RECORD_STRUCT.size
+        if kind == 0 or offset + size > len(data):
+            break  # unused mapped space or incomplete last record
+        fields.append((t_ns, kind, node, size))
+        payloads.append(data[offset:offset + size])
+        offset += size
+    records = np.array(fields, dtype=[("t_ns", "<i8"), ("kind", "u1"), ("node", "<u2"), ("size", "<u4")])
+    return records, payloads
+
+
+class ReplayProfile(object):
+    def __init__(self, replay: 'JournalReplay', times: list) -> None:
+        """Traffic profile sending at the recorded times [s] relative to the start of the replay"""
+        self.replay = replay
+        self.times = times
+        self.index = 0
+
+    def first(self, start: float):
+        self.index = 0
+        return self.next(None)
+
+    def next(self, deadline):
+        if self.index >= len(self.times):
+            return None
+        t = self.replay.start() + self.times[self.index]
+        self.index += 1
+        return t
+
+
+class JournalReplay(object):
+    def __init__(self, filename: str, rate: float = 1.0) -> None:
+        """
+        Replay the sent payloads and position datagrams of a journal with the
+        recorded inter-arrival times, divided by rate.
+
+        The node drivers get the replay instead of a LatencyTracker: next_payload()
+        returns the next recorded payload of a node, so the payloads are sent as
+        recorded, and the scheduler sends them at the times of the profiles.
+        The replay starts when the first node is scheduled (its connection is up)
+        at the time of the first recorded message, earlier position datagrams are
+        sent at the start.
+        """
+        if rate <= 0.0:
+            raise ValueError("The replay rate must be > 0")
+        self.filename = filename
+        self.rate = rate
+        records, payloads = read_journal(filename)
+        self.records = records
+        sent = records["t_ns"][records["kind"] == JOURNAL_SENT]
+        t0 = sent.min() if len(sent) else (records["t_ns"].min() if len(records) else 0)
+        self._times = collections.defaultdict(list)
+        self._payloads = collections.defaultdict(collections.deque)
+        self.positions = []
+        for (t_ns, kind, node, _), payload in zip(records.tolist(), payloads):
+            t = max(0.0, (t_ns - t0) * 1e-9 / rate)
+            if kind == JOURNAL_SENT:
+                self._times[node].append(t)
+                self._payloads[node].append(payload)
+            elif kind == JOURNAL_POSITION:
+                self.positions.append((t, node, payload))
+        self.sent = collections.Counter()
+        self._start = None
+        self._on_start = []
+        self._lock = threading.Lock()
+
+    def start(self) -> float:
+        """Start of the replay on the time.monotonic() clock, set by the first caller"""
+        with self._lock:
+            if self._start is not None:
+                return self._start
+            self._start = time.monotonic()
+            callbacks, self._on_start = self._on_start, []
+        for callback in callbacks:
+            callback()
+        return self._start
+
+    def when_started(self, callback) -> None:
+        """Call callback() on the start of the replay, immediately if it is already running"""
+        with self._lock:
+            if self._start is None:
+                self._on_start.append(callback)
+                return
+        callback()
+
+    def senders(self) -> list:
+        return sorted(self._times)
+
+    def profile(self, node_id: int):
+        """Traffic profile of node_id, None if it did not send in the journal"""
+        times = self._times.get(node_id)
+        return ReplayProfile(self, times) if times else None
+
+    def next_payload(self, src: int, text: bytes = b"") -> bytes:
+        with self._lock:
+            payloads = self._payloads.get(src)
+            if not payloads:
+                return text
+            self.sent[src] += 1
+            return payloads.popleft()
+
+    def next_message(self, src: int, text: bytes = b"") -> list:
+        return [self.next_payload(src, text)]
+
+    def discard(self, src: int, count: int = 1) -> None:
+        with self._lock:
+            self.sent[src] -= count
+
+    def on_receive(self, dst: int, data):
+        """No latency measurement on replay, the recorded payloads carry the times of the recording"""
+        return None
+
+    def print_summary(self) -> None:
+        total = sum(len(times) for times in self._times.values())
+        print(f"Replay: {sum(self.sent.values())} of {total} messages of {len(self._times)} node(s) and "
+              f"{len(self.positions)} position datagrams from {self.filename} at rate {self.rate:g}")
+
+
+class PositionReplay(threading.Thread):
+    def __init__(self, replay: JournalReplay, host: str, port_base: int, batch_port: int = 0) -> None:
+        """
+        Send the recorded position datagrams at the recorded times, instead of
+        the PosWorker. Batch datagrams (node 0) are sent to batch_port, the
+        others to port_base + node_id.
+        """
+        super().__init__(name="PositionReplay")
+        self.replay = replay
+        self.host = host
+        self.port_base = port_base
+        self.batch_port = batch_port
+        self.should_stop = threading.Event()
+        self.updates_sent = 0
+        self.updates_dropped = 0
+        self._wakeup = threading.Event()
+
+    def stop(self):
+        """stop the thread."""
+        self.should_stop.set()
+        self._wakeup.set()
+
+    def run(self):
+        if not self.replay.senders():
+            # only positions recorded, nothing else starts the replay
+            self.replay.start()
+        self.replay.when_started(self._wakeup.set)
+        self._wakeup.wait()
+        start = self.replay.start()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.setblocking(False)
+            for t, node_id, data in self.replay.positions:
+                if self.should_stop.wait(max(0.0, start + t - time.monotonic())):
+                    break
+                if node_id == 0 and not self.batch_port:
+                    self.updates_dropped += 1
+                    continue
+                address = (self.host, self.batch_port if node_id == 0 else self.port_base + node_id)
+                try:
+                    s.sendto(data, address)
+                    self.updates_sent += 1
+                except (BlockingIOError, ConnectionRefusedError):
+                    self.updates_dropped += 1
+        logger.info(f"Position replay stopped after {self.updates_sent} datagrams ({self.updates_dropped} dropped)")
+
+    def print_summary(self) -> None:
+        print(f"Position: {self.updates_sent} recorded datagrams replayed, {self.updates_dropped} dropped")
+
+
+def add_replay_arguments(argparser) -> None:
+    group = argparser.add_argument_group('replay')
+    group.add_argument('--replay', default=None,
+                       help='Replay the sent messages and position updates of a journal (see --journal) '
+                            'instead of the traffic profile and mobility model')
+    group.add_argument('--replay-rate', type=float, default=1.0,
+                       help='Replay speed, 1.0 keeps the recorded inter-arrival times')
+
+
+def replay_from_args(args):
+    return JournalReplay(args.replay, args.replay_rate) if args.replay else None
+
+
+def main():
+    argparser = ArgumentParser(description='Print a summary of a traffic journal')
+    argparser.add_argument('journal', help='Journal file written with --journal')
+    args = argparser.parse_args()
+    records, _ = read_journal(args.journal)
+    if len(records) == 0:
+        print(f"{args.journal}: no records")
+        return
+    duration = (records["t_ns"].max() - records["t_ns"].min()) * 1e-9
+    print(f"{args.journal}: {len(records)} records in {duration:.1f} s")
+    for kind, name in JOURNAL_KINDS.items():
+        selected = records[records["kind"] == kind]
+        if len(selected):
+            print(f"  {name}: {len(selected)} records, {int(selected['size'].sum())} bytes, "
+                  f"nodes {sorted(set(selected['node'].tolist()))}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+import json
+import logging
+import threading
+
+from clock import WALL_CLOCK
+
+logger = logging.getLogger(__name__)
+
+# Measurement payload: b"UWP1 <src> <seq> <send time [ns]> " + text, numbers in hex.
+# The payload is plain ASCII because ns2 handles application payloads as C strings.
+PAYLOAD_MAGIC = b"UWP1"
+
+# log-linear histogram buckets: values below 2**(SUB_BITS + 1) are exact, above each
+# power of two is split into 2**SUB_BITS buckets (relative error < 1.6 %)
+SUB_BITS = 6
+SUB_COUNT = 1 << SUB_BITS
+LINEAR_COUNT = 2 * SUB_COUNT
+NUM_BUCKETS = LINEAR_COUNT + 64 * SUB_COUNT
+
+# sequence numbers of a flow checked for duplicates, below the highest one received
+SEQ_WINDOW = 1 << 16
+
+
+def encode_header(src: int, seq: int, t_ns: int) -> bytes:
+    return b"%s %x %x %x " % (PAYLOAD_MAGIC, src, seq, t_ns)
+
+
+def encode_payload(src: int, seq: int, t_ns: int, text: bytes = b"") -> bytes:
+    return encode_header(src, seq, t_ns) + text
+
+
+def decode_payload(data):
+    """Return (src, seq, send time [ns], text) of a measurement payload or None for other payloads"""
+    data = bytes(data)
+    if not data.startswith(PAYLOAD_MAGIC):
+        return None
+    try:
+        _, src, seq, t_ns, text = data.split(b" ", 4)
+        return int(src, 16), int(seq, 16), int(t_ns, 16), text
+    except ValueError:
+        return None
+
+
+def format_delay(delay) -> str:
+    """Format a delay in [s] for log messages"""
+    return "unknown" if delay is None else f"{delay * 1e3:.1f} ms"
+
+
+def bucket_index(value: int) -> int:
+    if value < LINEAR_COUNT:
+        return max(0, value)
+    shift = value.bit_length() - (SUB_BITS + 1)
+    return LINEAR_COUNT + (shift - 1) * SUB_COUNT + (value >> shift) - SUB_COUNT
+
+
+def bucket_value(index: int) -> int:
+    """Highest value counted in the bucket"""
+    if index < LINEAR_COUNT:
+        return index
+    shift = (index - LINEAR_COUNT) // SUB_COUNT + 1
+    m = (index - LINEAR_COUNT) % SUB_COUNT + SUB_COUNT
+    return ((m + 1) << shift) - 1
+
+
+class LatencyHistogram(object):
+    def __init__(self) -> None:
+        """HDR-style histogram of integer values (latencies in [us])"""
+        self.counts = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value: int) -> None:
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        for i, c in enumerate(other.counts):
+            if c:
+                self.counts[i] += c
+        self.count += other.count
+        self.total += other.total
+        for v in (other.min, other.max):
+            if v is not None:
+                self.min = v if self.min is None else min(self.min, v)
+                self.max = v if self.max is None else max(self.max, v)
+
+    def percentile(self, p: float) -> int:
+        if self.count == 0:
+            return 0
+        rank = max(1, int(round(p / 100.0 * self.count)))
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min(bucket_value(i), self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "min_us": self.min,
+            "mean_us": self.total / self.count if self.count else None,
+            "p50_us": self.percentile(50),
+            "p90_us": self.percentile(90),
+            "p99_us": self.percentile(99),
+            "p999_us": self.percentile(99.9),
+            "max_us": self.max,
+        }
+
+
+class FlowStats(object):
+    def __init__(self) -> None:
+        """Receive statistics of one flow (sender -> receiver)"""
+        self.histogram = LatencyHistogram()
+        self.received = 0
+        self.received_bytes = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.highest_seq = -1
+        # bitmap of the received sequence numbers from _base on, at most SEQ_WINDOW bits
+        self._seen = bytearray()
+        self._base = 0
+
+    def update(self, seq: int, latency_us: int) -> bool:
+        """
+        Returns False for duplicates. Sequence numbers older than SEQ_WINDOW
+        below the highest one are counted as reordered, not checked for duplicates.
+        """
+        byte, bit = divmod(seq - self._base, 8)
+        if byte >= SEQ_WINDOW // 8:
+            # slide the window so that seq is its last sequence number
+            shift = byte - SEQ_WINDOW // 8 + 1
+            del self._seen[:shift]
+            self._base += 8 * shift
+            byte -= shift
+        if byte < 0:
+            duplicate = False
+        else:
+            if byte >= len(self._seen):
+                self._seen.extend(bytes(min(max(byte + 1 - len(self._seen), len(self._seen)),
+                                            SEQ_WINDOW // 8 - len(self._seen))))
+            duplicate = self._seen[byte] & (1 << bit)
+        if duplicate:
+            self.duplicates += 1
+            return False
+        if byte >= 0:
+            self._seen[byte] |= 1 << bit
+        self.received += 1
+        if seq < self.highest_seq:
+            self.reordered += 1
+        else:
+            self.highest_seq = seq
+        self.histogram.record(latency_us)
+        return True
+
+
+class LatencyTracker(object):
+    def __init__(self, clock=WALL_CLOCK) -> None:
+        """
+        Creates measurement payloads (sender id, sequence number, monotonic send
+        time) and evaluates them at the receivers: per flow latency histogram,
+        loss, duplicates and reordering. The send and receive times are taken
+        from clock (see clock.py).
+        """
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.sent = {}
+        self.discarded = {}
+        self.flows = {}
+        self.unknown = 0
+        # first send and last receive time of a measurement payload in [ns]
+        self.first_sent_ns = None
+        self.last_received_ns = None
+
+    def next_payload(self, src: int, text: bytes = b"") -> bytes:
+        t_ns = self.clock.now_ns()
+        with self._lock:
+            seq = self.sent.get(src, 0)
+            self.sent[src] = seq + 1
+            if self.first_sent_ns is None:
+                self.first_sent_ns = t_ns
+        return encode_payload(src, seq, t_ns, text)
+
+    def next_message(self, src: int, text: bytes = b"") -> list:
+        """Measurement header and text as separate buffers of one message, for vectored sends"""
+        t_ns = self.clock.now_ns()
+        with self._lock:
+            seq = self.sent.get(src, 0)
+            self.sent[src] = seq + 1
+            if self.first_sent_ns is None:
+                self.first_sent_ns = t_ns
+        return [encode_header(src, seq, t_ns), text]
+
+    def discard(self, src: int, count: int = 1) -> None:
+        """count messages of src were dropped by the harness before reaching ns, they are not counted as sent"""
+        with self._lock:
+            self.discarded[src] = self.discarded.get(src, 0) + count
+
+    def on_receive(self, dst: int, data):
+        """Evaluate a received payload, returns the latency in [s] or None if it is no measurement payload"""
+        now = self.clock.now_ns()
+        decoded = decode_payload(data)
+        if decoded is None:
+            with self._lock:
+                self.unknown += 1
+            return None
+        src, seq, t_ns, _ = decoded
+        latency_us = max(0, (now - t_ns) // 1000)
+        with self._lock:
+            flow = self.flows.get((src, dst))
+            if flow is None:
+                flow = self.flows[(src, dst)] = FlowStats()
+            if flow.update(seq, latency_us):
+                flow.received_bytes += len(data)
+                self.last_received_ns = now
+        return latency_us / 1e6
+
+    def summary(self) -> dict:
+        """
+        The flows are every sender with every node which received any message,
+        flows without a received message have received 0
+        """
+        with self._lock:
+            flows = []
+            total = LatencyHistogram()
+            receivers = sorted({dst for _, dst in self.flows})
+            for src in sorted(self.sent):
+                for dst in receivers:
+                    if dst == src:
+                        continue
+                    flow = self.flows.get((src, dst))
+                    if flow is None:
+                        flow = FlowStats()
+                    sent = self.sent[src] - self.discarded.get(src, 0)
+                    flows.append({
+                        "src": src,
+                        "dst": dst,
+                        "sent": sent,
+                        "received": flow.received,
+                        "received_bytes": flow.received_bytes,
+                        "lost": max(0, sent - flow.received),
+                        "delivery_ratio": flow.received / sent if sent else None,
+                        "duplicates": flow.duplicates,
+                        "reordered": flow.reordered,
+                        "latency": flow.histogram.to_dict(),
+                    })
+                    total.merge(flow.histogram)
+            duration = None
+            if self.first_sent_ns is not None and self.last_received_ns is not None:
+                # from the first sent to the last received message
+                duration = (self.last_received_ns - self.first_sent_ns) / 1e9
+            return {
+                "sent": sum(self.sent.values()) - sum(self.discarded.values()),
+                "discarded": sum(self.discarded.values()),
+                "received": sum(f["received"] for f in flows),
+                "received_bytes": sum(f["received_bytes"] for f in flows),
+                "duration_s": duration,
+                "unknown_payloads": self.unknown,
+                "latency": total.to_dict(),
+                "flows": flows,
+            }
+
+    def export_json(self, filename: str) -> None:
+        with open(filename, "wt") as f:
+            json.dump(self.summary(), f, indent=2)
+        logger.info(f"Latency statistics written to {filename}")
+
+    def print_summary(self) -> None:
+        s = self.summary()
+        print(f"Messages sent: {s['sent']}, received: {s['received']}, other payloads: {s['unknown_payloads']}"
+              + (f", discarded by the harness: {s['discarded']}" if s["discarded"] else ""))
+        for f in s["flows"]:
+            lat = f["latency"]
+            ratio = f"{100.0 * f['delivery_ratio']:.1f} %" if f["delivery_ratio"] is not None else "-"
+            line = (f"  {f['src']:>4} -> {f['dst']:<4} sent {f['sent']:>6} received {f['received']:>6} ({ratio}), "
+                    f"lost {f['lost']}, dup {f['duplicates']}, reordered {f['reordered']}")
+            if lat["count"]:
+                line += (f", latency p50 {lat['p50_us'] / 1e3:.1f} ms p99 {lat['p99_us'] / 1e3:.1f} ms "
+                         f"max {lat['max_us'] / 1e3:.1f} ms")
+            print(line)
+
+
+def add_latency_arguments(argparser) -> None:
+    group = argparser.add_argument_group('latency measurement')
+    group.add_argument('-l', '--measure-latency', action='store_true',
+                       help='Send measurement payloads (sender id, sequence number, send time) and evaluate latency and loss')
+    group.add_argument('--stats-json', default=None, help='Export the latency statistics to the given JSON file')
+
+
+def tracker_from_args(args, clock=WALL_CLOCK):
+    return LatencyTracker(clock) if args.measure_latency or args.stats_json else None
+
+
+def report(tracker, args) -> None:
+    """Print the summary and export it if requested"""
+    if tracker is None:
+        return
+    tracker.print_summary()
+    if args.stats_json:
+        tracker.export_json(args.stats_json)
@@ -0,0 +1,175 @@
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from clock import WALL_CLOCK, ClockEvent
+from process_utils import get_child_process_by_name
+
+logger = logging.getLogger(__name__)
+
+# the templates halt ns 10 s after opt(stop) and print the summary then
+NS_HALT_DELAY = 10.0
+
+# time ns gets to exit after the halt delay or after SIGTERM
+NS_EXIT_GRACE = 5.0
+
+
+class Lifecycle(object):
+    def __init__(self) -> None:
+        """
+        Shutdown of the harness: ns exit, the run time watchdog, SIGINT/SIGTERM
+        or any thread call request_stop(), which stops every worker registered
+        with add() at once. Workers block on wait() / the stopping event, or
+        include the lifecycle in their select set: fileno() becomes readable on
+        stop and stays readable, so no worker polls a flag with a timeout.
+        """
+        self.stopping = ClockEvent()
+        self.reason = None
+        self.stop_time = None
+        self._workers = []
+        self._lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_w, False)
+        self._signal_handlers = {}
+
+    def fileno(self) -> int:
+        return self._wakeup_r
+
+    def add(self, worker):
+        """Call worker.stop() on shutdown, immediately if the shutdown is already running"""
+        with self._lock:
+            if not self.stopping.is_set():
+                self._workers.append(worker)
+                return worker
+        self._stop_worker(worker)
+        return worker
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait up to timeout [s] for the shutdown, True if it has been requested"""
+        return self.stopping.wait(timeout)
+
+    def _stop_worker(self, worker) -> None:
+        try:
+            worker.stop()
+        except Exception as e:
+            logger.error(f"Error stopping {worker}: {e}", exc_info=True)
+
+    def request_stop(self, reason: str) -> None:
+        """Stop all workers, can be called from any thread and from signal handlers, only the first call counts"""
+        with self._lock:
+            if self.stopping.is_set():
+                return
+            self.reason = reason
+            self.stop_time = time.monotonic()
+            self.stopping.set()
+            workers = self._workers[:]
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except OSError:
+            pass
+        logger.info(f"Stopping all workers: {reason}")
+        for worker in workers:
+            self._stop_worker(worker)
+
+    def _on_signal(self, signum, frame) -> None:
+        if self.stopping.is_set() and signum == signal.SIGINT:
+            # second Ctrl-C
+            raise KeyboardInterrupt
+        # the handler runs in the main thread, stop the workers from another
+        # thread so the lock is never taken by the interrupted main thread
+        threading.Thread(target=self.request_stop, args=(signal.Signals(signum).name,), name="Lifecycle").start()
+
+    def install_signal_handlers(self, signums=(signal.SIGINT, signal.SIGTERM)) -> None:
+        """Shut down on the given signals instead of raising KeyboardInterrupt, main thread only"""
+        for signum in signums:
+            self._signal_handlers[signum] = signal.signal(signum, self._on_signal)
+
+    def watch_process(self, proc: subprocess.Popen, reason: str = "ns exited") -> threading.Thread:
+        """Request the shutdown as soon as proc exits"""
+        def watch():
+            returncode = proc.wait()
+            self.request_stop(f"{reason} with code {returncode}")
+
+        t = threading.Thread(target=watch, name="ProcessWatch", daemon=True)
+        t.start()
+        return t
+
+    def supervise(self, run_time: float, on_run_time=None, proc: subprocess.Popen = None, start: float = None,
+                  process_name: str = "ns", clock=WALL_CLOCK) -> None:
+        """
+        Block until the shutdown. on_run_time() is called when the run time [s]
+        since start (on clock, default now) is over, to stop the traffic
+        while ns still delivers the messages in flight. Without proc the shutdown
+        follows NS_HALT_DELAY later, otherwise with the exit of proc, and ns is
+        stopped by SIGTERM when it does not halt in time.
+        """
+        start = clock.now() if start is None else start
+        if not clock.wait_until(start + run_time, self.stopping):
+            logger.info("Run time is over, stopping traffic")
+            if on_run_time is not None:
+                on_run_time()
+        if proc is None:
+            if not self.wait(NS_HALT_DELAY):
+                self.request_stop("run time is over")
+            return
+        if clock.virtual:
+            # ns runs the halt delay of simulation time as fast as it can
+            deadline = time.monotonic() + NS_HALT_DELAY + NS_EXIT_GRACE
+        else:
+            # former watchdog of the scripts: double of the run time, at least the halt delay of the templates
+            deadline = start + max(2 * run_time, run_time + NS_HALT_DELAY + NS_EXIT_GRACE)
+        if self.wait(max(0.0, deadline - time.monotonic())):
+            return
+        logger.warning(f"{process_name} did not halt in time, stopping it")
+        stop_process(proc, process_name, timeout=0.0)
+        if not self.wait(NS_EXIT_GRACE):
+            self.request_stop(f"{process_name} does not exit")
+
+    def join(self, threads: list, timeout: float = 5.0) -> list:
+        """Join the threads within timeout [s] in total and return those still alive"""
+        deadline = time.monotonic() + timeout
+        for t in threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        alive = [t for t in threads if t.is_alive()]
+        for t in alive:
+            logger.warning(f"Thread {t.name} did not stop within {timeout} s")
+        if self.stop_time is not None:
+            logger.info(f"Workers stopped {1e3 * (time.monotonic() - self.stop_time):.1f} ms after the shutdown request")
+        return alive
+
+    def close(self) -> None:
+        for signum, handler in self._signal_handlers.items():
+            signal.signal(signum, handler)
+        self._signal_handlers = {}
+        for fd in (self._wakeup_r, self._wakeup_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def stop_process(proc: subprocess.Popen, process_name: str = "ns", timeout: float = 2.0) -> None:
+    """
+    SIGTERM the process_name child of proc (ns started through run.sh) and proc
+    itself, SIGKILL proc after timeout [s], 0 to not wait
+    """
+    if proc.poll() is not None:
+        return
+    child = get_child_process_by_name(proc.pid, process_name)
+    if child is not None and child.pid != proc.pid:
+        try:
+            os.kill(child.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    proc.terminate()
+    if timeout <= 0.0:
+        return
+    try:
+        proc.wait(timeout)
+    except subprocess.TimeoutExpired:
+        logger.warning(f"{process_name} did not exit {timeout} s after SIGTERM, killing it")
+        proc.kill()
+        proc.wait()
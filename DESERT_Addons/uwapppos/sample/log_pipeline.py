@@ -0,0 +1,224 @@
+import atexit
+import collections
+import logging
+import logging.handlers
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+from journal import JOURNAL_POSITION, JOURNAL_RECEIVED, JOURNAL_SENT, JournalWriter
+from latency import format_delay
+
+logger = logging.getLogger(__name__)
+
+# per message event kinds
+EVENT_SENT = 1
+EVENT_RECEIVED = 2
+
+# binary event record: monotonic time [ns], event kind, node id, peer node id (0 if unknown), payload size
+EVENT_STRUCT = struct.Struct("<qBxHHI")
+EVENT_DTYPE = np.dtype([("t_ns", "<i8"), ("kind", "u1"), ("pad", "u1"), ("node", "<u2"), ("peer", "<u2"),
+                        ("size", "<u4")])
+
+
+class LazyText(object):
+    """Decode a payload only when the log record is formatted"""
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+    def __str__(self) -> str:
+        return str(self.data, encoding="utf-8", errors="replace")
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler which leaves the formatting of the message to the listener thread"""
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class EventSampler(object):
+    def __init__(self, every: int = 1, rate: float = 0.0) -> None:
+        """
+        Decide which per message events are logged: every n-th event of a kind
+        and at most rate events per second of a kind (token bucket), 0 for no limit
+        """
+        self.every = max(1, every)
+        self.rate = rate
+        self.counts = collections.Counter()
+        self.suppressed = 0
+        self._tokens = {}
+        self._last = {}
+
+    def allow(self, kind: int) -> bool:
+        n = self.counts[kind]
+        self.counts[kind] = n + 1
+        if n % self.every:
+            self.suppressed += 1
+            return False
+        if self.rate > 0.0:
+            now = time.monotonic()
+            # bucket of one second of events, but at least one so that rates below 1/s let events through
+            capacity = max(1.0, self.rate)
+            tokens = min(capacity, self._tokens.get(kind, capacity) + (now - self._last.get(kind, now)) * self.rate)
+            self._last[kind] = now
+            if tokens < 1.0:
+                self._tokens[kind] = tokens
+                self.suppressed += 1
+                return False
+            self._tokens[kind] = tokens - 1.0
+        return True
+
+
+class EventRecorder(threading.Thread):
+    def __init__(self, filename: str, flush_interval: float = 0.5) -> None:
+        """
+        Write per message events as EVENT_STRUCT records instead of log lines.
+        Events are queued by the node threads and packed and written by this thread.
+        """
+        super().__init__(name="EventRecorder", daemon=True)
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.records = 0
+        self._pending = collections.deque()
+        self._stop_event = threading.Event()
+        self._file = open(filename, "wb")
+
+    def record(self, kind: int, node: int, peer: int, size: int) -> None:
+        self._pending.append((time.monotonic_ns(), kind, node, peer, size))
+
+    def _flush(self) -> None:
+        n = len(self._pending)
+        if n == 0:
+            return
+        buf = bytearray(n * EVENT_STRUCT.size)
+        for i in range(n):
+            EVENT_STRUCT.pack_into(buf, i * EVENT_STRUCT.size, *self._pending.popleft())
+        self._file.write(buf)
+        self.records += n
+
+    def stop(self):
+        """stop the thread."""
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self._flush()
+        self._flush()
+        self._file.close()
+
+
+def read_events(filename: str) -> np.ndarray:
+    """Read an event log written by EventRecorder as structured array with the fields of EVENT_DTYPE"""
+    return np.fromfile(filename, dtype=EVENT_DTYPE)
+
+
+class MessageEvents(object):
+    def __init__(self) -> None:
+        """Per message events of all nodes: sampled log lines or binary event records, and the traffic journal"""
+        self.sampler = EventSampler()
+        self.recorder = None
+        self.journal = None
+
+    def sent(self, node_id: int, payload, peer: int = 0) -> None:
+        """payload may be a list of buffers (header and payload of a vectored send)"""
+        if self.journal is not None:
+            self.journal.append(JOURNAL_SENT, node_id, payload)
+        if self.recorder is not None:
+            size = sum(len(part) for part in payload) if isinstance(payload, list) else len(payload)
+            self.recorder.record(EVENT_SENT, node_id, peer, size)
+        elif logger.isEnabledFor(logging.INFO) and self.sampler.allow(EVENT_SENT):
+            text = b"".join(payload) if isinstance(payload, list) else bytes(payload)
+            logger.info("Node %d sent message '%s'", node_id, LazyText(text))
+
+    def received(self, node_id: int, data, delay=None, peer: int = 0) -> None:
+        """data may be a memoryview only valid during the call, it is copied if logged"""
+        if self.journal is not None:
+            self.journal.append(JOURNAL_RECEIVED, node_id, data)
+        if self.recorder is not None:
+            self.recorder.record(EVENT_RECEIVED, node_id, peer, len(data))
+        elif logger.isEnabledFor(logging.INFO) and self.sampler.allow(EVENT_RECEIVED):
+            logger.info("Node %d received message (delay: %s): %s", node_id, format_delay(delay), LazyText(bytes(data)))
+
+    def position(self, node_id: int, data) -> None:
+        """Position datagram sent to node_id (0 for a batch), data may be a list of buffers"""
+        if self.journal is not None:
+            self.journal.append(JOURNAL_POSITION, node_id, data)
+
+
+# used by the node drivers for every sent and received message
+events = MessageEvents()
+
+_listener = None
+_queue_handler = None
+
+
+def add_logging_arguments(argparser) -> None:
+    group = argparser.add_argument_group('logging')
+    group.add_argument('--log-mode', choices=('queue', 'direct'), default='queue',
+                       help='queue: log records are formatted and written by a background thread, '
+                            'direct: by the logging thread')
+    group.add_argument('--log-every', type=int, default=1, help='Log only every n-th sent/received message')
+    group.add_argument('--log-rate', type=float, default=0.0,
+                       help='Log at most the given number of sent/received messages per second, 0 for no limit')
+    group.add_argument('--event-log', default=None,
+                       help='Write the sent/received messages as binary event records to the given file '
+                            'instead of log lines, see log_pipeline.read_events()')
+    group.add_argument('--journal', default=None,
+                       help='Record the sent and received messages and position updates with their bytes to the '
+                            'given file, replay it with --replay, see journal.py')
+
+
+def setup_logging(args) -> None:
+    """Configure the message events and move the handlers of the root logger behind a queue"""
+    global _listener, _queue_handler
+    events.sampler = EventSampler(args.log_every, args.log_rate)
+    if args.event_log:
+        events.recorder = EventRecorder(args.event_log)
+        events.recorder.start()
+    if args.journal:
+        events.journal = JournalWriter(args.journal)
+    if args.log_mode == 'queue':
+        root = logging.getLogger()
+        handlers = root.handlers[:]
+        for handler in handlers:
+            root.removeHandler(handler)
+        log_queue = queue.SimpleQueue()
+        _queue_handler = LazyQueueHandler(log_queue)
+        root.addHandler(_queue_handler)
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Write the pending log records and events, later records are written directly"""
+    global _listener, _queue_handler
+    if events.recorder is not None:
+        events.recorder.stop()
+        events.recorder.join()
+        logger.info(f"Wrote {events.recorder.records} events to {events.recorder.filename}")
+        events.recorder = None
+    if events.journal is not None:
+        events.journal.close()
+        logger.info(f"Wrote {events.journal.records} journal records to {events.journal.filename}")
+        events.journal = None
+    if events.sampler.suppressed:
+        logger.info(f"{events.sampler.suppressed} message log lines suppressed by sampling")
+        events.sampler.suppressed = 0
+    if _listener is not None:
+        root = logging.getLogger()
+        root.removeHandler(_queue_handler)
+        _listener.stop()
+        for handler in _listener.handlers:
+            root.addHandler(handler)
+        _listener = None
+        _queue_handler = None
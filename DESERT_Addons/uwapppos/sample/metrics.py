@@ -0,0 +1,310 @@
+"""
+Live metrics of a running harness session.
+
+The workers keep plain counters which only their own thread writes (node
+driver, outbound queues, position worker, OutputPump, shared memory of the
+shards). Metrics reads them when it is scraped, without locks and without
+slowing down the workers, and serves them in the Prometheus text format on a
+local HTTP endpoint (--metrics-port, e.g. curl http://127.0.0.1:9100/metrics)
+and/or draws a compact terminal dashboard (--dashboard).
+"""
+
+import fcntl
+import logging
+import sys
+import termios
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PREFIX = "uwapppos_"
+
+# unsent bytes in the kernel send queue and unread bytes in the receive queue of a socket (Linux)
+SIOCOUTQ = termios.TIOCOUTQ
+SIOCINQ = termios.FIONREAD
+
+
+def _socket_queue(sock, request: int):
+    """Bytes in a kernel socket queue, None if the socket is closed"""
+    try:
+        return int.from_bytes(fcntl.ioctl(sock.fileno(), request, b"\0\0\0\0"), sys.byteorder)
+    except (OSError, ValueError):
+        return None
+
+
+class Metrics(object):
+    def __init__(self) -> None:
+        """
+        Registry of the metric sources of a session, the watch_*() methods can
+        be called while the endpoint is already served
+        """
+        self.start = time.monotonic()
+        self.driver = None
+        self.queues = None
+        self.startup = None
+        self.pos_worker = None
+        self.pump = None
+        self.scheduler = None
+        self.pool = None
+
+    def watch_driver(self, driver) -> None:
+        """AsyncNodeDriver: per node messages, bytes, socket queues and the event loop lag"""
+        self.driver = driver
+
+    def watch_queues(self, queues) -> None:
+        """OutboundQueues (node id -> queue) of the threads engine, the driver ones are watched with it"""
+        self.queues = queues
+
+    def watch_startup(self, startup) -> None:
+        self.startup = startup
+
+    def watch_pos_worker(self, pos_worker) -> None:
+        self.pos_worker = pos_worker
+
+    def watch_pump(self, pump) -> None:
+        self.pump = pump
+
+    def watch_scheduler(self, scheduler) -> None:
+        self.scheduler = scheduler
+
+    def watch_pool(self, pool) -> None:
+        """ShardPool: per node messages from the shared memory of the shards"""
+        self.pool = pool
+
+    def _node_families(self):
+        """(name, type, help, [(node id, value)]) of the per node metrics"""
+        sent, received, bytes_sent, bytes_received, connected, send_queue, receive_queue = ([] for _ in range(7))
+        if self.driver is not None:
+            for node in list(self.driver.nodes.values()):
+                sent.append((node.node_id, node.sent))
+                received.append((node.node_id, node.received))
+                bytes_sent.append((node.node_id, node.bytes_sent))
+                bytes_received.append((node.node_id, node.bytes_received))
+                connected.append((node.node_id, int(node.connected)))
+                if node.connected and node.transport is not None:
+                    for samples, request in ((send_queue, SIOCOUTQ), (receive_queue, SIOCINQ)):
+                        value = _socket_queue(node.transport, request)
+                        if value is not None:
+                            samples.append((node.node_id, value))
+        elif self.pool is not None:
+            nodes = self.pool.stats.nodes
+            for node_id in self.pool.node_ids:
+                sent.append((node_id, int(nodes["sent"][node_id])))
+                received.append((node_id, int(nodes["received"][node_id])))
+                connected.append((node_id, int(nodes["ready_ns"][node_id] > 0 and not nodes["failed"][node_id])))
+        yield "messages_sent_total", "counter", "Messages sent to ns", sent
+        yield "messages_received_total", "counter", "Messages received from ns", received
+        yield "bytes_sent_total", "counter", "Payload bytes sent to ns", bytes_sent
+        yield "bytes_received_total", "counter", "Payload bytes received from ns", bytes_received
+        yield "node_connected", "gauge", "1 while the application socket of the node is open", connected
+        yield "socket_send_queue_bytes", "gauge", "Unsent bytes in the kernel send queue", send_queue
+        yield "socket_receive_queue_bytes", "gauge", "Unread bytes in the kernel receive queue", receive_queue
+
+        if self.pool is not None:
+            # the shards publish their queue statistics at the end of the run
+            nodes = self.pool.stats.nodes
+            stats = [(node_id, {"depth": 0, "max_depth": int(nodes["queue_max_depth"][node_id]),
+                                "partial_writes": int(nodes["queue_partial_writes"][node_id]),
+                                "stalls": int(nodes["queue_stalls"][node_id]),
+                                "dropped": int(nodes["queue_dropped"][node_id]),
+                                "rejected": int(nodes["queue_rejected"][node_id])})
+                     for node_id in self.pool.node_ids] if self.pool.protocol == "tcp" else []
+        else:
+            queues = self.driver.queues() if self.driver is not None else dict(self.queues or {})
+            stats = [(node_id, queue.stats()) for node_id, queue in list(queues.items())]
+        yield "queue_depth_bytes", "gauge", "Bytes in the outbound queue", [(n, s["depth"]) for n, s in stats]
+        yield "queue_max_depth_bytes", "gauge", "Maximum bytes in the outbound queue", \
+            [(n, s["max_depth"]) for n, s in stats]
+        yield "partial_sends_total", "counter", "Partial writes of the outbound queue", \
+            [(n, s["partial_writes"]) for n, s in stats]
+        yield "queue_stalls_total", "counter", "Sends held back by a full outbound queue", \
+            [(n, s["stalls"]) for n, s in stats]
+        yield "queue_dropped_total", "counter", "Messages dropped or rejected by a full outbound queue", \
+            [(n, s["dropped"] + s["rejected"]) for n, s in stats]
+
+        retries = []
+        if self.startup is not None:
+            retries = [(node_id, max(0, attempts - 1)) for node_id, attempts in list(self.startup.attempts.items())]
+        yield "connect_retries_total", "counter", "Repeated connection attempts of the startup", retries
+
+    def _families(self):
+        """(name, type, help, samples) of all metrics, samples are (labels, value)"""
+        for name, kind, help_text, samples in self._node_families():
+            yield name, kind, help_text, [({"node": str(node_id)}, value) for node_id, value in samples]
+        yield "uptime_seconds", "gauge", "Time since the start of the session", [({}, time.monotonic() - self.start)]
+        if self.pos_worker is not None:
+            sent, dropped = self.pos_worker.updates_sent, self.pos_worker.updates_dropped
+            suppressed = getattr(self.pos_worker, "updates_suppressed", 0)
+        elif self.pool is not None:
+            workers = self.pool.stats.workers
+            sent, dropped = int(workers["position_sent"].sum()), int(workers["position_dropped"].sum())
+            suppressed = int(workers["position_suppressed"].sum())
+        if self.pos_worker is not None or self.pool is not None:
+            yield "position_updates_sent_total", "counter", "Position updates sent to ns", [({}, sent)]
+            yield "position_updates_dropped_total", "counter", "Position updates dropped on a full socket", \
+                [({}, dropped)]
+            yield "position_updates_suppressed_total", "counter", "Position updates suppressed by dead reckoning", \
+                [({}, suppressed)]
+        if self.pump is not None:
+            yield "ns_output_lines_total", "counter", "Lines printed by ns on stdout", [({}, self.pump.lines_out)]
+            yield "ns_output_bytes_total", "counter", "Bytes printed by ns on stdout and stderr", \
+                [({"stream": "stdout"}, self.pump.bytes_out), ({"stream": "stderr"}, self.pump.bytes_err)]
+        if self.driver is not None:
+            yield "event_loop_lag_seconds", "gauge", "How late the node driver event loop wakes up", \
+                [({}, self.driver.loop_lag)]
+            yield "event_loop_lag_max_seconds", "gauge", "Maximum event loop lag", [({}, self.driver.loop_lag_max)]
+        if self.scheduler is not None:
+            yield "traffic_scheduled_total", "counter", "Messages due in the traffic scheduler", \
+                [({}, sum(list(self.scheduler.sent.values())))]
+            yield "traffic_lateness_max_seconds", "gauge", "Maximum send lateness", [({}, self.scheduler.lateness_max)]
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for name, kind, help_text, samples in self._families():
+            lines.append(f"# HELP {PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+                lines.append(f"{PREFIX}{name}{{{label_text}}} {value}" if label_text else f"{PREFIX}{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def totals(self) -> dict:
+        """Sums over the nodes of every metric, for the dashboard"""
+        totals = {}
+        for name, kind, _, samples in self._families():
+            values = [value for _, value in samples]
+            totals[name] = sum(values)
+            if kind == "gauge":
+                totals[name + ":max"] = max(values, default=0)
+            totals[name + ":count"] = len(values)
+        return totals
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Metrics request from {self.address_string()}: {format % args}")
+
+
+class MetricsServer(threading.Thread):
+    def __init__(self, metrics: Metrics, host: str = "127.0.0.1", port: int = 9100) -> None:
+        """Serve the metrics on http://host:port/metrics, raises OSError if the port is in use"""
+        super().__init__(name="MetricsServer", daemon=True)
+        self.httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.metrics = metrics
+        self.address = self.httpd.server_address
+
+    def run(self):
+        logger.info(f"Serving metrics on http://{self.address[0]}:{self.address[1]}/metrics")
+        self.httpd.serve_forever(poll_interval=0.5)
+        self.httpd.server_close()
+
+    def stop(self):
+        """stop the thread."""
+        if self.is_alive():
+            threading.Thread(target=self.httpd.shutdown, name="MetricsServerShutdown", daemon=True).start()
+
+
+def _si(value: float, unit: str) -> str:
+    for prefix in ("", "k", "M", "G"):
+        if abs(value) < 1000.0 or prefix == "G":
+            return f"{value:.1f} {prefix}{unit}" if prefix or unit != "B" else f"{value:.0f} {unit}"
+        value /= 1000.0
+
+
+class Dashboard(threading.Thread):
+    def __init__(self, metrics: Metrics, interval: float = 1.0, stream=None) -> None:
+        """Compact view of the metrics every interval [s], redrawn in place on a terminal"""
+        super().__init__(name="Dashboard")
+        self.metrics = metrics
+        self.interval = interval
+        self.stream = stream if stream is not None else sys.stderr
+        self.should_stop = threading.Event()
+        self._drawn = 0
+
+    def stop(self):
+        """stop the thread."""
+        self.should_stop.set()
+
+    def _lines(self, now: dict, last: dict, dt: float) -> list:
+        def rate(name):
+            return (now.get(name, 0) - last.get(name, 0)) / dt if dt > 0.0 else 0.0
+
+        lag = ""
+        if "event_loop_lag_seconds" in now:
+            lag = (f" | loop lag {1e3 * now['event_loop_lag_seconds']:.1f} ms "
+                   f"(max {1e3 * now['event_loop_lag_max_seconds']:.1f} ms)")
+        return [
+            f"uwapppos {now['uptime_seconds']:7.1f} s | nodes {now['node_connected']}/{now['node_connected:count']} "
+            f"connected, {now['connect_retries_total']} connect retries",
+            f"  messages sent {rate('messages_sent_total'):8.1f}/s ({now['messages_sent_total']}) "
+            f"received {rate('messages_received_total'):8.1f}/s ({now['messages_received_total']}) | "
+            f"out {_si(rate('bytes_sent_total'), 'B/s')} in {_si(rate('bytes_received_total'), 'B/s')}",
+            f"  queues depth {_si(now['queue_depth_bytes'], 'B')} (max {_si(now['queue_max_depth_bytes:max'], 'B')}) "
+            f"partial {now['partial_sends_total']} stalls {now['queue_stalls_total']} "
+            f"dropped {now['queue_dropped_total']} | kernel send queue max {_si(now['socket_send_queue_bytes:max'], 'B')}",
+            f"  positions {rate('position_updates_sent_total'):6.1f}/s | "
+            f"ns output {rate('ns_output_lines_total'):7.1f} lines/s{lag}",
+        ]
+
+    def _draw(self, lines: list) -> None:
+        if self.stream.isatty():
+            # redraw in place: back to the first line of the previous view, clear to the end of the screen
+            text = (f"\x1b[{self._drawn}F" if self._drawn else "") + "\x1b[J" + "\n".join(lines) + "\n"
+            self._drawn = len(lines)
+        else:
+            text = "\n".join(lines) + "\n"
+        self.stream.write(text)
+        self.stream.flush()
+
+    def run(self):
+        last, last_time = {}, time.monotonic()
+        while not self.should_stop.wait(self.interval):
+            now_time = time.monotonic()
+            try:
+                now = self.metrics.totals()
+                self._draw(self._lines(now, last, now_time - last_time))
+            except Exception as e:
+                logger.error(f"Dashboard: {e}", exc_info=True)
+                return
+            last, last_time = now, now_time
+
+
+def add_metrics_arguments(argparser) -> None:
+    group = argparser.add_argument_group('live metrics')
+    group.add_argument('--metrics-port', type=int, default=0,
+                       help='Serve live counters and gauges in the Prometheus text format on '
+                            'http://<metrics-host>:<port>/metrics, 0 to disable')
+    group.add_argument('--metrics-host', default='127.0.0.1', help='Address of the metrics endpoint')
+    group.add_argument('--dashboard', type=float, default=0.0,
+                       help='Show a compact live view of the metrics on stderr every given number of seconds, '
+                            '0 to disable (best with --no-echo)')
+
+
+def metrics_from_args(args) -> tuple:
+    """
+    Metrics and the threads serving them (not started) according to the command
+    line, raises OSError if the metrics port cannot be bound
+    """
+    metrics = Metrics()
+    threads = []
+    if args.metrics_port:
+        threads.append(MetricsServer(metrics, args.metrics_host, args.metrics_port))
+    if args.dashboard > 0.0:
+        threads.append(Dashboard(metrics, args.dashboard))
+    return metrics, threads
@@ -0,0 +1,475 @@
+import logging
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+from clock import WALL_CLOCK, ClockEvent
+from log_pipeline import events
+
+logger = logging.getLogger(__name__)
+
+# Serialization of PositionData, see position_data.h
+POSITION_STRUCT = struct.Struct("<?ddd")
+# numpy layout of the same record, used to pack all nodes at once
+POSITION_DTYPE = np.dtype([("geodetic", "?"), ("x", "<f8"), ("y", "<f8"), ("z", "<f8")])
+assert POSITION_DTYPE.itemsize == POSITION_STRUCT.size
+
+
+
+def pack_positions(records: np.ndarray, geodetic: np.ndarray, pos: np.ndarray) -> memoryview:
+    """Fill the POSITION_DTYPE records from the node state and return them as one byte buffer"""
+    records["geodetic"] = geodetic
+    records["x"] = pos[:, 0]
+    records["y"] = pos[:, 1]
+    records["z"] = pos[:, 2]
+    return memoryview(records.view(np.uint8))
+
+
+# Batched position datagram of BatchPositionListener, see position_data.h:
+# header magic "PB", version, flags, record count, then the records
+BATCH_HEADER_STRUCT = struct.Struct("<2sBBH")
+BATCH_MAGIC = b"PB"
+BATCH_VERSION = 1
+BATCH_FLAG_TIMESTAMP = 0x01
+BATCH_RECORD_DTYPE = np.dtype([("node_id", "<u2"), ("geodetic", "?"), ("x", "<f8"), ("y", "<f8"), ("z", "<f8")])
+BATCH_RECORD_TS_DTYPE = np.dtype(BATCH_RECORD_DTYPE.descr + [("timestamp", "<f8")])
+assert BATCH_RECORD_DTYPE.itemsize == 27 and BATCH_RECORD_TS_DTYPE.itemsize == 35
+# largest UDP payload over IPv4
+MAX_BATCH_DATAGRAM = 65507
+
+
+def pack_position_batches(node_ids: np.ndarray, geodetic: np.ndarray, pos: np.ndarray, timestamp: float = None,
+                          max_datagram: int = MAX_BATCH_DATAGRAM) -> list:
+    """
+    Pack the positions of all nodes into batch datagrams of at most max_datagram bytes.
+    Returns one list of buffers (header, records) per datagram, to be sent with sendmsg().
+    """
+    dtype = BATCH_RECORD_DTYPE if timestamp is None else BATCH_RECORD_TS_DTYPE
+    flags = 0 if timestamp is None else BATCH_FLAG_TIMESTAMP
+    records = np.empty(len(node_ids), dtype=dtype)
+    records["node_id"] = node_ids
+    records["geodetic"] = geodetic
+    records["x"] = pos[:, 0]
+    records["y"] = pos[:, 1]
+    records["z"] = pos[:, 2]
+    if timestamp is not None:
+        records["timestamp"] = timestamp
+    data = memoryview(records.view(np.uint8))
+    per_datagram = min(0xFFFF, (max_datagram - BATCH_HEADER_STRUCT.size) // dtype.itemsize)
+    if per_datagram < 1:
+        raise ValueError(f"Maximum datagram size {max_datagram} is too small for one position record")
+    datagrams = []
+    for first in range(0, len(records), per_datagram):
+        count = min(per_datagram, len(records) - first)
+        header = BATCH_HEADER_STRUCT.pack(BATCH_MAGIC, BATCH_VERSION, flags, count)
+        datagrams.append([header, data[first * dtype.itemsize:(first + count) * dtype.itemsize]])
+    return datagrams
+
+
+def unpack_position_batch(data) -> np.ndarray:
+    """Records of a batch datagram as BATCH_RECORD_DTYPE or BATCH_RECORD_TS_DTYPE array, ValueError if invalid"""
+    if len(data) < BATCH_HEADER_STRUCT.size:
+        raise ValueError(f"batch datagram of {len(data)} bytes is too short")
+    magic, version, flags, count = BATCH_HEADER_STRUCT.unpack_from(data)
+    if magic != BATCH_MAGIC or version != BATCH_VERSION:
+        raise ValueError(f"unsupported batch datagram {magic!r} version {version}")
+    dtype = BATCH_RECORD_TS_DTYPE if flags & BATCH_FLAG_TIMESTAMP else BATCH_RECORD_DTYPE
+    if len(data) < BATCH_HEADER_STRUCT.size + count * dtype.itemsize:
+        raise ValueError(f"batch datagram of {len(data)} bytes is too short for {count} records")
+    return np.frombuffer(data, dtype=dtype, count=count, offset=BATCH_HEADER_STRUCT.size)
+
+
+MODEL_CONSTANT = 0
+MODEL_WAYPOINT = 1
+MODEL_LAWNMOWER = 2
+MODEL_CIRCLE = 3
+MODELS = {
+    "constant": MODEL_CONSTANT,
+    "waypoint": MODEL_WAYPOINT,
+    "lawnmower": MODEL_LAWNMOWER,
+    "circle": MODEL_CIRCLE,
+}
+
+
+# per node state of MobilityEngine: attribute -> (shape of one node, dtype)
+ENGINE_STATE = {
+    "node_ids": ((), np.int64),
+    "model": ((), np.int8),
+    "geodetic": ((), bool),
+    "pos": ((3,), float),
+    "vel": ((3,), float),
+    "speed": ((), float),
+    "target": ((3,), float),
+    "area_min": ((3,), float),
+    "area_max": ((3,), float),
+    "origin": ((3,), float),
+    "leg_length": ((), float),
+    "leg_spacing": ((), float),
+    "legs": ((), float),
+    "radius": ((), float),
+    "phase": ((), float),
+    "travelled": ((), float),
+    "_records": ((), POSITION_DTYPE),
+}
+
+
+class MobilityEngine(object):
+    def __init__(self, seed: int = None) -> None:
+        """
+        Keeps the state of all moving nodes in numpy arrays and advances all of
+        them in one vectorized step.
+
+        Models:
+        - constant: constant velocity (vx, vy, vz) [m/s]
+        - waypoint: random waypoint inside the box area_min..area_max at speed [m/s],
+                    by default +-1000 m around the start position at constant depth
+        - lawnmower: survey of legs parallel to x with leg_length and leg_spacing [m],
+                     the vehicle returns along the pattern after the last leg
+        - circle: loiter on a circle with radius [m] around center at speed [m/s]
+        """
+        self.rng = np.random.default_rng(seed)
+        # the attributes of ENGINE_STATE are views of the first _size rows of these arrays,
+        # which grow by doubling, so adding N nodes is O(N)
+        self._state = {name: np.zeros((0,) + shape, dtype=dtype) for name, (shape, dtype) in ENGINE_STATE.items()}
+        self._size = 0
+        self._set_views()
+
+    def _set_views(self) -> None:
+        for name, array in self._state.items():
+            setattr(self, name, array[:self._size])
+
+    def _reserve(self, capacity: int) -> None:
+        for name, array in self._state.items():
+            grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:len(array)] = array
+            self._state[name] = grown
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add_node(self, node_id: int,
+                 pos: tuple,
+                 model: str = "constant",
+                 geodetic: bool = False,
+                 velocity: tuple = (0.0, 0.0, 0.0),
+                 speed: float = 1.0,
+                 area_min: tuple = None,
+                 area_max: tuple = None,
+                 leg_length: float = 1000.0,
+                 leg_spacing: float = 100.0,
+                 legs: int = 10,
+                 radius: float = 100.0,
+                 center: tuple = None) -> None:
+        """Add a node with start position pos = (x, y, z), see class description for the model parameters"""
+        if model not in MODELS:
+            raise ValueError(f"Unknown mobility model '{model}', use one of {list(MODELS)}")
+        p = np.asarray(pos, dtype=float)
+        if area_min is None:
+            area_min = p - (1000.0, 1000.0, 0.0)
+        if area_max is None:
+            area_max = p + (1000.0, 1000.0, 0.0)
+        if center is None:
+            center = p - (radius, 0.0, 0.0)
+        center = np.asarray(center, dtype=float)
+        phase = np.arctan2(p[1] - center[1], p[0] - center[0]) if model == "circle" else 0.0
+        if self._size == len(self._state["node_ids"]):
+            self._reserve(max(16, 2 * self._size))
+        i = self._size
+        self._size += 1
+        self._set_views()
+        self.node_ids[i] = node_id
+        self.model[i] = MODELS[model]
+        self.geodetic[i] = geodetic
+        self.pos[i] = p
+        self.vel[i] = velocity
+        self.speed[i] = speed
+        self.area_min[i] = area_min
+        self.area_max[i] = area_max
+        self.target[i] = self.rng.uniform(self.area_min[i], self.area_max[i])
+        self.origin[i] = center if model == "circle" else p
+        self.leg_length[i] = leg_length
+        self.leg_spacing[i] = leg_spacing
+        self.legs[i] = max(1, legs)
+        self.radius[i] = radius
+        self.phase[i] = phase
+        self.travelled[i] = 0.0
+
+    def step(self, dt: float) -> None:
+        """Advance all nodes by dt [s]"""
+        if dt <= 0.0 or len(self) == 0:
+            return
+        m = self.model == MODEL_CONSTANT
+        if m.any():
+            self.pos[m] += self.vel[m] * dt
+
+        m = self.model == MODEL_WAYPOINT
+        if m.any():
+            idx = np.flatnonzero(m)
+            delta = self.target[idx] - self.pos[idx]
+            dist = np.linalg.norm(delta, axis=1)
+            step = self.speed[idx] * dt
+            arrived = dist <= step
+            moving = ~arrived
+            self.pos[idx[moving]] += delta[moving] * (step[moving] / dist[moving])[:, None]
+            if arrived.any():
+                done = idx[arrived]
+                self.pos[done] = self.target[done]
+                self.target[done] = self.rng.uniform(self.area_min[done], self.area_max[done])
+
+        m = self.model == MODEL_LAWNMOWER
+        if m.any():
+            self.travelled[m] += self.speed[m] * dt
+            length = self.leg_length[m]
+            spacing = self.leg_spacing[m]
+            period = length + spacing
+            total = self.legs[m] * period - spacing
+            # run forth and back along the survey pattern
+            s = np.mod(self.travelled[m], 2.0 * total)
+            s = total - np.abs(s - total)
+            leg = np.floor(s / period)
+            r = s - leg * period
+            on_leg = r < length
+            forward = np.mod(leg, 2.0) == 0.0
+            along = np.where(on_leg, np.where(forward, r, length - r), np.where(forward, length, 0.0))
+            across = leg * spacing + np.where(on_leg, 0.0, r - length)
+            self.pos[m, 0] = self.origin[m, 0] + along
+            self.pos[m, 1] = self.origin[m, 1] + across
+
+        m = self.model == MODEL_CIRCLE
+        if m.any():
+            self.phase[m] += self.speed[m] / self.radius[m] * dt
+            self.pos[m, 0] = self.origin[m, 0] + self.radius[m] * np.cos(self.phase[m])
+            self.pos[m, 1] = self.origin[m, 1] + self.radius[m] * np.sin(self.phase[m])
+
+    def pack(self) -> memoryview:
+        """Return the PositionData records of all nodes (POSITION_STRUCT.size bytes each) as one buffer"""
+        return pack_positions(self._records, self.geodetic, self.pos)
+
+
+def add_mobility_arguments(argparser) -> None:
+    group = argparser.add_argument_group('mobility')
+    group.add_argument('-m', '--mobility', choices=list(MODELS), default='constant',
+                       help='Mobility model of the moving nodes')
+    group.add_argument('--move-all', action='store_true',
+                       help='Move all nodes, by default only the receiving node 1 is moving')
+    group.add_argument('--pos-interval', type=float, default=None,
+                       help='Position update interval in [s], default 5.0 or the recorded interval of a trajectory')
+    group.add_argument('--speed', type=float, default=1.5, help='Speed of the moving nodes in [m/s]')
+    group.add_argument('--seed', type=int, default=None, help='Random seed of the waypoint model')
+    group.add_argument('--trajectory', default=None,
+                       help='Play back a recorded trajectory file (see trajectory.py) instead of a mobility model')
+    group.add_argument('--trajectory-rate', type=float, default=1.0,
+                       help='Trajectory playback speed, 1.0 is the recorded rate')
+    group.add_argument('--pos-batch', action='store_true',
+                       help='Send the positions of all nodes in batch datagrams to one shared listener on the '
+                            'position port base, instead of one datagram per node')
+    group.add_argument('--pos-batch-timestamps', action='store_true',
+                       help='Add the wall clock time of the update to the batched position records')
+    group.add_argument('--pos-tolerance', type=float, default=None,
+                       help='Dead reckoning: only update a node when it moved more than the tolerance in [m] away '
+                            'from its last sent position, the positions are checked every --pos-interval')
+    group.add_argument('--pos-max-interval', type=float, default=60.0,
+                       help='Dead reckoning: maximum time in [s] between two updates of a node')
+
+
+def check_mobility_args(args) -> None:
+    """Raises ValueError for a position update interval or trajectory rate which cannot be scheduled"""
+    if args.pos_interval is not None and args.pos_interval <= 0.0:
+        raise ValueError("The position update interval must be > 0")
+    if args.trajectory_rate <= 0.0:
+        raise ValueError("The trajectory rate must be > 0")
+
+
+def engine_from_args(args, num_nodes: int, depth: float = 100.0, node_ids=None):
+    """
+    Create the engine for the node layout of uwAppPos.tmpl (receiver 1 at origin, senders at x=1500)
+    or the trajectory player if a trajectory file is given.
+    node_ids: only the nodes of a shard, the trajectory player always plays all nodes
+    """
+    if args.trajectory:
+        from trajectory import TrajectoryPlayer
+        player = TrajectoryPlayer(args.trajectory, args.trajectory_rate)
+        if args.pos_interval is None:
+            args.pos_interval = player.recorded_interval() / args.trajectory_rate
+        return player
+    if args.pos_interval is None:
+        # also with dead reckoning, so the suppressed updates are counted against the same update rate
+        args.pos_interval = 5.0
+    engine = MobilityEngine(args.seed)
+    positions = [(1, (0.0, 0.0, depth))]
+    if args.move_all:
+        positions += [(i + 2, (1500.0, 1500.0 * i, depth)) for i in range(num_nodes)]
+    if node_ids is not None:
+        positions = [(node_id, pos) for node_id, pos in positions if node_id in node_ids]
+    for node_id, pos in positions:
+        if args.mobility == "constant":
+            # former fixed speed of the position worker
+            engine.add_node(node_id, pos, "constant", velocity=(1.0, 0.0, 1.5))
+        else:
+            engine.add_node(node_id, pos, args.mobility, speed=args.speed)
+    return engine
+
+
+# mean earth radius in [m], to compare geodetic positions in metres
+EARTH_RADIUS = 6371000.0
+
+
+class DeadReckoning(object):
+    def __init__(self, tolerance: float, max_interval: float) -> None:
+        """
+        Suppress position updates the receiver does not need.
+
+        uwAppPosModule::setPosition() keeps a position until the next update
+        (zero-order hold), so the position the receiver assumes is the last one
+        sent. A node is only updated when its true position is more than
+        tolerance [m] away from that, or when max_interval [s] passed since its
+        last update.
+        """
+        self.tolerance = tolerance
+        self.max_interval = max_interval
+        self.suppressed = 0
+        self._sent_pos = None
+        self._sent_time = None
+
+    def error(self, geodetic: np.ndarray, pos: np.ndarray) -> np.ndarray:
+        """Distance in [m] between the true and the last sent position of every node"""
+        delta = pos - self._sent_pos
+        if geodetic.any():
+            # latitude/longitude [deg] -> north/east [m], local approximation
+            scale = np.radians(1.0) * EARTH_RADIUS
+            lat = np.radians(pos[geodetic, 0])
+            delta[geodetic, 0] *= scale
+            delta[geodetic, 1] *= scale * np.cos(lat)
+        return np.sqrt(np.einsum("ij,ij->i", delta, delta))
+
+    def due(self, now: float, geodetic: np.ndarray, pos: np.ndarray) -> np.ndarray:
+        """Mask of the nodes to update at now [s], their positions are taken as sent"""
+        if self._sent_pos is None or len(self._sent_pos) != len(pos):
+            mask = np.ones(len(pos), dtype=bool)
+            self._sent_pos = pos.copy()
+            self._sent_time = np.full(len(pos), now)
+            return mask
+        mask = (self.error(geodetic, pos) > self.tolerance) | (now - self._sent_time >= self.max_interval)
+        self._sent_pos[mask] = pos[mask]
+        self._sent_time[mask] = now
+        self.suppressed += len(mask) - int(np.count_nonzero(mask))
+        return mask
+
+
+def dead_reckoning_from_args(args):
+    """DeadReckoning according to the command line or None to send every update"""
+    if args.pos_tolerance is None:
+        return None
+    if args.pos_tolerance < 0.0 or args.pos_max_interval <= 0.0:
+        raise ValueError("The position tolerance must be >= 0 and the maximum update interval > 0")
+    return DeadReckoning(args.pos_tolerance, args.pos_max_interval)
+
+
+class PosWorker(threading.Thread):
+    def __init__(self, engine: MobilityEngine,
+                 send_interval: float,
+                 host: str,
+                 port_base: int,
+                 batch_port: int = None,
+                 timestamps: bool = False,
+                 dead_reckoning: DeadReckoning = None,
+                 clock=WALL_CLOCK) -> None:
+        """
+        Single thread sending the position of all nodes of the mobility engine.
+
+        send_interval: position update interval in [s]
+        host: address of ns2
+        port_base: position port base (port = app_pos_port_base + node_id)
+        batch_port: send the positions of all nodes in batch datagrams to this
+                    port of the BatchPositionListener instead of one datagram per node
+        timestamps: batch only, add the wall clock time of the update to the records
+        dead_reckoning: only send the updates selected by the DeadReckoning,
+                        send_interval is the interval the positions are checked then
+        clock: the positions move and are sent on this clock, see clock.py
+        """
+        super().__init__(name="PosWorker")
+        self.engine = engine
+        self.send_interval = send_interval
+        self.host = host
+        self.port_base = port_base
+        self.batch_port = batch_port
+        self.timestamps = timestamps
+        self.dead_reckoning = dead_reckoning
+        self.clock = clock.join("PosWorker")
+        self.should_stop = ClockEvent()
+        self.updates_sent = 0
+        self.updates_dropped = 0
+
+    @property
+    def updates_suppressed(self) -> int:
+        return self.dead_reckoning.suppressed if self.dead_reckoning is not None else 0
+
+    def stop(self):
+        """stop the thread."""
+        self.should_stop.set()
+
+    def _send_batches(self, s: socket.socket, mask: np.ndarray) -> None:
+        timestamp = time.time() if self.timestamps else None
+        address = (self.host, self.batch_port)
+        engine = self.engine
+        for buffers in pack_position_batches(engine.node_ids[mask], engine.geodetic[mask], engine.pos[mask], timestamp):
+            count = BATCH_HEADER_STRUCT.unpack(buffers[0])[3]
+            try:
+                s.sendmsg(buffers, [], 0, address)
+                self.updates_sent += count
+                events.position(0, buffers)
+            except BlockingIOError:
+                self.updates_dropped += count
+
+    def run(self):
+        """Worker thread sending the position data"""
+        addresses = [(self.host, self.port_base + int(node_id)) for node_id in self.engine.node_ids]
+        size = POSITION_STRUCT.size
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            if self.batch_port:
+                logger.info(f"Sending position data for {len(addresses)} node(s) in batches to port {self.batch_port}")
+            else:
+                logger.info(f"Sending position data for {len(addresses)} node(s) to port base {self.port_base}")
+            s.setblocking(False)
+            last_pos_update = None
+            next_update = self.clock.now()
+            while not self.should_stop.is_set():
+                try:
+                    now = self.clock.now()
+                    if last_pos_update is not None:
+                        self.engine.step(now - last_pos_update)
+                    last_pos_update = now
+                    if self.dead_reckoning is not None:
+                        mask = self.dead_reckoning.due(now, self.engine.geodetic, self.engine.pos)
+                    else:
+                        mask = np.ones(len(addresses), dtype=bool)
+                    if self.batch_port:
+                        if mask.any():
+                            self._send_batches(s, mask)
+                    else:
+                        data = self.engine.pack()
+                        for i in np.flatnonzero(mask):
+                            try:
+                                s.sendto(data[i * size:(i + 1) * size], addresses[i])
+                                self.updates_sent += 1
+                                events.position(int(self.engine.node_ids[i]), data[i * size:(i + 1) * size])
+                            except BlockingIOError:
+                                self.updates_dropped += 1
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"Sent positions of {int(np.count_nonzero(mask))} of {len(addresses)} node(s): "
+                                     f"{self.engine.pos[mask].tolist()}")
+                except Exception as e:
+                    logger.error(f"Error sending position data: {e}", exc_info=True)
+                next_update += self.send_interval
+                self.clock.wait_until(next_update, self.should_stop)
+            self.clock.leave()
+            logger.info(f"Sending position data stopped after {self.updates_sent} updates ({self.updates_dropped} dropped, "
+                        f"{self.updates_suppressed} suppressed)")
+
+    def print_summary(self) -> None:
+        total = self.updates_sent + self.updates_dropped + self.updates_suppressed
+        print(f"Position: {self.updates_sent} updates sent, {self.updates_dropped} dropped, "
+              f"{self.updates_suppressed} suppressed ({100.0 * self.updates_suppressed / max(1, total):.1f} %)")
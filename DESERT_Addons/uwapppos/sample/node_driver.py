@@ -0,0 +1,403 @@
+import asyncio
+import functools
+import logging
+import socket
+import threading
+import time
+
+from clock import ClockEvent
+from frame_decoder import FrameDecoder
+from latency import encode_payload
+from log_pipeline import events
+from outbound import OutboundQueue
+from startup import Startup
+from traffic import ConstantProfile, TrafficScheduler
+from udp_receiver import MAX_PAYLOAD, drain_datagrams, open_udp_socket
+
+logger = logging.getLogger(__name__)
+
+# sample interval of the event loop lag in [s]
+LAG_INTERVAL = 0.1
+
+
+def default_payload(node_id: int) -> bytes:
+    """Payload sent by a node if no other payload factory is given"""
+    return bytes(f"Message from node {node_id}", encoding="utf-8")
+
+
+def payload_size(node_id: int, tracker=None) -> int:
+    """Size of the payload of node_id in [bytes], including the measurement header if a LatencyTracker is used"""
+    payload = default_payload(node_id)
+    if tracker is not None:
+        payload = encode_payload(node_id, 0, time.monotonic_ns(), payload)
+    return len(payload)
+
+
+class DriverNode(object):
+    def __init__(self, node_id: int, profile, payload: bytes) -> None:
+        """
+        node_id: node id
+        profile: traffic profile (see traffic.py), None to not send messages
+        payload: message sent at every deadline of the profile
+        """
+        self.node_id = node_id
+        self.profile = profile
+        self.payload = payload
+        self.transport = None
+        self.connected = False
+        self.sent = 0
+        self.received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # TCP only: receive path, outbound queue and its flush progress
+        self.decoder = None
+        self.queue = None
+        self.writing = False
+        self.flushed = None
+
+
+class AsyncNodeDriver(object):
+    def __init__(self, protocol: str,
+                 host: str,
+                 app_port_base: int,
+                 app_send_port_base: int = None,
+                 startup: Startup = None,
+                 tracker=None,
+                 scheduler: TrafficScheduler = None,
+                 max_payload: int = MAX_PAYLOAD,
+                 queue_size: int = 64 * 1024,
+                 queue_policy: str = "block",
+                 go=None) -> None:
+        """
+        Single asyncio event loop owning the sockets, send schedule and receive
+        path of every node.
+
+        protocol: "tcp" or "udp", same value as TMPL_PROTOCOL
+        host: address of ns2
+        app_port_base: application socket port base of ns2 (port = app_port_base + node_id)
+        app_send_port_base: UDP only, local port base ns2 sends received data to
+        startup: Startup of the nodes, readiness of the ns sockets (default: 30 s deadline, no announcements)
+        tracker: optional LatencyTracker, payloads are sent as measurement payloads
+        scheduler: TrafficScheduler polled by the event loop (not started as thread), the messages
+            are sent on its clock, on a VirtualClock the driver takes part in the lock-step with ns
+        max_payload: UDP only, size of the receive buffer, larger datagrams are truncated
+        queue_size, queue_policy: TCP only, high-water mark and policy of the OutboundQueue of each node,
+            with the block policy the send loop waits for the queue of a node
+        go: optional event (threading or multiprocessing), the traffic starts when it is set
+            after the node sockets are open, e.g. when the nodes of all shards are ready
+        """
+        protocol = protocol.lower()
+        if protocol not in ("tcp", "udp"):
+            raise ValueError(f"Unsupported protocol '{protocol}'")
+        if protocol == "udp" and app_send_port_base is None:
+            raise ValueError("UDP protocol needs app_send_port_base")
+        self.protocol = protocol
+        self.host = host
+        self.app_port_base = app_port_base
+        self.app_send_port_base = app_send_port_base
+        self.startup = startup
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        self.go = go
+        self.tracker = tracker
+        self.scheduler = scheduler if scheduler is not None else TrafficScheduler()
+        self.clock = self.scheduler.clock.join("AsyncNodeDriver")
+        self._clock_stop = ClockEvent()
+        self.nodes = {}
+        self.loop = None
+        self._stop = None
+        self._stop_requested = False
+        self._wakeups = {}
+        self._udp_buffer = memoryview(bytearray(max_payload)) if protocol == "udp" else None
+        # how late the loop wakes up from a sleep of LAG_INTERVAL [s], last and maximum
+        self.loop_lag = 0.0
+        self.loop_lag_max = 0.0
+
+    def add_node(self, node_id: int, send_interval: float, payload: bytes = None, profile=None) -> DriverNode:
+        """
+        Add a node, sending is only active when send_interval > 0.0 (constant
+        interval) or a traffic profile is given
+        """
+        if payload is None:
+            payload = default_payload(node_id)
+        if profile is None and send_interval > 0.0:
+            profile = ConstantProfile(send_interval)
+        node = DriverNode(node_id, profile, payload)
+        self.nodes[node_id] = node
+        return node
+
+    def on_receive(self, node: DriverNode, data) -> None:
+        """Called for every received message, data is a bytes-like object only valid during the call"""
+        node.received += 1
+        node.bytes_received += len(data)
+        delay = self.tracker.on_receive(node.node_id, data) if self.tracker is not None else None
+        events.received(node.node_id, data, delay)
+
+    def on_disconnect(self, node: DriverNode) -> None:
+        logger.warning(f"Node {node.node_id}: disconnected from {(self.host, self.app_port_base + node.node_id)}")
+        self.scheduler.remove(node.node_id)
+        if not any(n.connected for n in self.nodes.values()):
+            self._request_stop()
+
+    def queues(self) -> dict:
+        """OutboundQueues of the connected TCP nodes, node id -> queue"""
+        return {node.node_id: node.queue for node in self.nodes.values() if node.queue is not None}
+
+    def _on_discard(self, node: DriverNode, count: int) -> None:
+        if self.tracker is not None:
+            self.tracker.discard(node.node_id, count)
+
+    def _on_tcp_readable(self, node: DriverNode) -> None:
+        try:
+            node.decoder.recv_into(node.transport)
+        except OSError as e:
+            logger.warning(f"Node {node.node_id}: receive failed, {e}")
+            node.decoder.closed = True
+        for frame in node.decoder.frames():
+            self.on_receive(node, frame)
+        if node.decoder.closed:
+            self._close_tcp(node)
+
+    def _on_tcp_writable(self, node: DriverNode) -> None:
+        try:
+            empty = node.queue.flush()
+        except OSError as e:
+            logger.warning(f"Node {node.node_id}: send failed, {e}")
+            self._close_tcp(node)
+            return
+        node.flushed.set()
+        if empty:
+            self.loop.remove_writer(node.transport.fileno())
+            node.writing = False
+
+    def _close_tcp(self, node: DriverNode) -> None:
+        if not node.connected:
+            return
+        self.loop.remove_reader(node.transport.fileno())
+        if node.writing:
+            self.loop.remove_writer(node.transport.fileno())
+            node.writing = False
+        node.connected = False
+        node.queue.close()
+        node.flushed.set()
+        self.on_disconnect(node)
+
+    async def _wait_queue(self, node: DriverNode, size: int) -> None:
+        """Block policy: hold back the send loop until the queue of node takes size more bytes"""
+        start = time.monotonic()
+        try:
+            while node.connected and node.queue.full(size):
+                node.flushed.clear()
+                await node.flushed.wait()
+        finally:
+            node.queue.record_stall(time.monotonic() - start)
+
+    def send(self, node: DriverNode) -> None:
+        if not node.connected:
+            return
+        if self.protocol == "tcp":
+            parts = self.tracker.next_message(node.node_id, node.payload) if self.tracker is not None else [node.payload]
+            try:
+                if not node.queue.put(parts, wait=False):
+                    return
+            except OSError as e:
+                logger.warning(f"Node {node.node_id}: send failed, {e}")
+                self._close_tcp(node)
+                return
+            if node.queue.pending and not node.writing:
+                self.loop.add_writer(node.transport.fileno(), self._on_tcp_writable, node)
+                node.writing = True
+            node.sent += 1
+            node.bytes_sent += sum(len(part) for part in parts)
+            events.sent(node.node_id, parts)
+            return
+        payload = node.payload
+        if self.tracker is not None:
+            payload = self.tracker.next_payload(node.node_id, payload)
+        try:
+            node.transport.sendto(payload, (self.host, self.app_port_base + node.node_id))
+        except (BlockingIOError, ConnectionRefusedError) as e:
+            logger.warning(f"Node {node.node_id}: message dropped, {e}")
+            return
+        node.sent += 1
+        node.bytes_sent += len(payload)
+        events.sent(node.node_id, payload)
+
+    def _on_announce(self, node_id: int) -> None:
+        """Listener start message of node_id, called from the OutputPump thread"""
+        wakeup = self._wakeups.get(node_id)
+        if wakeup is not None:
+            self.loop.call_soon_threadsafe(wakeup.set)
+
+    async def _wait_wakeup(self, node: DriverNode, timeout: float) -> None:
+        wakeup = self._wakeups[node.node_id]
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+
+    async def _open_tcp(self, node: DriverNode) -> bool:
+        """Connect with backoff until the startup deadline, retries are woken up by the listener start message"""
+        address = (self.host, self.app_port_base + node.node_id)
+        logger.info(f"Node {node.node_id}: connecting to {address}")
+        error = None
+        for delay in self.startup.delays(node.node_id):
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.setblocking(False)
+            try:
+                await self.loop.sock_connect(s, address)
+            except OSError as e:
+                s.close()
+                error = e
+                logger.debug(f"Connection to {address} failed, reason: {e}, retry in {1e3 * delay:.0f} ms")
+                await self._wait_wakeup(node, delay)
+                continue
+            except asyncio.CancelledError:
+                s.close()
+                raise
+            logger.debug(f"Node {node.node_id} connected to {address}")
+            node.transport = s
+            node.decoder = FrameDecoder()
+            node.queue = OutboundQueue(s, self.queue_size, self.queue_policy,
+                                       on_discard=functools.partial(self._on_discard, node))
+            node.flushed = asyncio.Event()
+            self.loop.add_reader(s.fileno(), self._on_tcp_readable, node)
+            node.connected = True
+            return True
+        self.startup.set_failed(node.node_id, f"connection to {address} failed: {error}")
+        return False
+
+    async def _open_udp(self, node: DriverNode) -> bool:
+        """The node socket is served by the selector of the loop, pending datagrams are drained per wakeup"""
+        local_address = (self.host, self.app_send_port_base + node.node_id)
+        logger.info(f"Node {node.node_id}: UDP socket binding to {local_address}")
+        try:
+            s = open_udp_socket(local_address)
+        except OSError as error:
+            logger.error(f"Node {node.node_id}: binding to {local_address} failed, reason: {error}")
+            return False
+        self.loop.add_reader(s.fileno(), drain_datagrams, s, self._udp_buffer,
+                             functools.partial(self.on_receive, node))
+        node.transport = s
+        node.connected = True
+        if self.startup.announcements and node.node_id not in self.startup.announced:
+            # nothing to connect to, ns receives on the node port after its listener start message
+            await self._wait_wakeup(node, self.startup.remaining())
+            if node.node_id not in self.startup.announced:
+                self.startup.set_failed(node.node_id, "no listener start message in the ns output")
+                return False
+        return True
+
+    async def _open(self, opener, node: DriverNode) -> bool:
+        ok = await opener(node)
+        if ok:
+            self.startup.set_ready(node.node_id)
+        return ok
+
+    async def _sleep_until(self, deadline: float) -> None:
+        if self.clock.virtual:
+            # the virtual clock advances in lock-step with ns, wait for it in a worker thread
+            await self.loop.run_in_executor(None, self.clock.wait_until, deadline, self._clock_stop)
+            return
+        delay = deadline - time.monotonic()
+        if delay > 0.0:
+            await asyncio.sleep(delay)
+
+    async def _monitor_lag(self) -> None:
+        """Event loop lag, a loop busy with callbacks wakes up late from every sleep"""
+        while True:
+            start = self.loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.loop_lag = max(0.0, self.loop.time() - start - LAG_INTERVAL)
+            self.loop_lag_max = max(self.loop_lag_max, self.loop_lag)
+
+    async def _send_loop(self) -> None:
+        """Send the messages of all nodes at the absolute deadlines of the scheduler"""
+        try:
+            while True:
+                deadline = self.scheduler.next_deadline()
+                if deadline is None:
+                    return
+                await self._sleep_until(deadline)
+                for node_id, _ in self.scheduler.pop_due(self.clock.now()):
+                    node = self.nodes[node_id]
+                    if node.queue is not None and self.queue_policy == "block" and node.queue.full(len(node.payload)):
+                        await self._wait_queue(node, len(node.payload))
+                    self.send(node)
+        finally:
+            self.clock.leave()
+
+    async def run_async(self, run_time: float = None) -> None:
+        """Open all node sockets and serve them until stop() is called or run_time [s] is over"""
+        self.loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        if self._stop_requested:
+            # stop() was called before the loop was running
+            self._stop.set()
+        if self.startup is None:
+            self.startup = Startup(self.nodes)
+        self._wakeups = {node_id: asyncio.Event() for node_id in self.nodes}
+        self.startup.add_listener(self._on_announce)
+        for node_id in self.startup.announced:
+            # announced before the loop was running
+            self._on_announce(node_id)
+        opener = self._open_tcp if self.protocol == "tcp" else self._open_udp
+        opening = asyncio.gather(*(self._open(opener, node) for node in self.nodes.values()))
+        stopped = asyncio.ensure_future(self._stop.wait())
+        await asyncio.wait((opening, stopped), return_when=asyncio.FIRST_COMPLETED)
+        if opening.done():
+            results = opening.result()
+        else:
+            # stopped while connecting
+            opening.cancel()
+            await asyncio.gather(opening, return_exceptions=True)
+            results = []
+        stopped.cancel()
+        if self.go is not None and not self._stop.is_set():
+            await self.loop.run_in_executor(None, self.go.wait)
+        # the traffic starts when every node is ready or failed
+        for node, ok in zip(self.nodes.values(), results):
+            if ok and node.connected and node.profile is not None and not self._stop.is_set():
+                self.scheduler.add(node.node_id, node.profile)
+        tasks = [asyncio.ensure_future(self._send_loop()), asyncio.ensure_future(self._monitor_lag())]
+        if any(results):
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=run_time)
+            except asyncio.TimeoutError:
+                pass
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for node in self.nodes.values():
+            if node.transport is not None:
+                if node.connected:
+                    self.loop.remove_reader(node.transport.fileno())
+                    if node.writing:
+                        self.loop.remove_writer(node.transport.fileno())
+                    node.connected = False
+                if node.queue is not None:
+                    node.queue.close()
+                node.transport.close()
+        logger.info('All node connections closed.')
+
+    def run(self, run_time: float = None) -> None:
+        """Blocking variant of run_async(), can be used as thread target"""
+        asyncio.run(self.run_async(run_time))
+
+    def _request_stop(self) -> None:
+        if self._stop is not None:
+            self._stop.set()
+
+    def stop(self) -> None:
+        """Stop the driver, can be called from any thread"""
+        self._stop_requested = True
+        self._clock_stop.set()
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._request_stop)
+
+    def start_thread(self, run_time: float = None) -> threading.Thread:
+        """Run the driver event loop in a background thread"""
+        t = threading.Thread(target=self.run, args=(run_time,), name="AsyncNodeDriver")
+        t.start()
+        return t
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+
+from ns_standin import standin_argv
+
+logger = logging.getLogger(__name__)
+
+# variables of the capturing shell, not part of the DESERT environment
+SHELL_VARIABLES = ("_", "PWD", "OLDPWD", "SHLVL")
+
+# same bootstrap as run.sh: create the environment file if missing, then source it
+CAPTURE_SCRIPT = """set -eo pipefail
+[ -f "$1/environment" ] || ([ -f "$1/make_environment.sh" ] && cd "$1" && ./make_environment.sh >&2)
+. "$1/environment"
+env -0
+"""
+
+
+def default_cache_dir() -> str:
+    return os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "uwapppos")
+
+
+def _environment_mtime(build_dir: str):
+    try:
+        return os.stat(os.path.join(build_dir, "environment")).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def capture_environment(build_dir: str) -> dict:
+    """Source $build_dir/environment in bash and return the variables it changes"""
+    out = subprocess.run(["/bin/bash", "-c", CAPTURE_SCRIPT, "capture", build_dir],
+                         stdout=subprocess.PIPE, check=True).stdout
+    env = {}
+    for entry in out.split(b"\0"):
+        name, sep, value = entry.decode(errors="surrogateescape").partition("=")
+        if sep and name not in SHELL_VARIABLES and os.environ.get(name) != value:
+            env[name] = value
+    return env
+
+
+def load_environment(build_dir: str, cache_dir: str = None) -> tuple:
+    """
+    Return (ns executable, environment variables) of the DESERT build in build_dir.
+    The environment is captured once and cached per build directory, the cache
+    is refreshed when the mtime of $build_dir/environment changes.
+    """
+    build_dir = os.path.abspath(build_dir)
+    cache_dir = cache_dir or default_cache_dir()
+    cache_file = os.path.join(cache_dir, "env-" + hashlib.sha1(build_dir.encode()).hexdigest()[:16] + ".json")
+    mtime = _environment_mtime(build_dir)
+    if mtime is not None and os.path.exists(cache_file):
+        with open(cache_file, "rt") as f:
+            cached = json.load(f)
+        if cached.get("build_dir") == build_dir and cached.get("mtime_ns") == mtime and os.path.exists(cached["ns"]):
+            return cached["ns"], cached["env"]
+
+    start = time.monotonic()
+    env = capture_environment(build_dir)
+    ns = shutil.which("ns", path=env.get("PATH", os.environ.get("PATH")))
+    if ns is None:
+        raise FileNotFoundError(f"ns not found in the PATH of {build_dir}/environment")
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}"
+    with open(tmp_file, "wt") as f:
+        json.dump({"build_dir": build_dir, "mtime_ns": _environment_mtime(build_dir), "ns": ns, "env": env}, f)
+    os.replace(tmp_file, cache_file)
+    logger.info(f"Captured DESERT environment of {build_dir} in {time.monotonic() - start:.2f} s")
+    return ns, env
+
+
+def add_launch_arguments(argparser) -> None:
+    group = argparser.add_argument_group('ns launch')
+    group.add_argument('--no-cache', action='store_true',
+                       help='Start ns through run.sh, sourcing the DESERT environment every time, '
+                            'and render the tcl script without the script cache')
+    group.add_argument('--cache-dir', default=None,
+                       help=f'Directory of the environment and script cache (default: {default_cache_dir()})')
+
+
+def launch_command(args, script: str) -> tuple:
+    """
+    Return (argv, env) to start ns (or the stand-in) for the tcl script.
+    With the cache ns is started directly with the cached environment instead of
+    running run.sh, env is None to inherit the environment of the harness.
+    """
+    if args.ns_standin:
+        return standin_argv(args, script), None
+    if args.no_cache:
+        return ['/bin/bash', './run.sh'], None
+    ns, env = load_environment(args.build_dir, args.cache_dir)
+    return [ns, script], {**os.environ, **env}
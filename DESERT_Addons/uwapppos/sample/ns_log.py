@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Streaming parser of the ns output into columnar event tables.
+
+The structured log lines of ns ([epoch]::NOW::[node::]MODULE...) are parsed
+chunk by chunk with precompiled patterns over the whole chunk, and every
+column of a chunk is converted at once into numpy arrays. No object is kept
+per line, the tables grow by doubling like the profiler time series.
+
+Use it as OutputPump sink (--ns-events) or on existing log files:
+
+python3 ns_log.py ns_run.log -o ns_run.events.npz
+"""
+
+import gzip
+import logging
+import re
+from argparse import ArgumentParser
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# One pattern for all structured lines, so a chunk is scanned only once:
+# [epoch]::NOW::[node::]MODULE followed by one of
+#   : setting local|geodetic node position to (x,y,z)  (uwAppPos_module.cc setPosition())
+#   : starting|stopping position listener [on port N]  (uwAppPos_module.cc position listener)
+#   ::EVENT[_value], e.g. UWAPPLICATION::SN_RECEIVED_12 -> event SN_RECEIVED, value 12
+#   : text
+# The brackets around epoch are missing in some modules, lines start after a newline.
+EVENT_PATTERN = re.compile(
+    rb'\n\[?(\d+)\]?::([-+.\deE]+)::(?:(\d+)::)?([A-Za-z]\w*)(?:'
+    rb': setting (local|geodetic) node position to \(([^,()\n]*),([^,()\n]*),([^,()\n]*)\)'
+    rb'|: (starting|stopping) position listener(?: on port (\d+))?'
+    rb'|::([A-Za-z_:]*[A-Za-z])(?:_(-?\d+))?'
+    rb'|:[ \t])')
+
+# event kind -> (group which is set for the lines of the kind, None for all lines,
+#                ((column, group, type), ...))
+# types: int (missing: -1), float (missing: nan), category (dictionary encoded), flag:<value> (bool)
+EVENT_KINDS = {
+    "events": (None, (("epoch", 0, "int"), ("time", 1, "float"), ("node", 2, "int"), ("module", 3, "category"),
+                      ("event", 10, "category"), ("value", 11, "int"))),
+    "position": (4, (("epoch", 0, "int"), ("time", 1, "float"), ("node", 2, "int"),
+                     ("geodetic", 4, "flag:geodetic"), ("x", 5, "float"), ("y", 6, "float"), ("z", 7, "float"))),
+    "listener": (8, (("epoch", 0, "int"), ("time", 1, "float"), ("node", 2, "int"), ("started", 8, "flag:starting"),
+                     ("port", 9, "int"))),
+}
+
+_TYPES = {"int": np.int64, "float": np.float64, "category": np.int32}
+
+
+def _column_dtype(kind: str):
+    return np.bool_ if kind.startswith("flag:") else _TYPES[kind]
+
+
+class ColumnTable(object):
+    def __init__(self, columns: tuple, capacity: int = 1024) -> None:
+        """
+        Table of typed columns with a common row count, category columns hold codes into categories[column]
+
+        columns: ((name, type), ...)
+        """
+        self.column_types = dict(columns)
+        self.rows = 0
+        self._data = {name: np.empty(capacity, dtype=_column_dtype(kind)) for name, kind in columns}
+        self.categories = {name: [] for name, kind in columns if kind == "category"}
+        self._codes = {name: {} for name in self.categories}
+
+    def encode(self, name: str, values: np.ndarray) -> np.ndarray:
+        """Dictionary encode an array of bytes values of a category column"""
+        uniques, inverse = np.unique(values, return_inverse=True)
+        codes = self._codes[name]
+        lookup = np.empty(len(uniques), dtype=np.int32)
+        for i, value in enumerate(uniques):
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(self.categories[name])
+                self.categories[name].append(value.decode(errors="replace"))
+            lookup[i] = code
+        return lookup[inverse.reshape(-1)]
+
+    def append(self, columns: dict, n: int) -> None:
+        if self.rows + n > len(next(iter(self._data.values()))):
+            capacity = max(2 * (self.rows + n), 1024)
+            for name, data in self._data.items():
+                grown = np.empty(capacity, dtype=data.dtype)
+                grown[:self.rows] = data[:self.rows]
+                self._data[name] = grown
+        for name, values in columns.items():
+            self._data[name][self.rows:self.rows + n] = values
+        self.rows += n
+
+    def columns(self) -> dict:
+        """Column name -> numpy array (views, valid until the next append)"""
+        return {name: data[:self.rows] for name, data in self._data.items()}
+
+
+def _convert(raw: np.ndarray, kind: str, table: ColumnTable, name: str) -> np.ndarray:
+    if kind.startswith("flag:"):
+        return raw == kind[5:].encode()
+    if kind == "category":
+        return table.encode(name, raw)
+    missing = raw == b""
+    if missing.any():
+        raw = np.where(missing, b"-1" if kind == "int" else b"nan", raw)
+    return raw.astype(_TYPES[kind])
+
+
+class NsLogParser(object):
+    def __init__(self, kinds: tuple = None, filename: str = None) -> None:
+        """
+        Parse ns output chunks into one ColumnTable per event kind of EVENT_KINDS.
+        Can be added as OutputPump sink, the tables are saved to filename (.npz)
+        on close().
+        """
+        kinds = tuple(EVENT_KINDS) if kinds is None else kinds
+        self.filename = filename
+        self.kinds = {kind: EVENT_KINDS[kind] for kind in kinds}
+        self.tables = {kind: ColumnTable(tuple((name, t) for name, _, t in EVENT_KINDS[kind][1])) for kind in kinds}
+        self.bytes_parsed = 0
+        # EVENT_PATTERN matches after a newline, the text starts with one
+        self._pending = b"\n"
+
+    def __call__(self, chunk: bytes) -> None:
+        self.feed(chunk)
+
+    def feed(self, chunk: bytes) -> None:
+        """Parse the complete lines of chunk, an incomplete last line is kept for the next chunk"""
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            self._pending += chunk
+            return
+        text = self._pending + chunk[:end + 1]
+        self._pending = b"\n" + chunk[end + 1:]
+        self._parse(text)
+
+    def flush(self) -> None:
+        """Parse a remaining incomplete line"""
+        if len(self._pending) > 1:
+            text, self._pending = self._pending, b"\n"
+            self._parse(text)
+
+    def _parse(self, text: bytes) -> None:
+        self.bytes_parsed += len(text) - 1
+        groups = EVENT_PATTERN.findall(text)
+        if not groups:
+            return
+        # one row of group values per line, converted column by column
+        raw = np.array(groups, dtype=bytes)
+        for kind, (selector, columns) in self.kinds.items():
+            rows = raw if selector is None else raw[raw[:, selector] != b""]
+            if len(rows) == 0:
+                continue
+            table = self.tables[kind]
+            table.append({name: _convert(rows[:, group], column_type, table, name)
+                          for name, group, column_type in columns}, len(rows))
+
+    def close(self) -> None:
+        self.flush()
+        if self.filename is not None:
+            self.save(self.filename)
+
+    def table(self, kind: str) -> dict:
+        """Columns of an event kind as dict name -> numpy array, category columns as codes"""
+        return self.tables[kind].columns()
+
+    def to_dataframe(self, kind: str):
+        """pandas DataFrame of an event kind, category columns as pandas categoricals"""
+        import pandas as pd
+        table = self.tables[kind]
+        columns = table.columns()
+        for name, categories in table.categories.items():
+            columns[name] = pd.Categorical.from_codes(columns[name], categories)
+        return pd.DataFrame(columns)
+
+    def to_arrow(self, kind: str):
+        """pyarrow Table of an event kind, category columns as dictionary arrays"""
+        import pyarrow as pa
+        table = self.tables[kind]
+        columns = table.columns()
+        for name, categories in table.categories.items():
+            columns[name] = pa.DictionaryArray.from_arrays(columns[name], pa.array(categories, pa.string()))
+        return pa.table(columns)
+
+    def to_parquet(self, kind: str, filename: str) -> None:
+        import pyarrow.parquet as pq
+        pq.write_table(self.to_arrow(kind), filename)
+
+    def save(self, filename: str) -> None:
+        """Save all tables as compressed numpy archive with the arrays <kind>/<column>"""
+        arrays = {}
+        for kind, table in self.tables.items():
+            for name, data in table.columns().items():
+                arrays[f"{kind}/{name}"] = data
+            for name, categories in table.categories.items():
+                arrays[f"{kind}/{name}/categories"] = np.array(categories, dtype=str)
+        np.savez_compressed(filename, **arrays)
+        logger.info(f"Saved ns events to {filename}: " +
+                    ", ".join(f"{table.rows} {kind}" for kind, table in self.tables.items()))
+
+    @classmethod
+    def load(cls, filename: str) -> "NsLogParser":
+        """Load the tables saved by save()"""
+        with np.load(filename) as archive:
+            kinds = tuple(dict.fromkeys(key.split("/")[0] for key in archive.files))
+            parser = cls(kinds)
+            for kind, table in parser.tables.items():
+                columns = {name: archive[f"{kind}/{name}"] for name in table.column_types}
+                for name in table.categories:
+                    table.categories[name] = archive[f"{kind}/{name}/categories"].tolist()
+                    table._codes[name] = {c.encode(): i for i, c in enumerate(table.categories[name])}
+                table.append(columns, len(next(iter(columns.values()))))
+        return parser
+
+
+# compression suffix, also of rotated files (ns_run.log.gz.1)
+COMPRESSION_PATTERN = re.compile(r'\.(gz|zst)(\.\d+)?$')
+
+
+def open_log(filename: str):
+    m = COMPRESSION_PATTERN.search(filename)
+    compression = m.group(1) if m is not None else None
+    if compression == "gz":
+        return gzip.open(filename, "rb")
+    if compression == "zst":
+        if zstandard is None:
+            raise ValueError("zstd compressed logs need the zstandard package, install with `pip3 install zstandard`")
+        return zstandard.ZstdDecompressor().stream_reader(open(filename, "rb"), closefd=True)
+    return open(filename, "rb")
+
+
+def parse_files(filenames, kinds: tuple = None, chunk_size: int = 1 << 22) -> NsLogParser:
+    """Parse ns log files (plain, .gz or .zst, e.g. rotated ns_run.log.N oldest first) in chunks"""
+    parser = NsLogParser(kinds)
+    for filename in filenames:
+        with open_log(filename) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                parser.feed(chunk)
+        parser.flush()
+    return parser
+
+
+def main():
+    argparser = ArgumentParser(description='Parse ns logs into columnar event tables')
+    argparser.add_argument('files', nargs='+', help='ns log files (ns_run.log, .gz or .zst), oldest first')
+    argparser.add_argument('-o', '--output', default='ns_run.events.npz', help='Output file (.npz)')
+    argparser.add_argument('-k', '--kind', action='append', choices=list(EVENT_KINDS),
+                           help='Event kinds to parse (default: all)')
+    args = argparser.parse_args()
+    parser = parse_files(args.files, tuple(args.kind) if args.kind else None)
+    parser.save(args.output)
+    print(f"Parsed {parser.bytes_parsed / 1e6:.1f} MB into {args.output}")
+    for kind, table in parser.tables.items():
+        print(f"  {kind}: {table.rows} rows")
+
+
+if __name__ == '__main__':
+    main()
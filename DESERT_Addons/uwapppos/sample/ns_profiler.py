@@ -0,0 +1,121 @@
+import logging
+import threading
+import time
+
+import numpy as np
+import psutil
+
+from process_utils import get_child_process_by_name
+
+logger = logging.getLogger(__name__)
+
+# columns of the resource time series
+PROFILE_COLUMNS = ("t", "cpu_percent", "rss", "threads", "ctx_voluntary", "ctx_involuntary", "sockets")
+
+
+class NsProfiler(threading.Thread):
+    def __init__(self, parent_pid: int,
+                 filename: str,
+                 interval: float = 1.0,
+                 process_name: str = "ns") -> None:
+        """
+        Sample the resource usage of the ns process parent_pid or its ns child
+        process (parent_pid is the shell running run.sh) and store the time
+        series as compressed numpy archive.
+
+        filename: output file (.npz) with the columns PROFILE_COLUMNS
+        interval: sample interval in [s]
+        """
+        super().__init__(name="NsProfiler")
+        self.parent_pid = parent_pid
+        self.filename = filename
+        self.interval = interval
+        self.process_name = process_name
+        self.process = None
+        self.should_stop = threading.Event()
+        self._data = np.zeros((256, len(PROFILE_COLUMNS)))
+        self._rows = 0
+
+    def stop(self):
+        """stop the thread."""
+        self.should_stop.set()
+
+    def _sockets(self, p: psutil.Process) -> int:
+        connections = p.net_connections if hasattr(p, "net_connections") else p.connections
+        try:
+            return len(connections(kind="inet"))
+        except psutil.AccessDenied:
+            return -1
+
+    def _append(self, row: tuple) -> None:
+        if self._rows == len(self._data):
+            self._data = np.resize(self._data, (2 * len(self._data), len(PROFILE_COLUMNS)))
+        self._data[self._rows] = row
+        self._rows += 1
+
+    def _find_process(self) -> bool:
+        while not self.should_stop.is_set() and psutil.pid_exists(self.parent_pid):
+            self.process = get_child_process_by_name(self.parent_pid, self.process_name)
+            if self.process is not None:
+                logger.info(f"Profiling {self.process_name} process {self.process.pid}")
+                return True
+            self.should_stop.wait(0.05)
+        return False
+
+    def run(self):
+        if not self._find_process():
+            logger.warning(f"No {self.process_name} child of process {self.parent_pid} found, nothing profiled")
+            return
+        p = self.process
+        t0 = time.monotonic()
+        try:
+            p.cpu_percent()  # first call initializes the CPU measurement
+            while not self.should_stop.wait(self.interval):
+                with p.oneshot():
+                    ctx = p.num_ctx_switches()
+                    self._append((time.monotonic() - t0,
+                                  p.cpu_percent(),
+                                  p.memory_info().rss,
+                                  p.num_threads(),
+                                  ctx.voluntary,
+                                  ctx.involuntary,
+                                  self._sockets(p)))
+        except psutil.NoSuchProcess:
+            pass
+        self.save()
+        self.log_summary()
+
+    def series(self) -> dict:
+        """Return the recorded time series as dict column name -> numpy array"""
+        data = self._data[:self._rows]
+        return {name: data[:, i] for i, name in enumerate(PROFILE_COLUMNS)}
+
+    def save(self) -> None:
+        np.savez_compressed(self.filename, **self.series())
+        logger.info(f"Saved {self._rows} resource samples of {self.process_name} to {self.filename}")
+
+    def summary(self) -> dict:
+        s = self.series()
+        if self._rows == 0:
+            return {}
+        return {
+            "samples": self._rows,
+            "duration": float(s["t"][-1]),
+            "cpu_percent_mean": float(s["cpu_percent"].mean()),
+            "cpu_percent_max": float(s["cpu_percent"].max()),
+            "rss_max": int(s["rss"].max()),
+            "threads_max": int(s["threads"].max()),
+            "ctx_voluntary": int(s["ctx_voluntary"][-1]),
+            "ctx_involuntary": int(s["ctx_involuntary"][-1]),
+            "sockets_max": int(s["sockets"].max()),
+        }
+
+    def log_summary(self) -> None:
+        s = self.summary()
+        if not s:
+            return
+        print(f"{self.process_name} resource usage over {s['duration']:.1f} s: "
+              f"CPU mean {s['cpu_percent_mean']:.1f} % max {s['cpu_percent_max']:.1f} %, "
+              f"RSS max {s['rss_max'] / 2**20:.1f} MiB, threads max {s['threads_max']}, "
+              f"context switches {s['ctx_voluntary']} voluntary / {s['ctx_involuntary']} involuntary, "
+              f"sockets max {s['sockets_max']}")
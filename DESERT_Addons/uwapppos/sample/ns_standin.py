@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+Pure Python stand-in for ns running uwAppPos.tcl / uwAppPos_UDP.tcl.
+
+Reads the opt(...) settings of the generated tcl script and opens the same
+sockets as the uwAppPos modules: the application socket on app_port_base + id
+(TCP server, received packets are sent to the client with 'D' + length
+framing, or UDP, received packets are sent to app_send_host:app_send_port_base + id)
+and the position socket on app_pos_port_base + id, or one shared batch
+position socket on app_pos_batch_port.
+Packets are forwarded with configurable delay and loss instead of simulating
+the acoustic channel, so the Python harness can be run and benchmarked without
+a DESERT build. With opt(sync_port) (uwAppPos.tcl of --clock virtual) the
+stand-in runs on the simulation time in lock-step with the harness like ns.
+
+python3 ns_standin.py uwAppPos.tcl --delay 0.5 --loss 0.1
+"""
+
+import asyncio
+import heapq
+import math
+import os
+import random
+import re
+import shlex
+import sys
+import time
+from argparse import ArgumentParser
+
+from frame_decoder import FRAME_START
+from mobility import POSITION_STRUCT, unpack_position_batch
+from scenario import OPT_PATTERN, SCRIPT_DIR
+
+# ns uses read(max_read_length) on the application socket, each read is one packet
+MAX_READ_LEN = 255
+
+GREEN = "\x1b[1;32m"
+RESET = "\x1b[0m"
+
+APPPOS_DEBUG_PATTERN = re.compile(r'^\s*Module/UW/APPPOS\s+set\s+debug_\s+(-?\d+)', re.MULTILINE)
+
+
+def parse_tcl_options(filename: str) -> dict:
+    """Return the opt(name) values of a tcl script, numbers are converted to float"""
+    with open(filename, "rt") as f:
+        text = f.read()
+    opts = {}
+    for _, name, value in OPT_PATTERN.findall(text):
+        value = value.strip('"').rstrip(';')
+        try:
+            opts[name] = float(value)
+        except ValueError:
+            opts[name] = value
+    m = None
+    for m in APPPOS_DEBUG_PATTERN.finditer(text):
+        pass
+    opts["apppos_debug"] = int(m.group(1)) if m is not None else 0
+    return opts
+
+
+def _set_process_name(name: str) -> None:
+    """Show up as name in ps and psutil (Linux only), so the harness finds the stand-in like ns"""
+    try:
+        import ctypes
+        ctypes.CDLL(None).prctl(15, name.encode(), 0, 0, 0)  # PR_SET_NAME
+    except Exception:
+        pass
+
+
+class _AppTcpProtocol(asyncio.Protocol):
+    def __init__(self, standin: 'NsStandin', node_id: int) -> None:
+        self.standin = standin
+        self.node_id = node_id
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.standin.clients[self.node_id].add(transport)
+
+    def data_received(self, data):
+        for i in range(0, len(data), MAX_READ_LEN):
+            self.standin.on_packet(self.node_id, data[i:i + MAX_READ_LEN])
+
+    def connection_lost(self, exc):
+        self.standin.clients[self.node_id].discard(self.transport)
+
+
+class _AppUdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, standin: 'NsStandin', node_id: int) -> None:
+        self.standin = standin
+        self.node_id = node_id
+
+    def datagram_received(self, data, addr):
+        self.standin.on_packet(self.node_id, data[:MAX_READ_LEN])
+
+
+class _PositionProtocol(asyncio.DatagramProtocol):
+    def __init__(self, standin: 'NsStandin', node_id: int) -> None:
+        self.standin = standin
+        self.node_id = node_id
+
+    def datagram_received(self, data, addr):
+        self.standin.on_position(self.node_id, data)
+
+
+class _BatchPositionProtocol(asyncio.DatagramProtocol):
+    def __init__(self, standin: 'NsStandin') -> None:
+        self.standin = standin
+
+    def datagram_received(self, data, addr):
+        self.standin.on_position_batch(data)
+
+
+class NsStandin(object):
+    def __init__(self, opts: dict,
+                 mode: str = "broadcast",
+                 delay: float = 0.0,
+                 jitter: float = 0.0,
+                 loss: float = 0.0,
+                 sound_speed: float = 0.0,
+                 linger: float = 10.0,
+                 seed: int = None) -> None:
+        """
+        opts: opt(...) settings of the tcl script, see parse_tcl_options()
+        mode: broadcast (to all other nodes, destAddr 255 of the templates),
+              sink (to node 1) or echo (back to the sender)
+        delay, jitter: fixed delay and uniformly distributed extra delay in [s]
+        loss: packet loss probability
+        sound_speed: add the propagation delay between the last received node positions, 0 to disable
+        linger: time in [s] ns keeps running after opt(stop)
+        """
+        self.protocol = opts.get("protocol", "tcp")
+        self.num_nodes = int(opts.get("nn", 1)) + 1
+        self.start_time = opts.get("start", 0.0)
+        self.stop_time = opts.get("stop", 15.0)
+        self.port_base = int(opts["app_port_base"])
+        self.pos_port_base = int(opts["app_pos_port_base"])
+        self.pos_batch_port = int(opts.get("app_pos_batch_port", 0))
+        self.send_host = opts.get("app_send_host", "127.0.0.1")
+        self.send_port_base = int(opts.get("app_send_port_base", 0))
+        self.debug = opts.get("apppos_debug", 0)
+        self.sync_host = opts.get("sync_host", "127.0.0.1")
+        self.sync_port = int(opts.get("sync_port", 0))
+        self.sync_step = opts.get("sync_step", 0.1)
+        self.mode = mode
+        self.delay = delay
+        self.jitter = jitter
+        self.loss = loss
+        self.sound_speed = sound_speed
+        self.linger = linger
+        self.rng = random.Random(seed)
+        self.node_ids = list(range(1, self.num_nodes + 1))
+        self.clients = {node_id: set() for node_id in self.node_ids}
+        self.positions = {}
+        self.sent = {node_id: 0 for node_id in self.node_ids}
+        self.received = {node_id: 0 for node_id in self.node_ids}
+        self.lost = 0
+        self.position_updates = 0
+        self._loop = None
+        self._app_transports = {}
+        self._servers = []
+        self._pos_transports = []
+        self._t0 = None
+        # lock-step mode: simulation time and pending (time, sequence, callback, args) events
+        self._sim_time = 0.0
+        self._events = []
+        self._event_seq = 0
+
+    def now(self) -> float:
+        """Simulation time in [s]"""
+        if self.sync_port:
+            return self._sim_time
+        return time.monotonic() - self._t0
+
+    def _call_later(self, delay: float, callback, *args) -> None:
+        if not self.sync_port:
+            self._loop.call_later(delay, callback, *args)
+            return
+        self._event_seq += 1
+        heapq.heappush(self._events, (self._sim_time + delay, self._event_seq, callback, args))
+
+    def log(self, msg: str) -> None:
+        print(f"{GREEN}{time.time():.0f}::{self.now():.6f}::{msg}{RESET}", flush=True)
+
+    def destinations(self, src: int) -> list:
+        if self.mode == "echo":
+            return [src]
+        if self.mode == "sink":
+            return [1] if src != 1 else []
+        return [n for n in self.node_ids if n != src]
+
+    def propagation_delay(self, src: int, dst: int) -> float:
+        if self.sound_speed <= 0.0 or src not in self.positions or dst not in self.positions:
+            return 0.0
+        return math.dist(self.positions[src], self.positions[dst]) / self.sound_speed
+
+    def on_packet(self, src: int, payload: bytes) -> None:
+        self.sent[src] += 1
+        for dst in self.destinations(src):
+            if self.loss > 0.0 and self.rng.random() < self.loss:
+                self.lost += 1
+                continue
+            delay = self.delay + self.propagation_delay(src, dst)
+            if self.jitter > 0.0:
+                delay += self.rng.uniform(0.0, self.jitter)
+            if delay > 0.0:
+                self._call_later(delay, self.deliver, dst, payload)
+            else:
+                self.deliver(dst, payload)
+
+    def deliver(self, dst: int, payload: bytes) -> None:
+        if self.protocol == "tcp":
+            if not self.clients[dst]:
+                return
+            frame = bytes((FRAME_START, len(payload))) + payload
+            for transport in self.clients[dst]:
+                transport.write(frame)
+        else:
+            transport = self._app_transports.get(dst)
+            if transport is None:
+                return
+            transport.sendto(payload, (self.send_host, self.send_port_base + dst))
+        self.received[dst] += 1
+
+    def on_position(self, node_id: int, data: bytes) -> None:
+        if len(data) != POSITION_STRUCT.size:
+            return
+        self._set_position(node_id, *POSITION_STRUCT.unpack(data))
+
+    def on_position_batch(self, data: bytes) -> None:
+        try:
+            records = unpack_position_batch(data)
+        except ValueError as e:
+            self.log(f"UWAPPPOS: ignoring invalid batch datagram, {e}")
+            return
+        for node_id, geodetic, x, y, z in records[["node_id", "geodetic", "x", "y", "z"]].tolist():
+            if node_id in self.clients:
+                self._set_position(node_id, geodetic, x, y, z)
+
+    def _set_position(self, node_id: int, geodetic: bool, x: float, y: float, z: float) -> None:
+        self.positions[node_id] = (x, y, z)
+        self.position_updates += 1
+        if self.debug >= 2:
+            self.log(f"{node_id}::UWAPPPOS: setting {'geodetic' if geodetic else 'local'} node position to ({x:g},{y:g},{z:g})")
+
+    async def _open(self) -> None:
+        loop = self._loop
+        for node_id in self.node_ids:
+            port = self.port_base + node_id
+            if self.protocol == "tcp":
+                server = await loop.create_server(lambda n=node_id: _AppTcpProtocol(self, n), "127.0.0.1", port,
+                                                  reuse_address=True)
+                self._servers.append(server)
+            else:
+                transport, _ = await loop.create_datagram_endpoint(lambda n=node_id: _AppUdpProtocol(self, n),
+                                                                   local_addr=("0.0.0.0", port))
+                self._app_transports[node_id] = transport
+            if self.pos_batch_port > 0:
+                # one listener shared by all nodes, like BatchPositionListener
+                if not self._pos_transports:
+                    transport, _ = await loop.create_datagram_endpoint(lambda: _BatchPositionProtocol(self),
+                                                                       local_addr=("0.0.0.0", self.pos_batch_port))
+                    self._pos_transports.append(transport)
+                pos_port = self.pos_batch_port
+            else:
+                pos_port = self.pos_port_base + node_id
+                transport, _ = await loop.create_datagram_endpoint(lambda n=node_id: _PositionProtocol(self, n),
+                                                                   local_addr=("0.0.0.0", pos_port))
+                self._pos_transports.append(transport)
+            if self.debug >= 1:
+                self.log(f"{node_id}::UWAPPPOS: starting position listener on port {pos_port}")
+
+    def _close(self) -> None:
+        print("Stopping nodes...", flush=True)
+        for server in self._servers:
+            server.close()
+        for clients in self.clients.values():
+            for transport in list(clients):
+                transport.close()
+        for transport in list(self._app_transports.values()) + self._pos_transports:
+            transport.close()
+        self._app_transports = {}
+
+    async def _run_lockstep(self) -> None:
+        """Run on the simulation time, report it at every synchronization point and wait for the harness"""
+        reader, writer = await asyncio.open_connection(self.sync_host, self.sync_port)
+        halt = self.stop_time + self.linger
+        next_sync = 0.0
+        opened = closed = False
+        while True:
+            t = min(next_sync, halt, self._events[0][0] if self._events else math.inf,
+                    self.start_time if not opened else math.inf, self.stop_time if not closed else math.inf)
+            self._sim_time = max(self._sim_time, t)
+            # same order as in ns: the nodes start and stop before the synchronization point of the same time
+            if not opened and t >= self.start_time:
+                await self._open()
+                opened = True
+            if not closed and t >= self.stop_time:
+                self._close()
+                closed = True
+            if t >= halt:
+                break
+            while self._events and self._events[0][0] <= t:
+                _, _, callback, args = heapq.heappop(self._events)
+                callback(*args)
+            if t < next_sync:
+                continue
+            writer.write(f"T {t:.9f}\n".encode())
+            await writer.drain()
+            fields = (await reader.readline()).split()
+            if not fields or fields[0] != b"GO":
+                print("Harness closed the sync socket, halting", flush=True)
+                break
+            next_sync = float(fields[1])
+            if next_sync <= t:
+                next_sync = t + self.sync_step
+            # serve the messages the harness sent for this synchronization point
+            await asyncio.sleep(0)
+        if not closed:
+            self._close()
+        writer.close()
+        self.print_summary()
+
+    async def run_async(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._t0 = time.monotonic()
+        for node_id in self.node_ids:
+            print(f"Creating node {node_id}... sending to {self.mode}", flush=True)
+        if self.sync_port:
+            await self._run_lockstep()
+            return
+        await asyncio.sleep(self.start_time)
+        await self._open()
+        await asyncio.sleep(max(0.0, self.stop_time - self.now()))
+        self._close()
+        await asyncio.sleep(self.linger)
+        self.print_summary()
+
+    def run(self) -> None:
+        try:
+            asyncio.run(self.run_async())
+        except KeyboardInterrupt:
+            self.print_summary()
+
+    def print_summary(self) -> None:
+        sent = sum(self.sent.values())
+        received = sum(self.received.values())
+        print("---------------------------------------------------------------------")
+        print("Simulation summary (ns stand-in)")
+        print(f"number of nodes  : {self.num_nodes - 1}")
+        print(f"simulation length: {self.stop_time - self.start_time:g} s")
+        print("---------------------------------------------------------------------")
+        print(f"Sent Packets             : {sent}")
+        print(f"Received Packets         : {received}")
+        print(f"Lost Packets             : {self.lost}")
+        print(f"Position updates         : {self.position_updates}")
+        print("done!", flush=True)
+
+
+def add_standin_arguments(argparser, prefix: str = "") -> None:
+    """Stand-in options, with prefix 'standin-' for the harness scripts"""
+    group = argparser.add_argument_group('ns stand-in')
+    group.add_argument(f'--{prefix}mode', choices=('broadcast', 'sink', 'echo'), default='broadcast',
+                       help='Forward packets to all other nodes, to node 1 or back to the sender')
+    group.add_argument(f'--{prefix}delay', type=float, default=0.0, help='Fixed packet delay in [s]')
+    group.add_argument(f'--{prefix}jitter', type=float, default=0.0, help='Uniformly distributed extra delay in [s]')
+    group.add_argument(f'--{prefix}loss', type=float, default=0.0, help='Packet loss probability')
+    group.add_argument(f'--{prefix}sound-speed', type=float, default=1500.0,
+                       help='Add the propagation delay between the node positions, 0 to disable')
+    group.add_argument(f'--{prefix}linger', type=float, default=10.0,
+                       help='Keep running for the given time in [s] after the stop time of the script')
+    group.add_argument(f'--{prefix}seed', type=int, default=None, help='Seed of the loss and jitter generator')
+
+
+def standin_argv(args, script: str) -> list:
+    """Command to run the stand-in instead of ns, args parsed with add_standin_arguments(prefix='standin-')"""
+    cmd = [sys.executable, os.path.join(SCRIPT_DIR, "ns_standin.py"), script,
+           "--mode", args.standin_mode,
+           "--delay", str(args.standin_delay),
+           "--jitter", str(args.standin_jitter),
+           "--loss", str(args.standin_loss),
+           "--sound-speed", str(args.standin_sound_speed),
+           "--linger", str(args.standin_linger)]
+    if args.standin_seed is not None:
+        cmd += ["--seed", str(args.standin_seed)]
+    return cmd
+
+
+def standin_command(args, script: str) -> str:
+    """Command line of standin_argv() for run.sh"""
+    return shlex.join(standin_argv(args, script))
+
+
+def main():
+    argparser = ArgumentParser(description='Pure Python stand-in for ns running a uwAppPos tcl script.')
+    argparser.add_argument('script', help='Generated tcl script (uwAppPos.tcl or uwAppPos_UDP.tcl)')
+    add_standin_arguments(argparser)
+    args = argparser.parse_args()
+
+    _set_process_name("ns")
+    standin = NsStandin(parse_tcl_options(args.script),
+                        mode=args.mode,
+                        delay=args.delay,
+                        jitter=args.jitter,
+                        loss=args.loss,
+                        sound_speed=args.sound_speed,
+                        linger=args.linger,
+                        seed=args.seed)
+    standin.run()
+
+
+if __name__ == '__main__':
+    main()
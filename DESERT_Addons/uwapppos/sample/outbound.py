@@ -0,0 +1,213 @@
+"""
+Bounded outbound queue of a TCP node socket.
+
+Messages are lists of buffers (e.g. measurement header and payload), they are
+written with one vectored sendmsg() for as many queued messages as possible.
+A partial write keeps the unsent tail as memoryview slices, the rest is sent
+when the socket becomes writable, so the byte stream to ns is never cut. When
+the queued bytes exceed the high-water mark the caller blocks, the oldest
+unsent message is dropped or the new message is rejected (see QUEUE_POLICIES).
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+QUEUE_POLICIES = ("block", "drop_oldest", "reject")
+
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+
+class OutboundQueue(object):
+    def __init__(self, sock, high_water: int = 64 * 1024, policy: str = "block", on_discard=None,
+                 wakeup: bool = False) -> None:
+        """
+        sock: non-blocking connected socket
+        high_water: maximum queued bytes, a single larger message is always accepted by an empty queue
+        policy: behaviour of put() on a full queue, see QUEUE_POLICIES
+        on_discard: callback(count) for messages dropped or rejected by the queue
+        wakeup: the queue can be selected, see fileno()
+        """
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy '{policy}'")
+        self.sock = sock
+        self.high_water = high_water
+        self.policy = policy
+        self.on_discard = on_discard
+        self.depth = 0
+        self.max_depth = 0
+        self.sent = 0
+        self.partial_writes = 0
+        self.stalls = 0
+        self.stall_time = 0.0
+        self.dropped = 0
+        self.rejected = 0
+        self.closed = False
+        # unsent messages, lists of memoryviews, the first one may be partially sent
+        self._messages = collections.deque()
+        self._head_started = False
+        self._cond = threading.Condition()
+        self._wakeup_r = None
+        self._wakeup_w = None
+        if wakeup:
+            self._wakeup_r, self._wakeup_w = os.pipe()
+            os.set_blocking(self._wakeup_r, False)
+            os.set_blocking(self._wakeup_w, False)
+
+    def fileno(self) -> int:
+        """Readable when a put() left unsent data, wait for the socket to become writable then and flush()"""
+        return self._wakeup_r
+
+    def clear_wakeup(self) -> None:
+        try:
+            os.read(self._wakeup_r, 4096)
+        except BlockingIOError:
+            pass
+
+    def full(self, size: int) -> bool:
+        """True if a message of size bytes exceeds the high-water mark"""
+        return self.depth > 0 and self.depth + size > self.high_water
+
+    def record_stall(self, seconds: float) -> None:
+        self.stalls += 1
+        self.stall_time += seconds
+
+    def put(self, parts, wait: bool = True) -> bool:
+        """
+        Queue a message (bytes-like object or list of them) and send as much as
+        possible, returns False if it was rejected or the queue is closed.
+        With the block policy put() waits for the flush() of another thread,
+        wait=False accepts the message above the high-water mark instead (the
+        caller of an event loop waits before, see full()).
+        """
+        if not isinstance(parts, (list, tuple)):
+            parts = (parts,)
+        message = [memoryview(part).cast("B") for part in parts if len(part)]
+        size = sum(len(part) for part in message)
+        discarded = 0
+        with self._cond:
+            if self.full(size) and not self.closed:
+                if self.policy == "reject":
+                    self.rejected += 1
+                    discarded = 1
+                elif self.policy == "drop_oldest":
+                    discarded = self._drop_oldest(size)
+                elif wait:
+                    start = time.monotonic()
+                    self._cond.wait_for(lambda: self.closed or not self.full(size))
+                    self.record_stall(time.monotonic() - start)
+            accepted = not self.closed and not (self.policy == "reject" and discarded)
+            if accepted and size:
+                stalled = self.pending
+                self._messages.append(message)
+                self.depth += size
+                self.max_depth = max(self.max_depth, self.depth)
+                # send at once unless the socket is stalled already
+                if not stalled and not self._flush() and self._wakeup_w is not None:
+                    try:
+                        os.write(self._wakeup_w, b"\0")
+                    except BlockingIOError:
+                        pass
+        if discarded and self.on_discard is not None:
+            self.on_discard(discarded)
+        return accepted
+
+    def _drop_oldest(self, size: int) -> int:
+        """Drop unsent messages until size fits, never the partially sent head of the stream"""
+        keep = 1 if self._head_started else 0
+        dropped = 0
+        while len(self._messages) > keep and self.full(size):
+            message = self._messages[keep]
+            del self._messages[keep]
+            self.depth -= sum(len(part) for part in message)
+            dropped += 1
+        self.dropped += dropped
+        return dropped
+
+    def _flush(self) -> bool:
+        while self._messages:
+            buffers = []
+            for message in self._messages:
+                if buffers and len(buffers) + len(message) > IOV_MAX:
+                    break
+                buffers.extend(message)
+            try:
+                n = self.sock.sendmsg(buffers)
+            except (BlockingIOError, InterruptedError):
+                return False
+            self.depth -= n
+            self._consume(n)
+            self._cond.notify_all()
+            if n < sum(len(b) for b in buffers):
+                self.partial_writes += 1
+                return False
+        return True
+
+    def _consume(self, n: int) -> None:
+        """Remove n sent bytes from the front of the queue"""
+        while n:
+            message = self._messages[0]
+            while message and n >= len(message[0]):
+                n -= len(message.pop(0))
+            if message:
+                # partial write, keep the unsent tail
+                message[0] = message[0][n:]
+                self._head_started = True
+                return
+            self._messages.popleft()
+            self._head_started = False
+            self.sent += 1
+
+    def flush(self) -> bool:
+        """Send queued data until EAGAIN, True if the queue is empty, can be called from any thread"""
+        with self._cond:
+            return self._flush()
+
+    @property
+    def pending(self) -> bool:
+        return self.depth > 0
+
+    def close(self) -> None:
+        """Release blocked put() calls, the unsent messages are discarded"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        for fd in (self._wakeup_r, self._wakeup_w):
+            if fd is not None:
+                os.close(fd)
+        self._wakeup_r = self._wakeup_w = None
+
+    def stats(self) -> dict:
+        return {"depth": self.depth, "max_depth": self.max_depth, "sent": self.sent,
+                "partial_writes": self.partial_writes, "stalls": self.stalls, "stall_time": self.stall_time,
+                "dropped": self.dropped, "rejected": self.rejected}
+
+
+def print_queue_summary(queues: dict) -> None:
+    """Summary of the OutboundQueues of all nodes, queues maps node id -> queue"""
+    if not queues:
+        return
+    deepest = max(queues, key=lambda node_id: queues[node_id].max_depth)
+    total = {key: sum(q.stats()[key] for q in queues.values())
+             for key in ("partial_writes", "stalls", "stall_time", "dropped", "rejected")}
+    print(f"Outbound queues: max depth {queues[deepest].max_depth} bytes (node {deepest}), "
+          f"{total['partial_writes']} partial writes, {total['stalls']} stalls for {total['stall_time']:.3f} s, "
+          f"{total['dropped']} dropped, {total['rejected']} rejected")
+    if total["dropped"] or total["rejected"]:
+        print("  dropped and rejected messages are not counted as sent, they never reached ns")
+
+
+def add_queue_arguments(argparser) -> None:
+    group = argparser.add_argument_group('outbound queue')
+    group.add_argument('--queue-size', type=int, default=64 * 1024,
+                       help='High-water mark of the outbound queue of a TCP node in [bytes]')
+    group.add_argument('--queue-policy', choices=QUEUE_POLICIES, default='block',
+                       help='On a full queue block the traffic scheduler, drop the oldest unsent message '
+                            'or reject the new one')
@@ -0,0 +1,247 @@
+import gzip
+import logging
+import os
+import re
+import selectors
+import sys
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from ns_log import NsLogParser
+
+logger = logging.getLogger(__name__)
+
+# 7-bit and 8-bit C1 ANSI sequences
+ansi_escape_8bit = re.compile(br'''
+    (?: # either 7-bit C1, two bytes, ESC Fe (omitting CSI)
+        \x1B
+        [@-Z\\-_]
+    |   # or a single 8-bit byte Fe (omitting CSI)
+        [\x80-\x9A\x9C-\x9F]
+    |   # or CSI + control codes
+        (?: # 7-bit CSI, ESC [
+            \x1B\[
+        |   # 8-bit CSI, 9B
+            \x9B
+        )
+        [0-?]*  # Parameter bytes
+        [ -/]*  # Intermediate bytes
+        [@-~]   # Final byte
+    )
+''', re.VERBOSE)
+
+# longest escape sequence kept back at the end of a chunk
+MAX_PENDING_ESCAPE = 32
+
+COMPRESSION_SUFFIX = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+
+class AnsiStripper(object):
+    """Remove ANSI escape sequences from a byte stream chunk by chunk"""
+
+    def __init__(self) -> None:
+        self.pending = b""
+
+    def strip(self, chunk: bytes) -> bytes:
+        if self.pending:
+            chunk = self.pending + chunk
+            self.pending = b""
+        # keep back an escape sequence which may continue in the next chunk
+        tail = max(chunk.rfind(b"\x1b", -MAX_PENDING_ESCAPE), chunk.rfind(b"\x9b", -MAX_PENDING_ESCAPE))
+        if tail >= 0 and ansi_escape_8bit.match(chunk, tail) is None:
+            self.pending = chunk[tail:]
+            chunk = chunk[:tail]
+        return ansi_escape_8bit.sub(b"", chunk)
+
+    def flush(self) -> bytes:
+        data, self.pending = self.pending, b""
+        return ansi_escape_8bit.sub(b"", data)
+
+
+def check_compression(compression: str) -> None:
+    """Raises ValueError if the compression is unknown or its package is not installed"""
+    if compression not in COMPRESSION_SUFFIX:
+        raise ValueError(f"Unknown compression '{compression}'")
+    if compression == "zstd" and zstandard is None:
+        raise ValueError("zstd compression needs the zstandard package, install with `pip3 install zstandard`")
+
+
+class RotatingLogWriter(object):
+    def __init__(self, filename: str,
+                 compression: str = "none",
+                 max_bytes: int = 0,
+                 backup_count: int = 10,
+                 level: int = 3) -> None:
+        """
+        Binary log file writer with optional gzip/zstd compression and size rotation.
+
+        filename: log file name, the compression suffix (.gz, .zst) is appended
+        max_bytes: rotate after max_bytes uncompressed bytes, 0 to never rotate
+        backup_count: number of rotated files kept (filename.1 is the newest)
+        level: compression level
+        """
+        check_compression(compression)
+        self.filename = filename + COMPRESSION_SUFFIX[compression]
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.level = level
+        self.written = 0
+        self._raw = None
+        self._file = None
+        self._open()
+
+    def _open(self) -> None:
+        if self.compression == "gzip":
+            self._file = gzip.open(self.filename, "wb", compresslevel=self.level)
+        elif self.compression == "zstd":
+            self._raw = open(self.filename, "wb")
+            self._file = zstandard.ZstdCompressor(level=self.level).stream_writer(self._raw)
+        else:
+            self._file = open(self.filename, "wb", buffering=1 << 20)
+        self.written = 0
+
+    def _rotate(self) -> None:
+        self.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.filename}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.filename}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.filename, f"{self.filename}.1")
+        self._open()
+
+    def write(self, data: bytes) -> None:
+        if self.max_bytes and self.written + len(data) > self.max_bytes and self.written > 0:
+            self._rotate()
+        self._file.write(data)
+        self.written += len(data)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._raw is not None:
+            self._raw.close()
+            self._raw = None
+
+
+class OutputPump(threading.Thread):
+    def __init__(self, proc,
+                 filename_out: str,
+                 filename_err: str,
+                 echo: bool = True,
+                 compression: str = "none",
+                 max_bytes: int = 0,
+                 chunk_size: int = 1 << 16) -> None:
+        """
+        Drain stdout and stderr of proc as soon as they are readable, in chunks of
+        up to chunk_size bytes, so ns never blocks on a full pipe.
+        ANSI sequences are stripped per chunk before writing to the log files.
+
+        echo: write stdout of proc to the terminal
+        compression, max_bytes: see RotatingLogWriter
+        """
+        super().__init__(name="OutputPump")
+        self.proc = proc
+        self.echo = echo
+        self.chunk_size = chunk_size
+        self.should_stop = False
+        self.sinks = []
+        self.bytes_out = 0
+        self.bytes_err = 0
+        self.lines_out = 0
+        self.file_out = RotatingLogWriter(filename_out, compression, max_bytes)
+        self.file_err = RotatingLogWriter(filename_err, compression, max_bytes)
+
+    def add_sink(self, sink) -> None:
+        """
+        Add a callable which gets every ANSI stripped stdout chunk (bytes, not split at line ends),
+        its close() method (if any) is called when the process output ends
+        """
+        self.sinks.append(sink)
+
+    def stop(self):
+        """stop the thread."""
+        self.should_stop = True
+
+    def _handle_stdout(self, data: bytes, stripper: AnsiStripper) -> None:
+        self.bytes_out += len(data)
+        self.lines_out += data.count(b"\n")
+        if self.echo:
+            sys.stdout.buffer.write(data)
+            sys.stdout.flush()
+        clean = stripper.strip(data)
+        self.file_out.write(clean)
+        for sink in self.sinks:
+            sink(clean)
+
+    def _handle_stderr(self, data: bytes) -> None:
+        self.bytes_err += len(data)
+        logger.error(data.decode(errors="replace").rstrip())
+        self.file_err.write(data)
+
+    def run(self):
+        stripper = AnsiStripper()
+        sel = selectors.DefaultSelector()
+        for f, handler in ((self.proc.stdout, self._handle_stdout), (self.proc.stderr, self._handle_stderr)):
+            os.set_blocking(f.fileno(), False)
+            sel.register(f.fileno(), selectors.EVENT_READ, handler)
+        while sel.get_map() and not self.should_stop:
+            for key, _ in sel.select(timeout=1.0):
+                try:
+                    data = os.read(key.fd, self.chunk_size)
+                except BlockingIOError:
+                    continue
+                if not data:
+                    # pipe closed by the process
+                    sel.unregister(key.fd)
+                elif key.data == self._handle_stdout:
+                    self._handle_stdout(data, stripper)
+                else:
+                    key.data(data)
+        sel.close()
+        rest = stripper.flush()
+        if rest:
+            self.file_out.write(rest)
+            for sink in self.sinks:
+                sink(rest)
+        for sink in self.sinks:
+            if hasattr(sink, "close"):
+                sink.close()
+        logger.info("OutputPump: observed process terminated, closing files")
+        self.file_out.close()
+        self.file_err.close()
+
+
+def add_output_arguments(argparser) -> None:
+    group = argparser.add_argument_group('ns output')
+    group.add_argument('--no-echo', action='store_true', help='Do not echo the ns output to the terminal')
+    group.add_argument('--log-compression', choices=list(COMPRESSION_SUFFIX), default='none',
+                       help='Compression of the ns log files')
+    group.add_argument('--log-max-size', type=float, default=0.0,
+                       help='Rotate the ns log files after the given size in [MB], 0 to never rotate')
+    group.add_argument('--ns-events', default=None,
+                       help='Parse the structured ns log lines while running and save them as columnar '
+                            'event tables to the given file (.npz), see ns_log.py')
+
+
+def check_output_args(args) -> None:
+    """Raises ValueError for log options the OutputPump cannot open, call it before ns is started"""
+    check_compression(args.log_compression)
+    if args.log_max_size < 0.0:
+        raise ValueError("The maximum log size must be >= 0")
+
+
+def pump_from_args(args, proc, filename_out: str = 'ns_run.log', filename_err: str = 'ns_run.err') -> OutputPump:
+    pump = OutputPump(proc, filename_out, filename_err,
+                      echo=not args.no_echo,
+                      compression=args.log_compression,
+                      max_bytes=int(args.log_max_size * 1e6))
+    if args.ns_events:
+        pump.add_sink(NsLogParser(filename=args.ns_events))
+    return pump
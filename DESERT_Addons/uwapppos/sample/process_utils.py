@@ -25,3 +25,23 @@ def get_process_id_by_name_port(process_name, port):
             if c.status == 'LISTEN' and c.laddr.port == port:
                 return p
     return None
+
+
+def get_child_process_by_name(parent_pid, process_name):
+    """
+    Get the given parent process if it has the given name, otherwise its first
+    (recursive) child with the given name (ns started directly or through run.sh)
+
+    ns_process = get_child_process_by_name(bash_proc.pid, 'ns')
+    print("PID", ns_process.pid)
+    """
+    try:
+        parent = psutil.Process(parent_pid)
+        if parent.name() == process_name:
+            return parent
+        for child in parent.children(recursive=True):
+            if child.name() == process_name:
+                return child
+    except psutil.NoSuchProcess:
+        pass
+    return None
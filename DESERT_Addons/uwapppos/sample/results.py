@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Results store of harness runs, e.g. the scenario directories of a sweep.
+
+Every directory with an ns log (ns_run.log, also compressed or rotated) is a
+run. Runs are indexed by the opt(...) parameters of their generated tcl
+script and summarized in a process pool: ns summary (throughput, sent and
+received packets), delivery ratio, throughput and latency percentiles of stats.json,
+position updates of the ns log and warnings/errors of python.log and
+ns_run.err. Summaries are cached by the hash of the run files in
+<root>/.results_cache.json, the files are only hashed again when their size
+or modification time changed, so an unchanged sweep is loaded in milliseconds.
+
+python3 results.py sweep -c bitrate -m "delivery ratio" -m "latency p99 [ms]"
+
+store = ResultsStore(["sweep"]).refresh()
+store.query(bitrate=4800, nn=4)
+store.compare("bitrate", ["delivery ratio", "ns mean throughput"])
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+from ns_log import NsLogParser, open_log
+from scenario import OPT_PATTERN
+from sweep import NS_SUMMARY_PATTERN, delivery_ratio, print_table, write_table
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = ".results_cache.json"
+CACHE_VERSION = 2
+
+# current ns log, also compressed, and its rotated files (.1 is the newest)
+NS_LOG_PATTERN = re.compile(r'^ns_run\.log(\.gz|\.zst)?(\.\d+)?$')
+# files of a run which make up its summary
+RUN_FILE_PATTERN = re.compile(r'^(ns_run\.log(\.gz|\.zst)?(\.\d+)?|ns_run\.err.*|python\.log|stats\.json|.*\.tcl)$')
+PYTHON_LEVEL_PATTERN = re.compile(rb'^PYTHON \S+ (WARNING|ERROR|CRITICAL):', re.MULTILINE)
+
+# parameters which differ per run without changing the scenario, e.g. the port blocks of a sweep
+PORT_PARAM_PATTERN = re.compile(r'port')
+
+# read this many bytes at the end of the current ns log for the summary of the finish proc
+SUMMARY_TAIL = 1 << 16
+
+
+def run_files(path: str) -> list:
+    """(name, size, mtime_ns) of the files of a run, sorted by name"""
+    files = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file() and RUN_FILE_PATTERN.match(entry.name):
+                st = entry.stat()
+                files.append((entry.name, st.st_size, st.st_mtime_ns))
+    return sorted(files)
+
+
+def hash_run(path: str, files: list) -> str:
+    """Hash of the contents of the run files"""
+    h = hashlib.blake2b(digest_size=16)
+    for name, _, _ in files:
+        h.update(name.encode() + b"\0")
+        with open(os.path.join(path, name), "rb") as f:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def _ns_logs(names: list) -> tuple:
+    """(rotated logs oldest first + current log, current log or None)"""
+    logs = [name for name in names if NS_LOG_PATTERN.match(name)]
+    current = [name for name in logs if NS_LOG_PATTERN.match(name).group(2) is None]
+    rotated = sorted((name for name in logs if name not in current),
+                     key=lambda name: int(NS_LOG_PATTERN.match(name).group(2)[1:]), reverse=True)
+    return rotated + current[:1], (current[0] if current else None)
+
+
+def read_params(path: str, names: list) -> dict:
+    """opt(...) values of the tcl script of a run, numbers as float"""
+    params = {}
+    for name in names:
+        if name.endswith(".tcl"):
+            with open(os.path.join(path, name), "rt", errors="replace") as f:
+                for _, key, value in OPT_PATTERN.findall(f.read()):
+                    value = value.strip('"')
+                    try:
+                        params[key] = float(value)
+                    except ValueError:
+                        params[key] = value
+    return params
+
+
+def summarize_run(path: str, names: list) -> dict:
+    """Summary of one run, runs in a worker process"""
+    summary = {}
+    logs, current = _ns_logs(names)
+    parser = NsLogParser(("position", "listener"))
+    tail = b""
+    for name in logs:
+        with open_log(os.path.join(path, name)) as f:
+            while True:
+                chunk = f.read(1 << 22)
+                if not chunk:
+                    break
+                parser.feed(chunk)
+                if name == current:
+                    tail = (tail + chunk)[-SUMMARY_TAIL:]
+        parser.flush()
+    summary["position updates"] = int(parser.tables["position"].rows)
+    summary["position nodes"] = len(set(parser.table("position")["node"].tolist()))
+    summary["position listeners"] = int(parser.tables["listener"].rows)
+    for name, value in NS_SUMMARY_PATTERN.findall(tail.decode(errors="replace")):
+        summary[f"ns {name.lower()}"] = float(value)
+    if "stats.json" in names:
+        with open(os.path.join(path, "stats.json"), "rt") as f:
+            stats = json.load(f)
+        summary.update({"sent": stats["sent"], "received": stats["received"], "delivery ratio": delivery_ratio(stats)})
+        # ns prints its Mean Throughput only in some scenarios, the harness measures every run
+        duration = stats.get("duration_s")
+        if duration:
+            summary["throughput [bit/s]"] = 8.0 * stats["received_bytes"] / duration
+        for name in ("p50", "p99", "max"):
+            value = stats["latency"][f"{name}_us"]
+            summary[f"latency {name} [ms]"] = value / 1e3 if value is not None else None
+    if "python.log" in names:
+        levels = []
+        with open(os.path.join(path, "python.log"), "rb") as f:
+            pending = b""
+            while True:
+                chunk = f.read(1 << 22)
+                if not chunk:
+                    break
+                # the last line may continue in the next chunk
+                end = chunk.rfind(b"\n") + 1
+                if end == 0:
+                    pending += chunk
+                    continue
+                levels += PYTHON_LEVEL_PATTERN.findall(pending + chunk[:end])
+                pending = chunk[end:]
+            levels += PYTHON_LEVEL_PATTERN.findall(pending)
+        summary["python warnings"] = levels.count(b"WARNING")
+        summary["python errors"] = len(levels) - summary["python warnings"]
+    errors = 0
+    for name in names:
+        if name.startswith("ns_run.err"):
+            with open_log(os.path.join(path, name)) as f:
+                while True:
+                    chunk = f.read(1 << 22)
+                    if not chunk:
+                        break
+                    errors += chunk.count(b"\n")
+    summary["ns error lines"] = errors
+    return summary
+
+
+def _analyze(path: str, files: list, known: frozenset) -> tuple:
+    """(hash, summary or None if the hash is known) of a run, runs in a worker process"""
+    digest = hash_run(path, files)
+    if digest in known:
+        return digest, None
+    return digest, summarize_run(path, [name for name, _, _ in files])
+
+
+class Run(object):
+    def __init__(self, path: str, params: dict, summary: dict, digest: str) -> None:
+        """One run: directory, opt(...) parameters and summary"""
+        self.path = path
+        self.params = params
+        self.summary = summary
+        self.digest = digest
+
+    def get(self, key: str, default=None):
+        """Value of a parameter or summary metric"""
+        if key in self.summary:
+            return self.summary[key]
+        return self.params.get(key, default)
+
+    def row(self, params: list = None) -> dict:
+        """Table row with the given parameters (default: all) and the summary"""
+        keys = self.params if params is None else params
+        return {"run": self.path, **{k: self.params.get(k) for k in keys}, **self.summary}
+
+    def __repr__(self) -> str:
+        return f"Run({self.path!r})"
+
+
+def _matches(value, wanted) -> bool:
+    if isinstance(wanted, (list, tuple, set)):
+        return any(_matches(value, w) for w in wanted)
+    try:
+        return float(value) == float(wanted)
+    except (TypeError, ValueError):
+        return str(value) == str(wanted)
+
+
+class ResultsStore(object):
+    def __init__(self, roots, cache_file: str = None, jobs: int = None) -> None:
+        """
+        Runs below the root directories, summaries cached in cache_file
+        (default: <first root>/.results_cache.json), computed by jobs processes
+        """
+        self.roots = [roots] if isinstance(roots, str) else list(roots)
+        self.cache_file = cache_file or os.path.join(self.roots[0], CACHE_FILE)
+        self.jobs = jobs
+        self.runs = []
+        self.analyzed = 0
+        self.cached = 0
+
+    def _load_cache(self) -> dict:
+        try:
+            with open(self.cache_file, "rt") as f:
+                cache = json.load(f)
+            if cache.get("version") == CACHE_VERSION:
+                return cache
+        except (OSError, ValueError):
+            pass
+        return {"version": CACHE_VERSION, "runs": {}, "summaries": {}}
+
+    def _save_cache(self, cache: dict) -> None:
+        tmp = f"{self.cache_file}.tmp"
+        with open(tmp, "wt") as f:
+            json.dump(cache, f)
+        os.replace(tmp, self.cache_file)
+
+    def discover(self) -> list:
+        """Directories of all runs below the roots"""
+        paths = []
+        for root in self.roots:
+            for path, dirs, names in os.walk(root):
+                dirs.sort()
+                if any(NS_LOG_PATTERN.match(name) for name in names):
+                    paths.append(os.path.normpath(path))
+        return paths
+
+    def refresh(self) -> 'ResultsStore':
+        """Index the runs, analyze new and changed runs in parallel"""
+        start = time.monotonic()
+        cache = self._load_cache()
+        entries = {}
+        stale = []
+        for path in self.discover():
+            files = run_files(path)
+            key = os.path.abspath(path)
+            entry = cache["runs"].get(key)
+            signature = [list(f) for f in files]
+            if entry is not None and entry["files"] == signature and entry["hash"] in cache["summaries"]:
+                entries[path] = entry
+            else:
+                entries[path] = {"files": signature, "hash": None, "params": read_params(path, [f[0] for f in files])}
+                stale.append((path, files))
+        if stale:
+            known = frozenset(cache["summaries"])
+            with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                results = executor.map(_analyze, [p for p, _ in stale], [f for _, f in stale],
+                                       [known] * len(stale))
+                for (path, _), (digest, summary) in zip(stale, results):
+                    entries[path]["hash"] = digest
+                    if summary is not None:
+                        cache["summaries"][digest] = summary
+        self.analyzed = len(stale)
+        self.cached = len(entries) - len(stale)
+        runs = {os.path.abspath(path): entry for path, entry in entries.items()}
+        if stale:
+            # runs below other roots share the cache file, keep their entries
+            cache["runs"].update(runs)
+            used = {entry["hash"] for entry in cache["runs"].values()}
+            cache["summaries"] = {h: s for h, s in cache["summaries"].items() if h in used}
+            self._save_cache(cache)
+        self.runs = [Run(path, entry["params"], cache["summaries"][entry["hash"]], entry["hash"])
+                     for path, entry in sorted(entries.items())]
+        logger.info(f"{len(self.runs)} runs ({self.analyzed} analyzed, {self.cached} cached) "
+                    f"in {1e3 * (time.monotonic() - start):.1f} ms")
+        return self
+
+    def query(self, where=None, **params) -> list:
+        """Runs with the given parameter values (a value or a list of values) for which where(run) is true"""
+        runs = [run for run in self.runs if all(_matches(run.get(k), v) for k, v in params.items())]
+        if where is not None:
+            runs = [run for run in runs if where(run)]
+        return runs
+
+    def varying(self, runs: list = None) -> list:
+        """Parameters with more than one value among the runs, except the socket ports"""
+        runs = self.runs if runs is None else runs
+        keys = sorted({k for run in runs for k in run.params if not PORT_PARAM_PATTERN.search(k)})
+        return [k for k in keys if len({str(run.params.get(k)) for run in runs}) > 1]
+
+    def table(self, runs: list = None, params: list = None) -> list:
+        """One row per run with the given parameters (default: the varying ones) and the summary"""
+        runs = self.runs if runs is None else runs
+        return [run.row(self.varying(runs) if params is None else params) for run in runs]
+
+    def compare(self, by, metrics: list, runs: list = None) -> list:
+        """
+        Group the runs by the values of the parameter(s) by and return one row per
+        group with the number of runs and the mean of each metric
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        runs = self.runs if runs is None else runs
+        groups = {}
+        for run in runs:
+            groups.setdefault(tuple(run.params.get(k) for k in by), []).append(run)
+        rows = []
+        for values, group in sorted(groups.items(), key=lambda item: [str(v) for v in item[0]]):
+            row = {**dict(zip(by, values)), "runs": len(group)}
+            for metric in metrics:
+                samples = [run.get(metric) for run in group if run.get(metric) is not None]
+                row[metric] = sum(samples) / len(samples) if samples else None
+            rows.append(row)
+        return rows
+
+    def to_dataframe(self, runs: list = None):
+        """pandas DataFrame of table()"""
+        import pandas as pd
+        return pd.DataFrame(self.table(runs))
+
+
+def main():
+    argparser = ArgumentParser(description='Summarize, query and compare harness runs (e.g. the scenarios of a sweep)')
+    argparser.add_argument('roots', nargs='+', help='Directories with runs')
+    argparser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Number of analysis processes')
+    argparser.add_argument('-w', '--where', action='append', default=[], metavar='KEY=V1,V2,...',
+                           help='Only runs with one of the given values of the parameter or metric')
+    argparser.add_argument('-c', '--compare', default=None, metavar='KEY[,KEY]',
+                           help='Group the runs by the given parameters and compare the mean of the metrics')
+    argparser.add_argument('-m', '--metric', action='append', default=None,
+                           help='Metric of --compare (default: delivery ratio, latency p99 [ms], ns mean throughput)')
+    argparser.add_argument('-o', '--output', default=None, help='Write the table to the given CSV file')
+    argparser.add_argument('--cache-file', default=None, help=f'Summary cache (default: <first root>/{CACHE_FILE})')
+    args = argparser.parse_args()
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+
+    store = ResultsStore(args.roots, args.cache_file, args.jobs).refresh()
+    params = {}
+    for item in args.where:
+        key, sep, values = item.partition('=')
+        if not sep:
+            argparser.error(f"Invalid filter '{item}', expected key=value[,value...]")
+        params[key] = values.split(',')
+    runs = store.query(**params)
+    if args.compare:
+        metrics = args.metric or ["delivery ratio", "latency p99 [ms]", "ns mean throughput"]
+        rows = store.compare(args.compare.split(','), metrics, runs)
+    else:
+        rows = store.table(runs)
+    if rows:
+        print_table(rows)
+    else:
+        print("No runs found")
+    if args.output:
+        write_table(rows, args.output)
+        print(f"Table written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Saturation finder: the maximum sustainable offered load per configuration.
+
+For every configuration of the grid (opt(...) overrides like bitrate, freq,
+ack_mode, or the harness keys n / t) the harness is run with increasing
+--offered-load, multiplied by --factor per step, until the delivery ratio
+drops below 1 - --max-loss or the p99 latency exceeds --max-p99. The knee
+between the last sustainable and the first saturated load is then narrowed
+down by bisection (geometric mean of the bounds). Every step is one scenario
+of sweep.py, i.e. a complete harness run (template rendering, ns launch) in
+its own work directory and port block. Configurations run in parallel.
+With --traffic burst the load is the mean over the burst cycle.
+
+python3 saturation.py -g bitrate=4800,9600 -g ack_mode=1,2 --start-load 0.2 -t 120 -b ~/DESERT_buildCopy_LOCAL
+"""
+
+import math
+import os
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+from sweep import PortAllocator, expand_grid, max_num_nodes, parse_grid, print_table, run_scenario, write_table
+
+
+class SaturationSearch(object):
+    def __init__(self, index: int, params: dict, args, harness_args: list, ports: PortAllocator) -> None:
+        """
+        Ramp and bisection of the offered load of one configuration,
+        the steps are run in <out-dir>/config_<index>/scenario_<step>
+        """
+        self.index = index
+        self.params = params
+        self.args = args
+        self.harness_args = harness_args
+        self.ports = ports
+        self.out_dir = os.path.join(args.out_dir, f"config_{index:03d}")
+        self.steps = []
+
+    def measure(self, load: float) -> dict:
+        """Run the harness at the offered load and return its result row with the verdict"""
+        row = run_scenario(len(self.steps), self.params, self.args.udp,
+                           ["--offered-load", f"{load:.6g}"] + self.harness_args, self.out_dir, self.ports)
+        row = {"config": self.index, "offered load": load, **row}
+        row["sustainable"], row["reason"] = self.verdict(row)
+        self.steps.append(row)
+        print(f"Config {self.index} {self.params}: load {load:.4g} -> delivery ratio {row.get('delivery ratio')}, "
+              f"p99 {row.get('latency p99 [ms]')} ms: {row['reason']}", flush=True)
+        return row
+
+    def verdict(self, row: dict) -> tuple:
+        if row["exit code"] != 0 or "delivery ratio" not in row:
+            return False, f"harness failed with exit code {row['exit code']}"
+        ratio = row["delivery ratio"]
+        if ratio is None:
+            # run time too short for the load, no verdict
+            return None, "nothing sent"
+        if ratio < 1.0 - self.args.max_loss:
+            return False, f"loss {100.0 * (1.0 - ratio):.1f} %"
+        p99 = row["latency p99 [ms]"]
+        if self.args.max_p99 is not None and p99 > self.args.max_p99:
+            return False, f"p99 latency {p99:.0f} ms"
+        return True, "ok"
+
+    def run(self) -> dict:
+        """Return the summary row of the configuration"""
+        good = None
+        bad = None
+        load = self.args.start_load
+        # ramp until the link saturates
+        while load <= self.args.max_load:
+            row = self.measure(load)
+            if row["sustainable"] is False:
+                bad = row
+                break
+            if row["sustainable"]:
+                good = row
+            load *= self.args.factor
+        # narrow down the knee
+        if good is not None and bad is not None and bad["exit code"] == 0:
+            for _ in range(self.args.bisect_steps):
+                load = math.sqrt(good["offered load"] * bad["offered load"])
+                row = self.measure(load)
+                if row["sustainable"] is False:
+                    bad = row
+                elif row["sustainable"]:
+                    good = row
+                else:
+                    break
+        summary = {"config": self.index, **self.params}
+        if good is None:
+            summary["max sustainable load"] = None
+            if bad is None:
+                summary["result"] = "no messages sent, increase the run time"
+            else:
+                summary["result"] = f"saturated at the start load: {bad['reason']}"
+        else:
+            summary["max sustainable load"] = good["offered load"]
+            summary["delivery ratio"] = good.get("delivery ratio")
+            summary["latency p99 [ms]"] = good.get("latency p99 [ms]")
+            if "ns mean throughput" in good:
+                summary["ns mean throughput"] = good["ns mean throughput"]
+            if bad is None:
+                summary["result"] = f"not saturated up to {self.args.max_load:g}"
+            else:
+                summary["knee"] = bad["offered load"]
+                summary["result"] = bad["reason"]
+        summary["steps"] = len(self.steps)
+        return summary
+
+
+def main():
+    argparser = ArgumentParser(allow_abbrev=False,
+                               description='Find the maximum sustainable offered load of each configuration by a ramp '
+                                           'and bisection. Unknown arguments are passed to every harness.')
+    argparser.add_argument('-g', '--grid', action='append', default=[], metavar='KEY=V1,V2,...',
+                           help='Configurations, n/num_nodes and t/run_time are harness arguments, '
+                                'other keys override opt(KEY) of the tcl template')
+    argparser.add_argument('--start-load', type=float, default=0.1,
+                           help='First offered load (messages/s, or bits/s with --load-unit bit)')
+    argparser.add_argument('--factor', type=float, default=2.0, help='Load factor of the ramp steps')
+    argparser.add_argument('--max-load', type=float, default=100.0, help='Stop the ramp above this load')
+    argparser.add_argument('--bisect-steps', type=int, default=4, help='Bisection steps between the ramp bounds')
+    argparser.add_argument('--max-loss', type=float, default=0.05, help='Maximum sustainable loss ratio')
+    argparser.add_argument('--max-p99', type=float, default=None,
+                           help='Maximum sustainable p99 latency in [ms], default: no limit')
+    argparser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Number of configurations run at once')
+    argparser.add_argument('-u', '--udp', action='store_true', help='Run test_sockets_UDP.py instead of test_sockets.py')
+    argparser.add_argument('-d', '--out-dir', default='saturation', help='Directory for the work directories')
+    argparser.add_argument('--port-base', type=int, default=20000, help='First port of the scenario port blocks')
+    args, harness_args = argparser.parse_known_args()
+    if args.start_load <= 0.0 or args.factor <= 1.0:
+        argparser.error("The start load must be > 0 and the factor > 1")
+    traffic = ArgumentParser(add_help=False)
+    traffic.add_argument('--traffic', default='constant')
+    if traffic.parse_known_args(harness_args)[0].traffic == 'trace':
+        argparser.error("--traffic trace sends at the times of the trace, its offered load cannot be ramped")
+
+    try:
+        configs = expand_grid(parse_grid(args.grid))
+        # the number of nodes may be a harness argument or a grid key
+        ports = PortAllocator(args.port_base, max_num_nodes(configs, harness_args) + 2)
+    except ValueError as e:
+        argparser.error(str(e))
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    print(f"Searching the saturation of {len(configs)} configuration(s), {args.jobs} at once")
+    searches = [SaturationSearch(i, params, args, harness_args, ports) for i, params in enumerate(configs)]
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        summaries = list(executor.map(SaturationSearch.run, searches))
+
+    steps = [row for search in searches for row in search.steps]
+    write_table(steps, os.path.join(args.out_dir, "steps.csv"))
+    results = os.path.join(args.out_dir, "saturation.csv")
+    write_table(summaries, results)
+    print_table(summaries)
+    print(f"Results written to {results}, all steps to {os.path.join(args.out_dir, 'steps.csv')}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+from string import Template
+
+logger = logging.getLogger(__name__)
+
+# directory of the templates and scripts, the generated files are written to the work directory
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# set opt(name) value of the tcl templates
+OPT_PATTERN = re.compile(r'^(\s*set\s+opt\((\w+)\)\s+)("[^"]*"|[^\s;]+)', re.MULTILINE)
+
+# input files of the command line, resolved before changing to the work directory
+INPUT_PATH_ARGUMENTS = ('build_dir', 'trajectory', 'traffic_trace', 'replay')
+
+
+class CustomTemplate(Template):
+    delimiter = '%$%'
+
+
+def parse_opt_overrides(items) -> dict:
+    """Parse ['txpower=130', 'bitrate=9600'] into a dict"""
+    overrides = {}
+    for item in items or []:
+        key, sep, value = item.partition('=')
+        if not sep or not key:
+            raise ValueError(f"Invalid option override '{item}', expected key=value")
+        overrides[key.strip()] = value.strip()
+    return overrides
+
+
+def override_tcl_options(text: str, overrides: dict) -> str:
+    """Replace the values of the set opt(key) lines, raises KeyError for options not in the script"""
+    missing = set(overrides)
+
+    def replace(m):
+        name = m.group(2)
+        if name not in overrides:
+            return m.group(0)
+        missing.discard(name)
+        value = str(overrides[name])
+        if m.group(3).startswith('"'):
+            value = f'"{value}"'
+        return m.group(1) + value
+
+    text = OPT_PATTERN.sub(replace, text)
+    if missing:
+        raise KeyError(f"Unknown tcl option(s): {', '.join(sorted(missing))}")
+    return text
+
+
+def _render(template: str, overrides: dict, substitutions: dict) -> str:
+    out = CustomTemplate(template).substitute(**substitutions)
+    if overrides:
+        out = override_tcl_options(out, overrides)
+    return out
+
+
+def render_script(template_file: str, filename: str, overrides: dict = None, cache_dir: str = None,
+                  **substitutions) -> None:
+    """
+    Substitute the %$%{TMPL_...} placeholders of template_file, apply the opt overrides and write filename.
+    With cache_dir the rendered scripts are cached by a hash of the template content and the
+    parameters, a cached script is copied instead of rendered again.
+    """
+    with open(template_file, 'rt') as f:
+        template = f.read()
+    if cache_dir is None:
+        with open(filename, 'wt') as f:
+            f.write(_render(template, overrides, substitutions))
+        return
+
+    key = hashlib.sha256(template.encode())
+    key.update(json.dumps([substitutions, overrides or {}], sort_keys=True, default=str).encode())
+    cached = os.path.join(cache_dir, "scripts", key.hexdigest() + ".tcl")
+    if not os.path.exists(cached):
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        tmp_file = f"{cached}.{os.getpid()}"
+        with open(tmp_file, 'wt') as f:
+            f.write(_render(template, overrides, substitutions))
+        os.replace(tmp_file, cached)
+    else:
+        logger.debug(f"Using cached script {cached}")
+    shutil.copyfile(cached, filename)
+
+
+def add_scenario_arguments(argparser, app_port_base: int, pos_port_base: int, app_send_port_base: int = None) -> None:
+    group = argparser.add_argument_group('scenario')
+    group.add_argument('-w', '--work-dir', default='.',
+                       help='Directory for the generated tcl script, run.sh and the log files')
+    group.add_argument('-o', '--opt', action='append', default=[], metavar='KEY=VALUE',
+                       help='Override opt(KEY) of the tcl template, e.g. -o txpower=130 -o bitrate=9600')
+    group.add_argument('--app-port-base', type=int, default=app_port_base,
+                       help='Application socket port base (port = base + node id)')
+    group.add_argument('--pos-port-base', type=int, default=pos_port_base,
+                       help='Position socket port base (port = base + node id)')
+    if app_send_port_base is not None:
+        group.add_argument('--app-send-port-base', type=int, default=app_send_port_base,
+                           help='Port base ns sends the received data to (port = base + node id)')
+
+
+def enter_work_dir(args) -> None:
+    """Create and change to the work directory, input paths of the command line are made absolute first"""
+    for name in INPUT_PATH_ARGUMENTS:
+        if getattr(args, name, None):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    os.makedirs(args.work_dir, exist_ok=True)
+    os.chdir(args.work_dir)
@@ -0,0 +1,433 @@
+"""
+Multi-process node sharding of the harness.
+
+With --workers N the node ids are spread round-robin across N worker
+processes. Each one drives the application sockets (app_port_base + id) of
+its nodes with an AsyncNodeDriver and sends their positions with its own
+PosWorker. The workers count every message in one shared memory block
+(SharedStats): per node counters and one latency histogram per worker,
+each slot written by a single process, so the parent aggregates them live
+from numpy views without locks and without pickling per message.
+
+The parent keeps ns, its output and the lifecycle. It waits until all
+shards opened their sockets (see startup.py) and then releases the traffic
+of all workers at once.
+"""
+
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from latency import NUM_BUCKETS, LatencyHistogram, bucket_index, decode_payload, encode_header, encode_payload
+from log_pipeline import setup_logging, stop_logging
+from startup import Startup
+
+logger = logging.getLogger(__name__)
+
+# per node counters, indexed by node id, written by the worker of the node
+NODE_DTYPE = np.dtype([(name, "<i8") for name in (
+    "sent", "discarded", "received", "received_bytes", "ready_ns", "failed",
+    "queue_max_depth", "queue_partial_writes", "queue_stalls", "queue_stall_us", "queue_dropped", "queue_rejected")])
+
+# per worker counters, written by the worker
+WORKER_DTYPE = np.dtype([(name, "<i8") for name in (
+    "state", "unknown", "latency_count", "latency_total", "latency_min", "latency_max", "first_sent_ns",
+    "last_received_ns",
+    "scheduled", "lateness_sum_us", "lateness_max_us",
+    "position_sent", "position_dropped", "position_suppressed")])
+
+# worker states
+WORKER_STARTING = 0
+WORKER_READY = 1
+WORKER_DONE = 2
+
+
+class SharedStats(object):
+    def __init__(self, num_slots: int, workers: int, name: str = None) -> None:
+        """
+        Counters of num_slots node ids (0..num_slots - 1) and workers worker
+        processes in one shared memory block, created if name is None, else attached
+        """
+        self.num_slots = num_slots
+        self.workers_count = workers
+        sizes = (num_slots * NODE_DTYPE.itemsize, workers * WORKER_DTYPE.itemsize, workers * NUM_BUCKETS * 8)
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=sum(sizes))
+            self.shm.buf[:sum(sizes)] = bytes(sum(sizes))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.nodes = np.ndarray(num_slots, dtype=NODE_DTYPE, buffer=self.shm.buf)
+        self.workers = np.ndarray(workers, dtype=WORKER_DTYPE, buffer=self.shm.buf, offset=sizes[0])
+        self.histograms = np.ndarray((workers, NUM_BUCKETS), dtype="<i8", buffer=self.shm.buf,
+                                     offset=sizes[0] + sizes[1])
+
+    def close(self) -> None:
+        """Release the views, the creator also removes the block"""
+        self.nodes = self.workers = self.histograms = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def histogram(self) -> LatencyHistogram:
+        """Latency histogram [us] merged over all workers"""
+        histogram = LatencyHistogram()
+        histogram.counts = self.histograms.sum(axis=0).tolist()
+        counted = self.workers[self.workers["latency_count"] > 0]
+        histogram.count = int(counted["latency_count"].sum())
+        histogram.total = int(counted["latency_total"].sum())
+        if len(counted):
+            histogram.min = int(counted["latency_min"].min())
+            histogram.max = int(counted["latency_max"].max())
+        return histogram
+
+    def summary(self) -> dict:
+        """
+        Same keys as LatencyTracker.summary(), expected replaces the flows: every
+        message is expected at all other ready nodes, also at those which received nothing
+        """
+        nodes = self.nodes.copy()
+        sent = nodes["sent"] - nodes["discarded"]
+        receivers = (nodes["ready_ns"] > 0) & (nodes["failed"] == 0)
+        expected = int((sent * (np.count_nonzero(receivers) - receivers)).sum())
+        first_sent = self.workers["first_sent_ns"][self.workers["first_sent_ns"] > 0]
+        last_received = int(self.workers["last_received_ns"].max())
+        duration = None
+        if len(first_sent) and last_received:
+            duration = (last_received - int(first_sent.min())) / 1e9
+        return {
+            "sent": int(sent.sum()),
+            "discarded": int(nodes["discarded"].sum()),
+            "received": int(nodes["received"].sum()),
+            "received_bytes": int(nodes["received_bytes"].sum()),
+            "duration_s": duration,
+            "expected": expected,
+            "unknown_payloads": int(self.workers["unknown"].sum()),
+            "latency": self.histogram().to_dict(),
+            "flows": [],
+        }
+
+    def export_json(self, filename: str) -> None:
+        import json
+        with open(filename, "wt") as f:
+            json.dump(self.summary(), f, indent=2)
+        logger.info(f"Latency statistics written to {filename}")
+
+    def print_summary(self) -> None:
+        s = self.summary()
+        ratio = f"{100.0 * s['received'] / s['expected']:.1f} %" if s["expected"] else "-"
+        print(f"Messages sent: {s['sent']}, received: {s['received']} of {s['expected']} expected ({ratio}), "
+              f"other payloads: {s['unknown_payloads']}"
+              + (f", discarded by the harness: {s['discarded']}" if s["discarded"] else ""))
+        lat = s["latency"]
+        if lat["count"]:
+            print(f"  latency p50 {lat['p50_us'] / 1e3:.1f} ms p99 {lat['p99_us'] / 1e3:.1f} ms "
+                  f"max {lat['max_us'] / 1e3:.1f} ms")
+
+
+class SharedTracker(object):
+    def __init__(self, stats: SharedStats, worker: int, measure: bool = True) -> None:
+        """
+        Tracker of a worker process for the AsyncNodeDriver (same interface as
+        LatencyTracker), counts into the SharedStats. Without measure the
+        payloads are sent unchanged and only counted.
+        """
+        self.stats = stats
+        self.worker = worker
+        self.measure = measure
+        self._nodes = stats.nodes
+        self._counters = stats.workers[worker:worker + 1]
+        self._histogram = stats.histograms[worker]
+        self._seq = {}
+
+    def _next_seq(self, src: int, t_ns: int) -> int:
+        seq = self._seq.get(src, 0)
+        self._seq[src] = seq + 1
+        self._nodes["sent"][src] += 1
+        if seq == 0 and self._counters["first_sent_ns"][0] == 0:
+            self._counters["first_sent_ns"] = t_ns
+        return seq
+
+    def next_payload(self, src: int, text: bytes = b"") -> bytes:
+        t_ns = time.monotonic_ns()
+        seq = self._next_seq(src, t_ns)
+        return encode_payload(src, seq, t_ns, text) if self.measure else text
+
+    def next_message(self, src: int, text: bytes = b"") -> list:
+        t_ns = time.monotonic_ns()
+        seq = self._next_seq(src, t_ns)
+        return [encode_header(src, seq, t_ns), text] if self.measure else [text]
+
+    def discard(self, src: int, count: int = 1) -> None:
+        self._nodes["discarded"][src] += count
+
+    def on_receive(self, dst: int, data):
+        now = time.monotonic_ns()
+        self._nodes["received"][dst] += 1
+        self._nodes["received_bytes"][dst] += len(data)
+        self._counters["last_received_ns"] = now
+        if not self.measure:
+            return None
+        decoded = decode_payload(data)
+        counters = self._counters
+        if decoded is None:
+            counters["unknown"] += 1
+            return None
+        latency_us = max(0, (now - decoded[2]) // 1000)
+        self._histogram[bucket_index(latency_us)] += 1
+        count = int(counters["latency_count"][0])
+        counters["latency_total"] += latency_us
+        if count == 0 or latency_us < counters["latency_min"][0]:
+            counters["latency_min"] = latency_us
+        if latency_us > counters["latency_max"][0]:
+            counters["latency_max"] = latency_us
+        counters["latency_count"] = count + 1
+        return latency_us / 1e6
+
+
+def run_shard(config: dict) -> None:
+    """Entry point of a worker process, config see ShardPool._config()"""
+    from mobility import PosWorker, dead_reckoning_from_args, engine_from_args
+    from node_driver import AsyncNodeDriver, payload_size
+    from traffic import TrafficScheduler, profile_factory
+
+    # the parent handles Ctrl-C and stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    args = config["args"]
+    index = config["index"]
+    logging.basicConfig(format=f'PYTHON %(asctime)s.%(msecs)03d %(levelname)s: [shard {index}] %(message)s',
+                        datefmt='%H:%M:%S', level=config["log_level"], force=True)
+    if args.event_log:
+        args.event_log = f"{args.event_log}.{index}"
+    setup_logging(args)
+    if args.seed is not None:
+        args.seed += index
+    stats = SharedStats(config["num_slots"], config["workers"], config["shm"])
+    counters = stats.workers[index:index + 1]
+    node_ids = config["node_ids"]
+    measure = args.measure_latency or args.stats_json is not None
+    tracker = SharedTracker(stats, index, measure)
+    first, largest = args.connect_backoff
+    startup = Startup(node_ids, args.startup_timeout, first, largest, start=config["start"])
+    scheduler = TrafficScheduler()
+    driver = AsyncNodeDriver(config["protocol"], config["host"], config["app_port_base"],
+                             config.get("app_send_port_base"), startup=startup, tracker=tracker,
+                             scheduler=scheduler, go=config["go"],
+                             **config["driver_options"])
+    create_profile = profile_factory(args, args.num_nodes,
+                                     payload_size(args.num_nodes + 1, tracker if measure else None))
+    for node_id in node_ids:
+        driver.add_node(node_id, 0.0, profile=create_profile(node_id) if node_id != 1 else None)
+    driver_thread = threading.Thread(target=driver.run, name="AsyncNodeDriver")
+    driver_thread.start()
+    startup.wait()
+    for node_id, t in startup.ready.items():
+        stats.nodes["ready_ns"][node_id] = int(t * 1e9)
+    for node_id in startup.failed:
+        stats.nodes["failed"][node_id] = 1
+    counters["state"] = WORKER_READY
+
+    config["go"].wait()
+    pos_worker = None
+    if not config["stop"].is_set() and (not args.trajectory or index == 0):
+        engine = engine_from_args(args, args.num_nodes, node_ids=None if args.trajectory else set(node_ids))
+        if len(engine):
+            pos_worker = PosWorker(engine, args.pos_interval, config["host"], config["pos_port_base"],
+                                   config["pos_batch_port"], args.pos_batch_timestamps,
+                                   dead_reckoning_from_args(args))
+            pos_worker.start()
+    config["traffic_stop"].wait()
+    scheduler.clear()
+    config["stop"].wait()
+    driver.stop()
+    if pos_worker is not None:
+        pos_worker.stop()
+        pos_worker.join()
+        counters["position_sent"] = pos_worker.updates_sent
+        counters["position_dropped"] = pos_worker.updates_dropped
+        counters["position_suppressed"] = pos_worker.updates_suppressed
+    driver_thread.join()
+    summary = scheduler.summary()
+    counters["scheduled"] = summary["messages"]
+    counters["lateness_sum_us"] = int(1e6 * summary["lateness_mean"] * summary["messages"])
+    counters["lateness_max_us"] = int(1e6 * summary["lateness_max"])
+    for node_id, queue in driver.queues().items():
+        q = queue.stats()
+        row = stats.nodes[node_id:node_id + 1]
+        row["queue_max_depth"] = q["max_depth"]
+        row["queue_partial_writes"] = q["partial_writes"]
+        row["queue_stalls"] = q["stalls"]
+        row["queue_stall_us"] = int(1e6 * q["stall_time"])
+        row["queue_dropped"] = q["dropped"]
+        row["queue_rejected"] = q["rejected"]
+    counters["state"] = WORKER_DONE
+    counters = None
+    tracker = None
+    stop_logging()
+    stats.close()
+
+
+class ShardPool(threading.Thread):
+    def __init__(self, args, protocol: str, node_ids: list, startup: Startup, host: str, app_port_base: int,
+                 pos_port_base: int, pos_batch_port: int = 0, app_send_port_base: int = None,
+                 driver_options: dict = None, report_interval: float = 5.0) -> None:
+        """
+        Run the nodes node_ids in args.workers worker processes (run_shard).
+        The pool feeds the readiness of the nodes into startup and starts the
+        traffic of all workers when every node is ready or failed.
+
+        driver_options: further keyword arguments of the AsyncNodeDriver of the workers
+        report_interval: log the aggregated counters every report_interval [s], 0 to disable
+        """
+        super().__init__(name="ShardPool")
+        self.args = args
+        self.protocol = protocol
+        self.node_ids = list(node_ids)
+        self.startup = startup
+        self.host = host
+        self.app_port_base = app_port_base
+        self.app_send_port_base = app_send_port_base
+        self.pos_port_base = pos_port_base
+        self.pos_batch_port = pos_batch_port
+        self.driver_options = driver_options or {}
+        self.report_interval = report_interval
+        self.workers = args.workers
+        self.stats = SharedStats(max(self.node_ids) + 1, self.workers)
+        self._context = multiprocessing.get_context("spawn")
+        self._go = self._context.Event()
+        self._traffic_stop = self._context.Event()
+        self._stopping = self._context.Event()
+        self._wakeup = threading.Event()
+        self.processes = []
+        self.shards = []
+
+    def stop_traffic(self) -> None:
+        """Stop sending, e.g. when the run time is over, the workers keep receiving until stop()"""
+        self._traffic_stop.set()
+
+    def stop(self):
+        """stop the thread."""
+        self._stopping.set()
+        self._traffic_stop.set()
+        self._go.set()
+        self._wakeup.set()
+
+    def _config(self, index: int, node_ids: list) -> dict:
+        return {"args": self.args, "index": index, "node_ids": node_ids, "workers": self.workers,
+                "shm": self.stats.name, "num_slots": self.stats.num_slots, "start": self.startup.start,
+                "log_level": logging.getLogger().level, "protocol": self.protocol, "host": self.host,
+                "app_port_base": self.app_port_base, "app_send_port_base": self.app_send_port_base,
+                "pos_port_base": self.pos_port_base, "pos_batch_port": self.pos_batch_port,
+                "driver_options": self.driver_options,
+                "go": self._go, "traffic_stop": self._traffic_stop, "stop": self._stopping}
+
+    def _wait_workers(self, state: int, interval: float) -> bool:
+        """Wait until every worker reached state or exited, False on stop()"""
+        while not self._stopping.is_set():
+            states = self.stats.workers["state"]
+            if all(states[i] >= state or not p.is_alive() for i, p in enumerate(self.processes)):
+                return True
+            self._wakeup.wait(interval)
+        return False
+
+    def _collect_startup(self) -> None:
+        nodes = self.stats.nodes
+        for index, (process, node_ids) in enumerate(zip(self.processes, self.shards)):
+            for node_id in node_ids:
+                if nodes["ready_ns"][node_id]:
+                    self.startup.set_ready(node_id, nodes["ready_ns"][node_id] / 1e9)
+                elif nodes["failed"][node_id]:
+                    self.startup.set_failed(node_id, f"not ready in shard {index}, see its log")
+                else:
+                    self.startup.set_failed(node_id, f"shard {index} exited with code {process.exitcode}")
+
+    def run(self):
+        node_ids = self.node_ids
+        if self.protocol == "udp" and self.startup.announcements:
+            # UDP nodes have nothing to connect to, only announced nodes are given to the shards
+            announced = []
+            for node_id in node_ids:
+                if self.startup.wait_announced(node_id):
+                    announced.append(node_id)
+                else:
+                    self.startup.set_failed(node_id, "no listener start message in the ns output")
+            node_ids = announced
+        self.shards = [shard for shard in (node_ids[i::self.workers] for i in range(self.workers)) if shard]
+        for index, shard in enumerate(self.shards):
+            process = self._context.Process(target=run_shard, args=(self._config(index, shard),),
+                                            name=f"shard-{index}")
+            process.start()
+            self.processes.append(process)
+        logger.info(f"Started {len(self.processes)} shard processes with {len(node_ids)} nodes")
+        if self._wait_workers(WORKER_READY, 0.01):
+            self._collect_startup()
+        # traffic and position streams of all shards start at once
+        self._go.set()
+        last = (time.monotonic(), 0, 0)
+        while not self._wakeup.wait(self.report_interval or None):
+            last = self._report(last)
+        for process in self.processes:
+            process.join(5.0)
+            if process.is_alive():
+                logger.warning(f"Shard process {process.name} did not stop, terminating it")
+                process.terminate()
+                process.join()
+
+    def _report(self, last):
+        """Log the aggregated counters and rates since the last report"""
+        now = time.monotonic()
+        sent = int(self.stats.nodes["sent"].sum())
+        received = int(self.stats.nodes["received"].sum())
+        dt = now - last[0]
+        logger.info(f"Shards: sent {sent} ({(sent - last[1]) / dt:.1f}/s), "
+                    f"received {received} ({(received - last[2]) / dt:.1f}/s)")
+        return now, sent, received
+
+    def print_summary(self) -> None:
+        workers = self.stats.workers[:len(self.processes)]
+        nodes = self.stats.nodes
+        scheduled = int(workers["scheduled"].sum())
+        lateness = workers["lateness_sum_us"].sum() / scheduled / 1e3 if scheduled else 0.0
+        print(f"Shards: {len(self.processes)} worker processes, "
+              f"nodes per shard {[len(shard) for shard in self.shards]}")
+        print(f"Traffic: {scheduled} messages, send lateness mean {lateness:.2f} ms "
+              f"max {workers['lateness_max_us'].max(initial=0) / 1e3:.2f} ms")
+        if self.protocol == "tcp":
+            deepest = int(np.argmax(nodes["queue_max_depth"]))
+            print(f"Outbound queues: max depth {int(nodes['queue_max_depth'][deepest])} bytes (node {deepest}), "
+                  f"{int(nodes['queue_partial_writes'].sum())} partial writes, {int(nodes['queue_stalls'].sum())} stalls "
+                  f"for {nodes['queue_stall_us'].sum() / 1e6:.3f} s, {int(nodes['queue_dropped'].sum())} dropped, "
+                  f"{int(nodes['queue_rejected'].sum())} rejected")
+        print(f"Position: {int(workers['position_sent'].sum())} updates sent, "
+              f"{int(workers['position_dropped'].sum())} dropped, "
+              f"{int(workers['position_suppressed'].sum())} suppressed")
+
+    def close(self) -> None:
+        self.stats.close()
+
+
+def add_shard_arguments(argparser) -> None:
+    group = argparser.add_argument_group('sharding')
+    group.add_argument('--workers', type=int, default=1,
+                       help='Spread the nodes and their position updates across the given number of worker '
+                            'processes, each with its own asyncio node driver')
+    group.add_argument('--shard-report-interval', type=float, default=5.0,
+                       help='Log the aggregated counters of the workers every given number of seconds, 0 to disable')
+
+
+def check_shard_args(args) -> None:
+    """Raise ValueError for options the worker processes do not support"""
+    if args.workers < 1:
+        raise ValueError("The number of workers must be >= 1")
+    if args.workers == 1:
+        return
+    if args.engine != 'asyncio':
+        raise ValueError("--workers needs the asyncio engine")
+    if args.replay or args.journal:
+        raise ValueError("--journal and --replay are not supported with --workers")
@@ -0,0 +1,196 @@
+"""
+Startup phase of the harness: readiness of the ns application sockets.
+
+All node sockets are opened concurrently, failed connections are retried
+with an exponential backoff until an overall deadline. A TCP node is ready
+when its connection is accepted, the backoff is the readiness gate.
+
+uwApplication logs the start of the application socket without node id and
+port (OPEN_CONNECTION_TCP::SERVER_READY, only with debug_ >= 2), so the
+announcements are the start messages of the position listeners of the
+uwAppPos modules ("<id>::UWAPPPOS: starting position listener on port
+<port>", with APPPOS debug_ >= 1). The "start" command of a module prints it
+right before it opens the application socket, so it is a hint: it wakes up
+the retries of a node immediately, a connection attempt which comes too
+early is retried with the backoff. For UDP nodes, which have nothing to
+connect to, it is the only readiness signal.
+
+Traffic and position streams start when every node is ready or failed,
+nodes which are not ready at the deadline are reported.
+"""
+
+import logging
+import re
+import statistics
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# position listener, not application socket, see the module docstring
+LISTENER_START_PATTERN = re.compile(rb'(\d+)::UWAPPPOS: starting position listener on port (\d+)')
+
+# longest incomplete line kept back at the end of an output chunk
+MAX_PENDING_LINE = 4096
+
+
+class Startup(object):
+    def __init__(self, node_ids,
+                 timeout: float = 30.0,
+                 initial_delay: float = 0.01,
+                 max_delay: float = 0.5,
+                 announcements: bool = False,
+                 start: float = None) -> None:
+        """
+        Readiness of the nodes node_ids, shared by the node drivers of all engines.
+
+        timeout: overall deadline of the startup in [s] after start
+        initial_delay, max_delay: first and largest delay between the connection attempts of a node in [s]
+        announcements: ns prints the listener start messages, the startup has to be added to
+            the OutputPump as sink (see OutputPump.add_sink)
+        start: time.monotonic() of the ns launch, the times to ready are measured from it
+        """
+        self.node_ids = list(node_ids)
+        self.start = time.monotonic() if start is None else start
+        self.deadline = self.start + timeout
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.announcements = announcements
+        self.announced = {}
+        self.ready = {}
+        self.failed = {}
+        self.attempts = {}
+        self.stopping = False
+        self._cond = threading.Condition()
+        self._wakeups = {node_id: threading.Event() for node_id in self.node_ids}
+        self._listeners = []
+        self._pending = b""
+
+    def launched(self, start: float) -> None:
+        """Measure the times to ready and the deadline from start, time.monotonic() of the ns launch"""
+        self.start = start
+        self.deadline = start + self.timeout
+
+    def __call__(self, chunk: bytes) -> None:
+        """OutputPump sink, scans the ns output for the listener start messages"""
+        data = self._pending + chunk
+        end = data.rfind(b"\n") + 1
+        self._pending = data[end:][-MAX_PENDING_LINE:]
+        for m in LISTENER_START_PATTERN.finditer(data, 0, end):
+            self.announce(int(m.group(1)))
+
+    def announce(self, node_id: int) -> None:
+        """The application socket of node_id is being opened, can be called from any thread"""
+        with self._cond:
+            if node_id in self.announced or node_id not in self._wakeups:
+                return
+            self.announced[node_id] = time.monotonic()
+            listeners = self._listeners[:]
+            self._cond.notify_all()
+        self._wakeups[node_id].set()
+        for listener in listeners:
+            listener(node_id)
+
+    def add_listener(self, callback) -> None:
+        """Call callback(node_id) on every listener start message, from the OutputPump thread"""
+        with self._cond:
+            self._listeners.append(callback)
+
+    def remaining(self) -> float:
+        """Time to the deadline in [s]"""
+        return max(0.0, self.deadline - time.monotonic())
+
+    def delays(self, node_id: int):
+        """
+        Delays between the connection attempts of node_id in [s], doubling from
+        initial_delay up to max_delay, ends at the deadline or on stop()
+        """
+        delay = self.initial_delay
+        while not self.stopping:
+            remaining = self.remaining()
+            if remaining <= 0.0:
+                return
+            self.attempts[node_id] = self.attempts.get(node_id, 0) + 1
+            yield min(delay, remaining)
+            delay = min(2.0 * delay, self.max_delay)
+
+    def sleep(self, node_id: int, delay: float) -> bool:
+        """Wait delay [s] or until the listener start message of node_id, True on stop()"""
+        wakeup = self._wakeups[node_id]
+        wakeup.wait(delay)
+        wakeup.clear()
+        return self.stopping
+
+    def wait_announced(self, node_id: int) -> bool:
+        """Wait for the listener start message of node_id until the deadline, True if it arrived"""
+        with self._cond:
+            self._cond.wait_for(lambda: node_id in self.announced or self.stopping, self.remaining())
+            return node_id in self.announced
+
+    def set_ready(self, node_id: int, t: float = None) -> None:
+        """node_id is ready at t (time.monotonic(), default now)"""
+        with self._cond:
+            self.ready[node_id] = time.monotonic() if t is None else t
+            self._cond.notify_all()
+        logger.info(f"Node {node_id}: ready {1e3 * (self.ready[node_id] - self.start):.1f} ms after the ns launch, "
+                    f"{self.attempts.get(node_id, 0) + 1} attempt(s)")
+
+    def set_failed(self, node_id: int, reason: str) -> None:
+        with self._cond:
+            self.failed[node_id] = reason
+            self._cond.notify_all()
+        if not self.stopping:
+            logger.error(f"Node {node_id}: not ready after {time.monotonic() - self.start:.1f} s, {reason}, "
+                         f"node is not driven")
+
+    def done(self) -> bool:
+        return self.stopping or len(self.ready) + len(self.failed) >= len(self.node_ids)
+
+    def wait(self) -> bool:
+        """Wait until every node is ready or failed, True if all nodes are ready"""
+        with self._cond:
+            self._cond.wait_for(self.done)
+            return len(self.ready) == len(self.node_ids)
+
+    def stop(self) -> None:
+        """Abort the startup, can be called from any thread"""
+        with self._cond:
+            self.stopping = True
+            self._cond.notify_all()
+        for wakeup in self._wakeups.values():
+            wakeup.set()
+
+    def print_summary(self) -> None:
+        times = sorted((t - self.start, node_id) for node_id, t in self.ready.items())
+        line = f"Startup: {len(self.ready)} of {len(self.node_ids)} nodes ready"
+        if times:
+            ttr = [t for t, _ in times]
+            line += (f" {ttr[-1]:.3f} s after the ns launch, time to ready min {ttr[0]:.3f} / "
+                     f"median {statistics.median(ttr):.3f} / max {ttr[-1]:.3f} s")
+        print(line)
+        if times:
+            print("  slowest nodes: " + ", ".join(f"{node_id} {t:.3f} s" for t, node_id in reversed(times[-5:])))
+        if self.announcements:
+            silent = [node_id for node_id in self.node_ids if node_id not in self.announced]
+            if silent:
+                print(f"  no listener start message of node(s) {silent}")
+        missing = [node_id for node_id in self.node_ids if node_id not in self.ready]
+        for node_id in missing:
+            print(f"  node {node_id} NOT READY: {self.failed.get(node_id, 'startup aborted')}")
+
+
+def add_startup_arguments(argparser) -> None:
+    group = argparser.add_argument_group('startup')
+    group.add_argument('--startup-timeout', type=float, default=30.0,
+                       help='Deadline for the application sockets of all nodes in [s] after the ns launch')
+    group.add_argument('--connect-backoff', type=float, nargs=2, default=[0.01, 0.5], metavar=('FIRST', 'MAX'),
+                       help='First and largest delay between the connection attempts of a node in [s]')
+
+
+def startup_from_args(args, node_ids, announcements: bool = False) -> Startup:
+    """Startup of node_ids, call Startup.launched() when ns is started"""
+    first, largest = args.connect_backoff
+    if args.startup_timeout <= 0.0 or first <= 0.0 or largest < first:
+        raise ValueError("The startup timeout and the backoff delays must be > 0 and FIRST <= MAX")
+    return Startup(node_ids, args.startup_timeout, first, largest, announcements)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Parameter sweep over the harness, running several scenarios at once.
+
+Every scenario runs test_sockets.py (or test_sockets_UDP.py with --udp) in its
+own work directory with its own block of socket ports, so the instances do
+not collide, and the watchdog of each harness only stops its own ns.
+Grid keys n / num_nodes and t / run_time are passed to the harness, all
+others are opt(...) overrides of the tcl template. Arguments not known to
+the sweep are passed to every harness. The results are collected into one
+CSV table.
+
+python3 sweep.py -g n=2,4,8 -g txpower=130,135 -g bitrate=4800,9600 -j 8 -b ~/DESERT_buildCopy_LOCAL
+"""
+
+import collections
+import csv
+import itertools
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from argparse import ArgumentError, ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+from scenario import SCRIPT_DIR
+
+HARNESS_KEYS = {"n": "-n", "num_nodes": "-n", "t": "-t", "run_time": "-t"}
+
+# summary lines printed by the finish proc of the templates (and the ns stand-in)
+NS_SUMMARY_PATTERN = re.compile(r'^\s*(Mean Throughput|Sent Packets|Received Packets|Packet Delivery Ratio)\s*:\s*([-+0-9.eE]+)',
+                                re.MULTILINE)
+
+MAX_PORT = 65535
+
+
+def parse_grid(items) -> dict:
+    """Parse ['n=2,4', 'txpower=130,135'] into {'n': ['2', '4'], 'txpower': ['130', '135']}"""
+    grid = {}
+    for item in items:
+        key, sep, values = item.partition('=')
+        if not sep or not key or not values:
+            raise ValueError(f"Invalid grid entry '{item}', expected key=value[,value...]")
+        grid[key.strip()] = [v.strip() for v in values.split(',')]
+    return grid
+
+
+def expand_grid(grid: dict) -> list:
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def max_num_nodes(scenarios: list, harness_args: list) -> int:
+    """
+    Largest number of sending nodes of the scenarios, from the grid keys n /
+    num_nodes and the -n/--num-nodes passed through to the harness (default 2)
+    """
+    argparser = ArgumentParser(add_help=False, exit_on_error=False)
+    argparser.add_argument('-n', '--num-nodes', type=int, action='append', default=[])
+    try:
+        known, _ = argparser.parse_known_args(harness_args)
+    except ArgumentError as e:
+        raise ValueError(f"Invalid harness argument: {e}")
+    num_nodes = [int(v) for params in scenarios for k, v in params.items() if HARNESS_KEYS.get(k) == "-n"]
+    return max(num_nodes + known.num_nodes or [2])
+
+
+class PortAllocator(object):
+    def __init__(self, base: int, stride: int, ports_per_scenario: int = 3) -> None:
+        """
+        Hands out non overlapping port blocks of ports_per_scenario * stride ports
+        starting at base. A released block is reused last, so sockets of a
+        finished scenario have time to close.
+        """
+        self.base = base
+        self.stride = stride
+        self.block_size = ports_per_scenario * stride
+        count = (MAX_PORT - base) // self.block_size
+        if count < 1:
+            raise ValueError(f"No port block of {self.block_size} ports above {base}")
+        self._free = collections.deque(range(count))
+        self._available = threading.Semaphore(count)
+        self._lock = threading.Lock()
+
+    def acquire(self) -> int:
+        self._available.acquire()
+        with self._lock:
+            return self._free.popleft()
+
+    def release(self, block: int) -> None:
+        with self._lock:
+            self._free.append(block)
+        self._available.release()
+
+    def ports(self, block: int) -> tuple:
+        """(app port base, position port base, app send port base) of the block"""
+        start = self.base + block * self.block_size
+        return start, start + self.stride, start + 2 * self.stride
+
+
+def read_ns_summary(filename: str) -> dict:
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, "rt", errors="replace") as f:
+        text = f.read()
+    return {f"ns {name.lower()}": float(value) for name, value in NS_SUMMARY_PATTERN.findall(text)}
+
+
+def delivery_ratio(stats: dict):
+    """
+    Received / expected messages of a stats.json export, every message of a
+    sender is expected at all nodes which received any message (destination 255
+    of the templates, the flows of the export), None if nothing was sent. The
+    exports of --workers runs have no flows but the expected count.
+    """
+    if "expected" in stats:
+        if not stats["expected"]:
+            return 0.0 if stats["sent"] else None
+        return stats["received"] / stats["expected"]
+    if not stats["flows"]:
+        return 0.0 if stats["sent"] else None
+    expected = sum(f["sent"] for f in stats["flows"])
+    return stats["received"] / expected if expected else None
+
+
+def run_scenario(index: int, params: dict, udp: bool, harness_args: list, out_dir: str,
+                 ports: PortAllocator) -> dict:
+    """Run one scenario in out_dir/scenario_<index> and return its row of the result table"""
+    work_dir = os.path.abspath(os.path.join(out_dir, f"scenario_{index:04d}"))
+    os.makedirs(work_dir, exist_ok=True)
+    script = "test_sockets_UDP.py" if udp else "test_sockets.py"
+    cmd = [sys.executable, os.path.join(SCRIPT_DIR, script), "-w", work_dir, "--no-echo",
+           "--stats-json", "stats.json"]
+    for key, value in params.items():
+        if key in HARNESS_KEYS:
+            cmd += [HARNESS_KEYS[key], value]
+        else:
+            cmd += ["-o", f"{key}={value}"]
+    block = ports.acquire()
+    try:
+        app_port_base, pos_port_base, app_send_port_base = ports.ports(block)
+        cmd += ["--app-port-base", str(app_port_base), "--pos-port-base", str(pos_port_base)]
+        if udp:
+            cmd += ["--app-send-port-base", str(app_send_port_base)]
+        cmd += harness_args
+        start = time.monotonic()
+        with open(os.path.join(work_dir, "harness.log"), "wb") as log:
+            returncode = subprocess.call(cmd, cwd=work_dir, stdout=log, stderr=subprocess.STDOUT)
+        wall_time = time.monotonic() - start
+    finally:
+        ports.release(block)
+
+    row = {"scenario": index, **params, "exit code": returncode, "wall time": round(wall_time, 1)}
+    stats_file = os.path.join(work_dir, "stats.json")
+    if os.path.exists(stats_file):
+        with open(stats_file, "rt") as f:
+            stats = json.load(f)
+        row.update({
+            "sent": stats["sent"],
+            "received": stats["received"],
+            "discarded": stats.get("discarded", 0),
+            "delivery ratio": delivery_ratio(stats),
+            "latency p50 [ms]": stats["latency"]["p50_us"] / 1e3,
+            "latency p99 [ms]": stats["latency"]["p99_us"] / 1e3,
+        })
+    row.update(read_ns_summary(os.path.join(work_dir, "ns_run.log")))
+    return row
+
+
+def write_table(rows: list, filename: str) -> None:
+    columns = []
+    for row in rows:
+        columns += [c for c in row if c not in columns]
+    with open(filename, "wt", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_table(rows: list) -> None:
+    columns = []
+    for row in rows:
+        columns += [c for c in row if c not in columns]
+    cells = [[str(row.get(c, "")) for c in columns] for row in rows]
+    widths = [max([len(c)] + [len(r[i]) for r in cells]) for i, c in enumerate(columns)]
+    print("  ".join(c.rjust(w) for c, w in zip(columns, widths)))
+    for r in cells:
+        print("  ".join(v.rjust(w) for v, w in zip(r, widths)))
+
+
+def main():
+    argparser = ArgumentParser(allow_abbrev=False,
+                               description='Run a parameter sweep of the harness with several scenarios in parallel. '
+                                           'Unknown arguments are passed to every harness.')
+    argparser.add_argument('-g', '--grid', action='append', required=True, metavar='KEY=V1,V2,...',
+                           help='Parameter values, n/num_nodes and t/run_time are harness arguments, '
+                                'other keys override opt(KEY) of the tcl template')
+    argparser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Number of scenarios run at once')
+    argparser.add_argument('-u', '--udp', action='store_true', help='Run test_sockets_UDP.py instead of test_sockets.py')
+    argparser.add_argument('-d', '--out-dir', default='sweep', help='Directory for the scenario work directories')
+    argparser.add_argument('-r', '--results', default=None,
+                           help='CSV file of the result table (default: <out-dir>/results.csv)')
+    argparser.add_argument('--port-base', type=int, default=20000, help='First port of the scenario port blocks')
+    args, harness_args = argparser.parse_known_args()
+
+    try:
+        scenarios = expand_grid(parse_grid(args.grid))
+        # node ids are 1 .. n + 1, a harness -n also sets the port block stride
+        ports = PortAllocator(args.port_base, max_num_nodes(scenarios, harness_args) + 2)
+    except ValueError as e:
+        argparser.error(str(e))
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    print(f"Running {len(scenarios)} scenarios, {args.jobs} at once")
+    rows = []
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(run_scenario, i, params, args.udp, harness_args, args.out_dir, ports)
+                   for i, params in enumerate(scenarios)]
+        for future in futures:
+            row = future.result()
+            print(f"Scenario {row['scenario']} finished with exit code {row['exit code']} after {row['wall time']} s")
+            rows.append(row)
+
+    results = args.results or os.path.join(args.out_dir, "results.csv")
+    write_table(rows, results)
+    print_table(rows)
+    print(f"Results written to {results}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+
+import pytest
+
+from clock import WALL_CLOCK, ClockEvent, SyncServer, VirtualClock, template_substitutions
+from ns_standin import parse_tcl_options
+from scenario import SCRIPT_DIR, render_script
+
+SUBSTITUTIONS = dict(TMPL_NO_SENDERS=2, TMPL_PROTOCOL="tcp", TMPL_STOPTIME=10, TMPL_APP_PORT_BASE=4000,
+                     TMPL_APP_POS_PORT_BASE=5000, TMPL_APP_POS_BATCH_PORT=0)
+
+
+def render(tmp_path, clock, sync=None) -> str:
+    filename = str(tmp_path / "uwAppPos.tcl")
+    render_script(os.path.join(SCRIPT_DIR, "uwAppPos.tmpl"), filename, **SUBSTITUTIONS,
+                  **template_substitutions(clock, sync))
+    with open(filename, "rt") as f:
+        return f.read()
+
+
+def test_wall_clock_script_uses_the_real_time_scheduler(tmp_path):
+    script = render(tmp_path, WALL_CLOCK)
+    assert "$ns use-scheduler RealTime" in script
+    assert "sync_point" not in script
+    assert "sync_port" not in parse_tcl_options(str(tmp_path / "uwAppPos.tcl"))
+
+
+def test_virtual_clock_script_synchronizes_before_run(tmp_path):
+    clock = VirtualClock()
+    sync = SyncServer(clock, step=0.25)
+    sync.start()
+    try:
+        script = render(tmp_path, clock, sync)
+    finally:
+        sync.stop()
+        sync.join()
+    assert "use-scheduler RealTime" not in script
+    assert script.index('$ns at 0 "sync_point"') < script.index("$ns run")
+    options = parse_tcl_options(str(tmp_path / "uwAppPos.tcl"))
+    assert int(options["sync_port"]) == sync.port
+    assert float(options["sync_step"]) == 0.25
+
+
+def test_advance_waits_for_the_participants():
+    clock = VirtualClock()
+    participant = clock.join("worker")
+    stop = ClockEvent()
+    done = []
+
+    def work():
+        t = 1.0
+        while not participant.wait_until(t, stop):
+            done.append(clock.now())
+            t += 1.0
+        participant.leave()
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    # the worker is busy until its first wait, then waits for t = 1.0
+    assert clock.advance(0.5) == 1.0
+    assert clock.advance(2.0) == 3.0
+    assert done == [2.0, 2.0]
+    stop.set()
+    thread.join()
+    assert clock.advance(5.0) is None
+
+
+def test_event_wakes_up_the_wait():
+    clock = VirtualClock()
+    stop = ClockEvent()
+    timer = threading.Timer(0.05, stop.set)
+    timer.start()
+    t0 = time.monotonic()
+    assert clock.wait_until(None, stop)
+    assert time.monotonic() - t0 < 5.0
+    timer.join()
+    assert stop._waiters == []
+    with pytest.raises(TypeError):
+        clock.wait_until(1.0, threading.Event())
+
+
+def test_stop_releases_the_waits():
+    clock = VirtualClock()
+    participant = clock.join("worker")
+    # the participant stays busy, the barrier waits until the clock is stopped
+    timer = threading.Timer(0.05, clock.stop)
+    timer.start()
+    assert clock.advance(1.0) is None
+    timer.join()
+    assert not participant.wait_until(None, ClockEvent())
@@ -0,0 +1,60 @@
+import socket
+
+import pytest
+
+from frame_decoder import MAX_FRAME_SIZE, FrameDecoder
+
+
+def frame(payload: bytes) -> bytes:
+    return b"D" + bytes([len(payload)]) + payload
+
+
+def feed(decoder: FrameDecoder, data: bytes) -> list:
+    free = decoder.get_buffer()
+    free[:len(data)] = data
+    decoder.buffer_updated(len(data))
+    return [bytes(payload) for payload in decoder.frames()]
+
+
+def test_frames_split_across_reads():
+    decoder = FrameDecoder()
+    stream = frame(b"hello") + frame(b"") + frame(b"x" * 255)
+    assert feed(decoder, stream[:4]) == []
+    assert feed(decoder, stream[4:10]) == [b"hello", b""]
+    assert feed(decoder, stream[10:]) == [b"x" * 255]
+    assert decoder.pending() == 0
+    assert decoder.frames_decoded == 3
+
+
+def test_garbage_is_skipped_until_the_next_frame():
+    decoder = FrameDecoder()
+    assert feed(decoder, b"xyz" + frame(b"ok")) == [b"ok"]
+    assert decoder.resyncs == 1
+    assert decoder.bytes_skipped == 3
+
+
+def test_partial_frame_is_moved_to_the_front():
+    decoder = FrameDecoder(MAX_FRAME_SIZE + 10)
+    payloads = []
+    for i in range(20):
+        payloads += feed(decoder, frame(bytes([65 + i]) * 200))
+    assert payloads == [bytes([65 + i]) * 200 for i in range(20)]
+
+
+def test_capacity_must_hold_a_frame():
+    with pytest.raises(ValueError):
+        FrameDecoder(MAX_FRAME_SIZE - 1)
+
+
+def test_recv_into_reads_until_eagain_and_close():
+    a, b = socket.socketpair()
+    with a, b:
+        a.setblocking(False)
+        decoder = FrameDecoder()
+        b.sendall(frame(b"one") + frame(b"two"))
+        assert decoder.recv_into(a) == 10
+        assert [bytes(p) for p in decoder.frames()] == [b"one", b"two"]
+        assert decoder.recv_into(a) == 0 and not decoder.closed
+        b.close()
+        decoder.recv_into(a)
+        assert decoder.closed
@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+import pytest
+
+from journal import (JOURNAL_HEADER_STRUCT, JOURNAL_POSITION, JOURNAL_RECEIVED, JOURNAL_RECORD_STRUCT, JOURNAL_SENT,
+                     JournalReplay, JournalWriter, read_journal)
+
+RECORDS = [(JOURNAL_SENT, 2, b"hello"),
+           (JOURNAL_RECEIVED, 3, [b"\x00\x05", b"hello"]),
+           (JOURNAL_POSITION, 0, b""),
+           (JOURNAL_SENT, 3, bytes(range(256)) * 4)]
+
+
+def write(filename: str, chunk_size: int = 4096) -> JournalWriter:
+    writer = JournalWriter(filename, chunk_size)
+    for kind, node, data in RECORDS:
+        writer.append(kind, node, data)
+    return writer
+
+
+def assert_records(records, payloads, count: int = len(RECORDS)) -> None:
+    assert len(records) == len(payloads) == count
+    assert records["kind"].tolist() == [kind for kind, _, _ in RECORDS[:count]]
+    assert records["node"].tolist() == [node for _, node, _ in RECORDS[:count]]
+    expected = [b"".join(data) if isinstance(data, list) else data for _, _, data in RECORDS[:count]]
+    assert payloads == expected
+    assert records["size"].tolist() == [len(data) for data in expected]
+    assert np.all(np.diff(records["t_ns"]) >= 0)
+
+
+def test_round_trip(tmp_path):
+    filename = str(tmp_path / "ns_run.journal")
+    writer = write(filename)
+    writer.close()
+    assert writer.records == len(RECORDS)
+    # the file is truncated to the records
+    size = JOURNAL_HEADER_STRUCT.size + sum(JOURNAL_RECORD_STRUCT.size + r for r in read_journal(filename)[0]["size"])
+    assert os.path.getsize(filename) == size
+    assert_records(*read_journal(filename))
+    # appending after close is ignored
+    writer.append(JOURNAL_SENT, 2, b"late")
+    writer.close()
+
+
+def test_growing_map(tmp_path):
+    filename = str(tmp_path / "ns_run.journal")
+    # smaller than the last record
+    writer = write(filename, chunk_size=64)
+    writer.close()
+    assert_records(*read_journal(filename))
+
+
+def test_journal_of_a_crashed_run(tmp_path):
+    # the mapped space after the last record is zero
+    filename = str(tmp_path / "ns_run.journal")
+    writer = write(filename)
+    writer._map.flush()
+    assert os.path.getsize(filename) == 4096
+    assert_records(*read_journal(filename))
+    writer.close()
+
+
+@pytest.mark.parametrize("cut", [1, JOURNAL_RECORD_STRUCT.size - 1, JOURNAL_RECORD_STRUCT.size + 100])
+def test_truncated_tail(tmp_path, cut):
+    filename = str(tmp_path / "ns_run.journal")
+    write(filename).close()
+    with open(filename, "r+b") as f:
+        f.truncate(os.path.getsize(filename) - len(RECORDS[-1][2]) - JOURNAL_RECORD_STRUCT.size + cut)
+    assert_records(*read_journal(filename), count=len(RECORDS) - 1)
+
+
+def test_not_a_journal(tmp_path):
+    filename = tmp_path / "ns_run.journal"
+    filename.write_bytes(b"UWJ")
+    with pytest.raises(ValueError):
+        read_journal(str(filename))
+    filename.write_bytes(JOURNAL_HEADER_STRUCT.pack(b"UWJ1", 2))
+    with pytest.raises(ValueError):
+        read_journal(str(filename))
+
+
+def test_replay(tmp_path):
+    filename = str(tmp_path / "ns_run.journal")
+    write(filename).close()
+    replay = JournalReplay(filename, rate=2.0)
+    assert replay.senders() == [2, 3]
+    assert replay.profile(4) is None
+    assert len(replay.positions) == 1
+    assert replay.next_payload(3) == RECORDS[-1][2]
+    assert replay.next_payload(3, b"text") == b"text"
+    assert replay.sent[3] == 1
+    with pytest.raises(ValueError):
+        JournalReplay(filename, rate=0.0)
@@ -0,0 +1,88 @@
+import pytest
+
+from latency import (LINEAR_COUNT, NUM_BUCKETS, SEQ_WINDOW, FlowStats, LatencyHistogram, LatencyTracker, bucket_index, bucket_value,
+                     decode_payload, encode_payload)
+
+
+def test_payload_round_trip():
+    payload = encode_payload(3, 17, 123456789, b"text with spaces")
+    assert decode_payload(memoryview(payload)) == (3, 17, 123456789, b"text with spaces")
+    assert decode_payload(b"plain payload") is None
+    assert decode_payload(b"UWP1 zz") is None
+
+
+@pytest.mark.parametrize("value", [0, 1, LINEAR_COUNT - 1, LINEAR_COUNT, 1000, 123456, 10 ** 9])
+def test_bucket_bounds(value):
+    index = bucket_index(value)
+    assert 0 <= index < NUM_BUCKETS
+    assert value <= bucket_value(index)
+    # relative error of the log-linear buckets below 1.6 %
+    assert bucket_value(index) - value <= max(0, 0.016 * value)
+    if index:
+        assert bucket_value(index - 1) < value
+
+
+def test_histogram_percentiles_and_merge():
+    first, second = LatencyHistogram(), LatencyHistogram()
+    for value in range(1, 101):
+        (first if value <= 50 else second).record(value)
+    first.merge(second)
+    assert (first.count, first.min, first.max) == (100, 1, 100)
+    assert first.percentile(50) == 50
+    assert first.percentile(99) == 99
+    assert first.to_dict()["mean_us"] == 50.5
+    assert LatencyHistogram().percentile(50) == 0
+
+
+def test_flow_duplicates_and_reordering():
+    flow = FlowStats()
+    assert [flow.update(seq, 10) for seq in (0, 2, 1, 2, 100)] == [True, True, True, False, True]
+    assert (flow.received, flow.duplicates, flow.reordered, flow.highest_seq) == (4, 1, 1, 100)
+
+
+def test_tracker_latency_and_loss(clock):
+    tracker = LatencyTracker(clock)
+    payloads = [tracker.next_payload(2, b"x") for _ in range(3)]
+    clock.time = 0.005
+    assert tracker.on_receive(1, payloads[0]) == pytest.approx(0.005)
+    tracker.on_receive(1, payloads[2])
+    assert tracker.on_receive(1, b"other") is None
+    summary = tracker.summary()
+    assert summary["sent"] == 3 and summary["received"] == 2
+    assert summary["latency"]["p50_us"] == 5000
+    assert summary["received_bytes"] == 2 * len(payloads[0])
+    assert summary["duration_s"] == pytest.approx(0.005)
+
+
+def test_duplicates_are_no_received_bytes(clock):
+    tracker = LatencyTracker(clock)
+    assert tracker.summary()["duration_s"] is None
+    payload = tracker.next_payload(2, b"x")
+    tracker.on_receive(1, payload)
+    tracker.on_receive(1, payload)
+    assert tracker.summary()["received_bytes"] == len(payload)
+
+
+def test_lost_flows_are_reported(clock):
+    tracker = LatencyTracker(clock)
+    tracker.on_receive(3, tracker.next_payload(2))
+    # nothing of node 4 arrives anywhere
+    tracker.next_payload(4)
+    tracker.next_payload(4)
+    flows = {(f["src"], f["dst"]): f for f in tracker.summary()["flows"]}
+    assert sorted(flows) == [(2, 3), (4, 3)]
+    assert (flows[4, 3]["sent"], flows[4, 3]["received"], flows[4, 3]["lost"]) == (2, 0, 2)
+    assert flows[4, 3]["delivery_ratio"] == 0.0
+    tracker.print_summary()
+
+
+def test_sequence_window_is_bounded():
+    flow = FlowStats()
+    assert flow.update(2 ** 40, 10)
+    assert not flow.update(2 ** 40, 10)
+    assert len(flow._seen) <= SEQ_WINDOW // 8
+    # older than the window: counted, not checked for duplicates
+    assert flow.update(5, 10) and flow.update(5, 10)
+    assert flow.update(2 ** 40 - SEQ_WINDOW + 8, 10)
+    assert not flow.update(2 ** 40 - SEQ_WINDOW + 8, 10)
+    assert (flow.received, flow.duplicates, flow.reordered) == (4, 2, 3)
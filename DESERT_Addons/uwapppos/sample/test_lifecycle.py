@@ -0,0 +1,83 @@
+import select
+import subprocess
+import threading
+import time
+
+from lifecycle import Lifecycle, stop_process
+
+
+class Worker(object):
+    def __init__(self, name: str, stopped: list) -> None:
+        self.name = name
+        self.stopped = stopped
+
+    def stop(self) -> None:
+        self.stopped.append(self.name)
+
+
+def test_stop_wakes_up_select_and_stops_workers_in_order():
+    lifecycle = Lifecycle()
+    stopped = []
+    for name in ("scheduler", "driver", "pos_worker"):
+        lifecycle.add(Worker(name, stopped))
+    woken = []
+
+    def wait_in_select():
+        readable, _, _ = select.select([lifecycle], [], [], 5.0)
+        woken.append((readable == [lifecycle], time.monotonic()))
+
+    t = threading.Thread(target=wait_in_select)
+    t.start()
+    lifecycle.request_stop("test")
+    lifecycle.request_stop("second call")
+    t.join()
+    assert woken[0][0] and woken[0][1] - lifecycle.stop_time < 1.0
+    # the workers are stopped in the order they were added, only once
+    assert stopped == ["scheduler", "driver", "pos_worker"]
+    assert lifecycle.reason == "test"
+    # fileno() stays readable for workers which start waiting later
+    assert select.select([lifecycle], [], [], 0.0)[0] == [lifecycle]
+    # a worker added during the shutdown is stopped at once
+    lifecycle.add(Worker("late", stopped))
+    assert stopped[-1] == "late"
+    assert lifecycle.join([t]) == []
+    lifecycle.close()
+
+
+def test_failing_worker_does_not_stop_the_shutdown():
+    lifecycle = Lifecycle()
+    stopped = []
+
+    class Broken(object):
+        def stop(self):
+            raise RuntimeError("broken")
+
+    lifecycle.add(Broken())
+    lifecycle.add(Worker("after", stopped))
+    lifecycle.request_stop("test")
+    assert stopped == ["after"]
+    lifecycle.close()
+
+
+def test_process_exit_requests_the_shutdown():
+    lifecycle = Lifecycle()
+    proc = subprocess.Popen(["sh", "-c", "exit 3"])
+    lifecycle.watch_process(proc)
+    assert lifecycle.wait(5.0)
+    assert lifecycle.reason == "ns exited with code 3"
+    lifecycle.close()
+
+
+def test_run_time_and_halt_of_the_process():
+    lifecycle = Lifecycle()
+    calls = []
+    proc = subprocess.Popen(["sh", "-c", "sleep 10; true"])
+    lifecycle.watch_process(proc)
+    start = time.monotonic()
+    threading.Timer(0.3, stop_process, args=(proc, "sleep")).start()
+    lifecycle.supervise(0.1, on_run_time=lambda: calls.append(time.monotonic() - start), proc=proc, start=start)
+    # the traffic stops at the run time, the shutdown follows the exit of the process
+    assert len(calls) == 1 and 0.1 <= calls[0] < 0.3
+    assert lifecycle.stopping.is_set() and lifecycle.reason.startswith("ns exited")
+    assert time.monotonic() - start < 2.0
+    lifecycle.close()
@@ -0,0 +1,37 @@
+import pytest
+
+import log_pipeline
+from log_pipeline import EventSampler
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(log_pipeline.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_every_nth_event_per_kind():
+    sampler = EventSampler(every=3)
+    assert [sampler.allow(0) for _ in range(6)] == [True, False, False, True, False, False]
+    assert sampler.allow(1)
+    assert sampler.suppressed == 4
+
+
+def test_rate_below_one_per_second(clock):
+    # regression: the bucket was capped at rate tokens and never reached one token
+    sampler = EventSampler(1, 0.5)
+    allowed = []
+    for _ in range(6):
+        allowed.append(sampler.allow(0))
+        clock[0] += 1.0
+    assert allowed == [True, False, True, False, True, False]
+
+
+def test_rate_limits_bursts(clock):
+    sampler = EventSampler(1, 10.0)
+    assert sum(sampler.allow(0) for _ in range(50)) == 10
+    clock[0] += 0.5
+    assert sum(sampler.allow(0) for _ in range(50)) == 5
+    # the kinds have their own buckets
+    assert sampler.allow(1)
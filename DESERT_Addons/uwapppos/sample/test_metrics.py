@@ -0,0 +1,135 @@
+import io
+import re
+import socket
+import urllib.error
+import urllib.request
+from types import SimpleNamespace
+
+import pytest
+
+from metrics import CONTENT_TYPE, PREFIX, Dashboard, Metrics, MetricsServer, add_metrics_arguments, metrics_from_args
+
+ADD_ARGUMENTS = [add_metrics_arguments]
+
+SAMPLE_PATTERN = re.compile(r'^(uwapppos_\w+)(?:\{(\w+="[^"]*"(?:,\w+="[^"]*")*)\})? (-?[\d.e+-]+)$')
+
+
+class FakeQueue(object):
+    def __init__(self, depth: int) -> None:
+        self.depth = depth
+
+    def stats(self) -> dict:
+        return {"depth": self.depth, "max_depth": 2 * self.depth, "partial_writes": 1, "stalls": 2, "dropped": 3,
+                "rejected": 1}
+
+
+@pytest.fixture
+def sockets():
+    pair = socket.socketpair()
+    yield pair
+    for s in pair:
+        s.close()
+
+
+@pytest.fixture
+def metrics(sockets):
+    nodes = {2: SimpleNamespace(node_id=2, sent=10, received=7, bytes_sent=400, bytes_received=280, connected=True,
+                                transport=sockets[0]),
+             3: SimpleNamespace(node_id=3, sent=0, received=0, bytes_sent=0, bytes_received=0, connected=False,
+                                transport=None)}
+    queues = {2: FakeQueue(100), 3: FakeQueue(0)}
+    metrics = Metrics()
+    metrics.watch_driver(SimpleNamespace(nodes=nodes, queues=lambda: queues, loop_lag=0.002, loop_lag_max=0.01))
+    metrics.watch_startup(SimpleNamespace(attempts={2: 3, 3: 1}))
+    metrics.watch_pos_worker(SimpleNamespace(updates_sent=50, updates_dropped=1))
+    metrics.watch_pump(SimpleNamespace(lines_out=20, bytes_out=1000, bytes_err=5))
+    metrics.watch_scheduler(SimpleNamespace(sent={2: 10, 3: 0}, lateness_max=0.001))
+    return metrics
+
+
+def parse_samples(text: str) -> dict:
+    """Samples of the Prometheus text format as {(name, labels): value}, checks HELP and TYPE of every family"""
+    samples = {}
+    declared = {}
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            name = line.split()[2]
+            assert name not in declared
+            declared[name] = None
+        elif line.startswith("# TYPE "):
+            _, _, name, kind = line.split()
+            assert name in declared and kind in ("counter", "gauge")
+            declared[name] = kind
+        else:
+            m = SAMPLE_PATTERN.match(line)
+            assert m is not None, line
+            assert m.group(1) in declared
+            samples[m.group(1), m.group(2) or ""] = float(m.group(3))
+    assert all(name.startswith(PREFIX) for name in declared)
+    for name, kind in declared.items():
+        assert kind == "counter" if name.endswith("_total") else kind is not None
+    return samples
+
+
+def test_prometheus_text_format(metrics, sockets):
+    # unread bytes of node 2 in the kernel queue of its socket
+    sockets[1].sendall(b"x" * 1000)
+    text = metrics.render()
+    assert text.endswith("\n")
+    samples = parse_samples(text)
+    assert samples["uwapppos_messages_sent_total", 'node="2"'] == 10
+    assert samples["uwapppos_bytes_received_total", 'node="2"'] == 280
+    assert samples["uwapppos_node_connected", 'node="3"'] == 0
+    assert samples["uwapppos_socket_receive_queue_bytes", 'node="2"'] == 1000
+    # the socket queues of closed nodes are not reported
+    assert ("uwapppos_socket_send_queue_bytes", 'node="3"') not in samples
+    assert samples["uwapppos_queue_max_depth_bytes", 'node="2"'] == 200
+    assert samples["uwapppos_queue_dropped_total", 'node="3"'] == 4
+    assert samples["uwapppos_connect_retries_total", 'node="2"'] == 2
+    assert samples["uwapppos_ns_output_bytes_total", 'stream="stderr"'] == 5
+    assert samples["uwapppos_position_updates_suppressed_total", ""] == 0
+    assert samples["uwapppos_event_loop_lag_max_seconds", ""] == 0.01
+    assert samples["uwapppos_traffic_scheduled_total", ""] == 10
+    assert samples["uwapppos_uptime_seconds", ""] >= 0.0
+
+
+def test_families_without_sources():
+    samples = parse_samples(Metrics().render())
+    assert list(samples) == [("uwapppos_uptime_seconds", "")]
+
+
+def test_totals_and_dashboard(metrics):
+    totals = metrics.totals()
+    assert totals["messages_sent_total"] == 10 and totals["node_connected:count"] == 2
+    assert totals["queue_depth_bytes:max"] == 100
+    stream = io.StringIO()
+    dashboard = Dashboard(metrics, stream=stream)
+    dashboard._draw(dashboard._lines(totals, {}, 2.0))
+    text = stream.getvalue()
+    assert "nodes 1/2 connected, 2 connect retries" in text
+    assert "messages sent      5.0/s (10)" in text
+    assert "\x1b[" not in text
+
+
+def test_endpoint(metrics):
+    server = MetricsServer(metrics, port=0)
+    server.start()
+    try:
+        url = f"http://{server.address[0]}:{server.address[1]}"
+        with urllib.request.urlopen(url + "/metrics") as response:
+            assert response.headers["Content-Type"] == CONTENT_TYPE
+            samples = parse_samples(response.read().decode())
+        assert samples["uwapppos_messages_received_total", 'node="2"'] == 7
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + "/other")
+    finally:
+        server.stop()
+        server.join(5.0)
+    assert not server.is_alive()
+
+
+def test_metrics_arguments(parse):
+    metrics, threads = metrics_from_args(parse())
+    assert isinstance(metrics, Metrics) and threads == []
+    metrics, threads = metrics_from_args(parse("--metrics-port", "0", "--dashboard", "0.5"))
+    assert [type(thread) for thread in threads] == [Dashboard]
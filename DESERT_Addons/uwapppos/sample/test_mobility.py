@@ -0,0 +1,193 @@
+import os
+import re
+import struct
+
+import numpy as np
+import pytest
+
+from mobility import (BATCH_FLAG_TIMESTAMP, BATCH_HEADER_STRUCT, BATCH_MAGIC, BATCH_RECORD_DTYPE, BATCH_RECORD_TS_DTYPE,
+                      BATCH_VERSION, POSITION_STRUCT, DeadReckoning, MobilityEngine, add_mobility_arguments,
+                      check_mobility_args, dead_reckoning_from_args, engine_from_args, pack_position_batches,
+                      unpack_position_batch)
+
+
+ADD_ARGUMENTS = [add_mobility_arguments]
+
+
+@pytest.mark.parametrize("interval", ["0", "-1"])
+def test_pos_interval_must_be_positive(parse, interval):
+    with pytest.raises(ValueError):
+        check_mobility_args(parse("--pos-interval", interval))
+
+
+def test_trajectory_rate_must_be_positive(parse):
+    with pytest.raises(ValueError):
+        check_mobility_args(parse("--trajectory-rate", "0"))
+
+
+def test_default_arguments_are_valid(parse):
+    check_mobility_args(parse())
+    check_mobility_args(parse("--pos-interval", "0.5"))
+
+
+def test_constant_velocity_step_and_pack():
+    engine = MobilityEngine()
+    engine.add_node(1, (0.0, 0.0, 100.0), "constant", velocity=(1.0, 0.0, 1.5))
+    engine.step(2.0)
+    np.testing.assert_allclose(engine.pos[0], (2.0, 0.0, 103.0))
+    assert POSITION_STRUCT.unpack(bytes(engine.pack())) == (False, 2.0, 0.0, 103.0)
+
+
+def test_waypoint_moves_at_speed_to_the_target():
+    engine = MobilityEngine(seed=1)
+    # a box of one point, the next target is the same point
+    engine.add_node(2, (0.0, 0.0, 50.0), "waypoint", speed=2.0, area_min=(10.0, 0.0, 50.0), area_max=(10.0, 0.0, 50.0))
+    engine.step(2.0)
+    np.testing.assert_allclose(engine.pos[0], (4.0, 0.0, 50.0))
+    engine.step(10.0)
+    np.testing.assert_allclose(engine.pos[0], (10.0, 0.0, 50.0))
+
+
+def test_waypoint_stays_in_the_area():
+    engine = MobilityEngine(seed=2)
+    engine.add_node(2, (0.0, 0.0, 50.0), "waypoint", speed=5.0, area_min=(-20.0, -10.0, 50.0),
+                    area_max=(20.0, 10.0, 50.0))
+    previous = engine.pos[0].copy()
+    for _ in range(200):
+        engine.step(1.0)
+        assert np.linalg.norm(engine.pos[0] - previous) <= 5.0 + 1e-9
+        assert np.all(engine.pos[0] >= (-20.0, -10.0, 50.0)) and np.all(engine.pos[0] <= (20.0, 10.0, 50.0))
+        previous = engine.pos[0].copy()
+
+
+@pytest.mark.parametrize("travelled, expected", [
+    (50.0, (50.0, 0.0)),     # first leg
+    (105.0, (100.0, 5.0)),   # turning to the second leg
+    (130.0, (80.0, 10.0)),   # second leg runs back
+    (210.0, (0.0, 10.0)),    # end of the pattern
+    (250.0, (40.0, 10.0)),   # returning along the pattern
+])
+def test_lawnmower_pattern(travelled, expected):
+    engine = MobilityEngine()
+    engine.add_node(2, (1000.0, 2000.0, 30.0), "lawnmower", speed=10.0, leg_length=100.0, leg_spacing=10.0, legs=2)
+    engine.step(travelled / 10.0)
+    np.testing.assert_allclose(engine.pos[0], (1000.0 + expected[0], 2000.0 + expected[1], 30.0), atol=1e-9)
+
+
+def test_circle_keeps_the_radius():
+    engine = MobilityEngine()
+    engine.add_node(2, (100.0, 0.0, 10.0), "circle", speed=50.0 * np.pi, radius=100.0, center=(0.0, 0.0, 10.0))
+    # a quarter turn per second
+    engine.step(1.0)
+    np.testing.assert_allclose(engine.pos[0], (0.0, 100.0, 10.0), atol=1e-9)
+    engine.step(0.3)
+    assert np.linalg.norm(engine.pos[0, :2]) == pytest.approx(100.0)
+
+
+def test_many_nodes_of_mixed_models():
+    engine = MobilityEngine(seed=3)
+    models = ["constant", "waypoint", "lawnmower", "circle"]
+    for i in range(1000):
+        engine.add_node(i + 2, (float(i), 0.0, 10.0), models[i % 4], velocity=(1.0, 0.0, 0.0))
+    assert len(engine) == 1000 and len(engine.pos) == 1000
+    assert list(engine.node_ids[:3]) == [2, 3, 4]
+    engine.step(1.0)
+    np.testing.assert_allclose(engine.pos[::4, 0], np.arange(0.0, 1000.0, 4.0) + 1.0)
+    assert len(engine.pack()) == 1000 * POSITION_STRUCT.size
+
+
+def header_constants() -> dict:
+    """The POSITION_BATCH_* constants of position_data.h"""
+    header = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "position_data.h")
+    with open(header, "rt") as f:
+        text = f.read()
+    constants = {name: int(value, 0) for name, value in
+                 re.findall(r"constexpr (?:unsigned char|std::size_t) POSITION_BATCH_(\w+) = (\w+);", text)}
+    constants["MAGIC"] = "".join(re.search(r"POSITION_BATCH_MAGIC\[2\] = \{'(.)', '(.)'\}", text).groups()).encode()
+    return constants
+
+
+def test_batch_layout_matches_position_data_h():
+    constants = header_constants()
+    assert constants["MAGIC"] == BATCH_MAGIC
+    assert constants["VERSION"] == BATCH_VERSION
+    assert constants["FLAG_TIMESTAMP"] == BATCH_FLAG_TIMESTAMP
+    assert constants["HEADER_SIZE"] == BATCH_HEADER_STRUCT.size
+    assert constants["RECORD_SIZE"] == BATCH_RECORD_DTYPE.itemsize
+    assert constants["RECORD_SIZE"] + constants["TIMESTAMP_SIZE"] == BATCH_RECORD_TS_DTYPE.itemsize
+
+
+@pytest.mark.parametrize("timestamp", [None, 1234.5])
+def test_batch_round_trip(timestamp):
+    node_ids = np.array([1, 2, 700])
+    geodetic = np.array([False, True, False])
+    pos = np.array([[1.0, 2.0, 3.0], [45.5, 12.25, -10.0], [-1.0, 0.0, 100.0]])
+    # at most two records per datagram
+    record = struct.Struct("<H?ddd" + ("d" if timestamp is not None else ""))
+    datagrams = pack_position_batches(node_ids, geodetic, pos, timestamp,
+                                      max_datagram=BATCH_HEADER_STRUCT.size + 2 * record.size)
+    assert [len(b"".join(buffers)) for buffers in datagrams] == [6 + 2 * record.size, 6 + record.size]
+    decoded = []
+    for buffers in datagrams:
+        data = b"".join(buffers)
+        # the layout of position_data.h, independent of the numpy dtypes
+        magic, version, flags, count = struct.unpack_from("<2sBBH", data)
+        assert (magic, version, bool(flags & 0x01)) == (b"PB", 1, timestamp is not None)
+        decoded += [record.unpack_from(data, 6 + i * record.size) for i in range(count)]
+        records = unpack_position_batch(data)
+        assert len(records) == count
+    assert [r[0] for r in decoded] == [1, 2, 700]
+    assert [r[1] for r in decoded] == [False, True, False]
+    np.testing.assert_array_equal([r[2:5] for r in decoded], pos)
+    if timestamp is not None:
+        assert {r[5] for r in decoded} == {timestamp}
+
+
+def test_invalid_batches():
+    with pytest.raises(ValueError):
+        unpack_position_batch(b"PB")
+    with pytest.raises(ValueError):
+        unpack_position_batch(BATCH_HEADER_STRUCT.pack(b"XX", BATCH_VERSION, 0, 0))
+    with pytest.raises(ValueError):
+        unpack_position_batch(BATCH_HEADER_STRUCT.pack(BATCH_MAGIC, BATCH_VERSION, 0, 2) + bytes(27))
+    with pytest.raises(ValueError):
+        pack_position_batches(np.array([1]), np.array([False]), np.zeros((1, 3)), max_datagram=20)
+
+
+def test_dead_reckoning_suppression():
+    dr = DeadReckoning(tolerance=10.0, max_interval=60.0)
+    geodetic = np.array([False, False])
+    pos = np.array([[0.0, 0.0, 0.0], [100.0, 0.0, 0.0]])
+    # the first update of every node is always sent
+    assert list(dr.due(0.0, geodetic, pos)) == [True, True]
+    pos[0, 0] = 5.0
+    pos[1, 0] = 111.0
+    assert list(dr.due(5.0, geodetic, pos)) == [False, True]
+    # the error is measured from the last sent position, not the last checked one
+    pos[0, 0] = 10.5
+    assert list(dr.due(10.0, geodetic, pos)) == [True, False]
+    # after max_interval every node is updated
+    assert list(dr.due(65.0, geodetic, pos)) == [False, True]
+    assert list(dr.due(70.0, geodetic, pos)) == [True, False]
+    assert dr.suppressed == 4
+
+
+def test_dead_reckoning_geodetic_metres():
+    dr = DeadReckoning(tolerance=100.0, max_interval=60.0)
+    geodetic = np.array([True, True])
+    pos = np.array([[60.0, 10.0, 0.0], [60.0, 10.0, 0.0]])
+    dr.due(0.0, geodetic, pos)
+    # 0.001 deg latitude is about 111 m, 0.001 deg longitude at 60 deg latitude about 56 m
+    pos[0, 0] += 0.001
+    pos[1, 1] += 0.001
+    assert list(dr.due(1.0, geodetic, pos)) == [True, False]
+
+
+def test_dead_reckoning_keeps_the_update_interval(parse):
+    args = parse("--pos-tolerance", "5")
+    engine_from_args(args, 2)
+    assert args.pos_interval == 5.0
+    assert isinstance(dead_reckoning_from_args(args), DeadReckoning)
+    assert dead_reckoning_from_args(parse()) is None
+    with pytest.raises(ValueError):
+        dead_reckoning_from_args(parse("--pos-tolerance", "-1"))
@@ -0,0 +1,117 @@
+import gzip
+
+import numpy as np
+import pytest
+
+from ns_log import NsLogParser, parse_files
+
+LOG = (b"Starting ns\n"
+       b"[1700000000]::0.5::2::UWAPPPOS: starting position listener on port 4100\n"
+       b"[1700000000]::12.5::2::UWAPPPOS: setting local node position to (1.5,-2,30)\n"
+       b"1700000001::13.25::3::UWAPPPOS: setting geodetic node position to (45.25,12.5,-10)\n"
+       b"[1700000001]::14::3::UWAPPLICATION::SN_RECEIVED_12\n"
+       b"[1700000002]::15.5::UWPHYSICAL::PACKET_DROPPED\n"
+       b"[1700000002]::16::2::UWAPPPOS: some text\n"
+       b"[1700000003]::20::2::UWAPPPOS: stopping position listener\n")
+
+
+def decoded(parser: NsLogParser, kind: str) -> dict:
+    """Columns of a kind with the category codes replaced by the values, the codes depend on the chunks"""
+    table = parser.tables[kind]
+    columns = table.columns()
+    for name, categories in table.categories.items():
+        columns[name] = np.array(categories, dtype=object)[columns[name]]
+    return columns
+
+
+def assert_tables_equal(a: NsLogParser, b: NsLogParser) -> None:
+    assert list(a.tables) == list(b.tables)
+    for kind in a.tables:
+        assert a.tables[kind].rows == b.tables[kind].rows
+        expected = decoded(b, kind)
+        for name, data in decoded(a, kind).items():
+            np.testing.assert_array_equal(data, expected[name])
+
+
+def test_parse_all_kinds():
+    parser = NsLogParser()
+    parser.feed(LOG)
+    parser.flush()
+    events = parser.table("events")
+    assert list(events["epoch"]) == [1700000000] * 2 + [1700000001] * 2 + [1700000002] * 2 + [1700000003]
+    assert list(events["node"]) == [2, 2, 3, 3, -1, 2, 2]
+    events = decoded(parser, "events")
+    assert list(events["module"]) == ["UWAPPPOS"] * 3 + ["UWAPPLICATION", "UWPHYSICAL"] + ["UWAPPPOS"] * 2
+    # lines without event have an empty event
+    assert list(events["event"]) == [""] * 3 + ["SN_RECEIVED", "PACKET_DROPPED"] + [""] * 2
+    assert list(events["value"]) == [-1] * 3 + [12] + [-1] * 3
+    position = parser.table("position")
+    assert list(position["geodetic"]) == [False, True]
+    np.testing.assert_array_equal(np.column_stack((position["x"], position["y"], position["z"])),
+                                  [[1.5, -2.0, 30.0], [45.25, 12.5, -10.0]])
+    np.testing.assert_array_equal(position["time"], [12.5, 13.25])
+    listener = parser.table("listener")
+    assert list(listener["started"]) == [True, False]
+    assert list(listener["port"]) == [4100, -1]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 100])
+def test_records_split_across_chunks(chunk_size):
+    whole = NsLogParser()
+    whole.feed(LOG)
+    whole.flush()
+    parser = NsLogParser()
+    for i in range(0, len(LOG), chunk_size):
+        parser(LOG[i:i + chunk_size])
+    parser.close()
+    assert_tables_equal(parser, whole)
+    assert parser.bytes_parsed == whole.bytes_parsed == len(LOG)
+
+
+def test_flush_parses_the_last_line():
+    parser = NsLogParser()
+    parser.feed(LOG + b"[1700000004]::21::3::UWAPPLICATION::SN_RECEIVED_13")
+    assert parser.tables["events"].rows == 7
+    parser.flush()
+    assert parser.tables["events"].rows == 8
+    assert parser.table("events")["value"][-1] == 13
+    # nothing left to parse
+    parser.flush()
+    assert parser.tables["events"].rows == 8
+
+
+def test_selected_kinds():
+    parser = NsLogParser(kinds=("listener",))
+    parser.feed(LOG)
+    assert list(parser.tables) == ["listener"]
+    assert parser.tables["listener"].rows == 2
+
+
+def test_save_and_load(tmp_path):
+    filename = str(tmp_path / "ns_run.events.npz")
+    parser = NsLogParser(filename=filename)
+    parser.feed(LOG)
+    parser.close()
+    loaded = NsLogParser.load(filename)
+    assert_tables_equal(loaded, parser)
+    # loaded categories keep encoding new values
+    loaded.feed(b"[1700000005]::22::2::UWAPPLICATION::SN_RECEIVED_14\n")
+    assert loaded.tables["events"].rows == 8
+    assert list(decoded(loaded, "events")["event"][-2:]) == ["", "SN_RECEIVED"]
+    assert sorted(loaded.tables["events"].categories["event"]) == ["", "PACKET_DROPPED", "SN_RECEIVED"]
+
+
+def test_parse_files(tmp_path):
+    plain = tmp_path / "ns_run.log.1"
+    plain.write_bytes(LOG[:200])
+    compressed = tmp_path / "ns_run.log.gz"
+    with gzip.open(compressed, "wb") as f:
+        f.write(LOG[200:])
+    parser = parse_files([str(plain), str(compressed)], chunk_size=16)
+    # the line split between the files is lost, the files are parsed independently
+    whole = NsLogParser()
+    whole.feed(LOG[:200])
+    whole.flush()
+    whole.feed(LOG[200:])
+    whole.flush()
+    assert_tables_equal(parser, whole)
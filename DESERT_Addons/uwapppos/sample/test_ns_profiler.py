@@ -0,0 +1,46 @@
+import subprocess
+
+import numpy as np
+
+from ns_profiler import PROFILE_COLUMNS, NsProfiler
+
+
+def test_profile_of_the_child_process(tmp_path):
+    # the shell stands for run.sh, sleep for its ns child
+    shell = subprocess.Popen(["sh", "-c", "sleep 10; true"])
+    filename = str(tmp_path / "ns_run.profile.npz")
+    try:
+        profiler = NsProfiler(shell.pid, filename, interval=0.02, process_name="sleep")
+        profiler.start()
+        profiler.should_stop.wait(0.5)
+        profiler.stop()
+        profiler.join()
+    finally:
+        shell.kill()
+        shell.wait()
+    assert profiler.process is not None and profiler.process.name() == "sleep"
+    with np.load(filename) as data:
+        assert sorted(data.files) == sorted(PROFILE_COLUMNS)
+        t = data["t"]
+        assert len(t) >= 5 and np.all(np.diff(t) > 0.0)
+        assert np.all(data["rss"] > 0) and np.all(data["threads"] == 1)
+        assert len(data["cpu_percent"]) == len(t)
+    summary = profiler.summary()
+    assert summary["samples"] == len(t) and summary["threads_max"] == 1
+
+
+def test_series_grows_beyond_the_initial_size(tmp_path):
+    profiler = NsProfiler(0, str(tmp_path / "profile.npz"))
+    for i in range(1000):
+        profiler._append((float(i),) + (1.0,) * (len(PROFILE_COLUMNS) - 1))
+    series = profiler.series()
+    assert len(series["t"]) == 1000 and series["t"][-1] == 999.0
+
+
+def test_no_child_process(tmp_path):
+    filename = tmp_path / "profile.npz"
+    shell = subprocess.Popen(["true"])
+    shell.wait()
+    profiler = NsProfiler(shell.pid, str(filename))
+    profiler.run()
+    assert profiler.process is None and not filename.exists()
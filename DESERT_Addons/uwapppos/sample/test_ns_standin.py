@@ -0,0 +1,78 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+from frame_decoder import FRAME_START
+from mobility import POSITION_STRUCT
+from ns_standin import NsStandin
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def options(**opts) -> dict:
+    """opt(...) settings of one sending node, the application port of node 1 is free"""
+    app_port = free_port()
+    return {"protocol": "tcp", "nn": 1, "start": 0.0, "stop": 5.0, "app_port_base": app_port - 1,
+            "app_pos_port_base": free_port() - 1, **opts}
+
+
+async def echo_round_trip(standin: NsStandin, payload: bytes, timeout: float) -> bytes:
+    """Send payload as node 1 and return what comes back within timeout"""
+    task = asyncio.create_task(standin.run_async())
+    for _ in range(100):
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", standin.port_base + 1)
+            break
+        except OSError:
+            await asyncio.sleep(0.01)
+    writer.write(payload)
+    await writer.drain()
+    try:
+        data = await asyncio.wait_for(reader.readexactly(len(payload) + 2), timeout)
+    except asyncio.TimeoutError:
+        data = b""
+    writer.close()
+    task.cancel()
+    standin._close()
+    return data
+
+
+def test_echo_round_trip():
+    standin = NsStandin(options(), mode="echo", delay=0.2, linger=0.0)
+    start = time.monotonic()
+    data = asyncio.run(echo_round_trip(standin, b"hello", 5.0))
+    # the packet comes back framed with 'D' + length after the delay
+    assert data == bytes((FRAME_START, 5)) + b"hello"
+    assert time.monotonic() - start >= 0.2
+    assert (standin.sent[1], standin.received[1], standin.lost) == (1, 1, 0)
+
+
+def test_lost_packet_is_not_delivered():
+    standin = NsStandin(options(), mode="echo", loss=1.0, linger=0.0)
+    assert asyncio.run(echo_round_trip(standin, b"hello", 0.3)) == b""
+    assert (standin.sent[1], standin.received[1], standin.lost) == (1, 0, 1)
+
+
+@pytest.mark.parametrize("mode, destinations", [("broadcast", [1, 3]), ("sink", [1]), ("echo", [2])])
+def test_destinations(mode, destinations):
+    standin = NsStandin(options(nn=2), mode=mode)
+    assert standin.destinations(2) == destinations
+
+
+def test_loss_rate_and_propagation_delay():
+    standin = NsStandin(options(nn=1), mode="broadcast", loss=0.25, sound_speed=1500.0, seed=1)
+    delivered = []
+    standin.deliver = lambda dst, payload: delivered.append(dst)
+    for _ in range(4000):
+        standin.on_packet(2, b"x")
+    assert standin.lost + len(delivered) == 4000
+    assert standin.lost / 4000 == pytest.approx(0.25, abs=0.03)
+    standin.on_position(1, POSITION_STRUCT.pack(False, 0.0, 0.0, 0.0))
+    standin.on_position(2, POSITION_STRUCT.pack(False, 3000.0, 0.0, 0.0))
+    assert standin.propagation_delay(1, 2) == 2.0
@@ -0,0 +1,102 @@
+import socket
+
+import pytest
+
+from outbound import OutboundQueue
+
+
+@pytest.fixture
+def pair():
+    a, b = socket.socketpair()
+    for s in (a, b):
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        s.setblocking(False)
+    yield a, b
+    a.close()
+    b.close()
+
+
+def message(i: int, size: int = 1000) -> bytes:
+    return bytes([i % 256]) * size
+
+
+def stall(queue: OutboundQueue) -> list:
+    """Put a message larger than the socket buffers, returns it, its head is partially sent"""
+    messages = [message(0, 1 << 20)]
+    assert queue.put(messages[0], wait=False)
+    assert queue.pending
+    return messages
+
+
+def receive_all(queue: OutboundQueue, sock: socket.socket) -> bytes:
+    data = b""
+    while True:
+        try:
+            data += sock.recv(65536)
+        except BlockingIOError:
+            if not queue.pending:
+                return data
+        queue.flush()
+
+
+def test_partial_writes_keep_the_stream(pair):
+    a, b = pair
+    queue = OutboundQueue(a, high_water=1 << 20)
+    messages = stall(queue)
+    assert queue.partial_writes == 1
+    messages.append(message(255))
+    queue.put([messages[-1][:10], messages[-1][10:]], wait=False)
+    assert receive_all(queue, b) == b"".join(messages)
+    assert queue.sent == len(messages)
+    assert queue.depth == 0
+
+
+
+def test_reject_policy(pair):
+    a, b = pair
+    discarded = []
+    queue = OutboundQueue(a, high_water=3000, policy="reject", on_discard=discarded.append)
+    stall(queue)
+    depth = queue.depth
+    assert not queue.put(message(0, 4000))
+    assert queue.depth == depth
+    assert queue.rejected == 1
+    assert discarded == [1]
+
+
+def test_drop_oldest_never_drops_the_partially_sent_head(pair):
+    a, b = pair
+    discarded = []
+    queue = OutboundQueue(a, high_water=1 << 20, policy="drop_oldest", on_discard=discarded.append)
+    messages = stall(queue)
+    queued = [message(100 + i) for i in range(3)]
+    for m in queued:
+        queue.put(m, wait=False)
+    queue.high_water = queue.depth
+    new = message(200)
+    assert queue.put(new)
+    assert queue.dropped == 1
+    assert discarded == [1]
+    # the head is completed, the oldest unsent message is gone
+    assert receive_all(queue, b) == b"".join(messages + queued[1:] + [new])
+
+
+def test_large_message_fits_an_empty_queue(pair):
+    a, b = pair
+    queue = OutboundQueue(a, high_water=10, policy="reject")
+    assert not queue.full(100)
+    assert queue.put(message(1, 100))
+    assert b.recv(200) == message(1, 100)
+
+
+def test_closed_queue_rejects(pair):
+    a, b = pair
+    queue = OutboundQueue(a)
+    queue.close()
+    assert not queue.put(b"x")
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        OutboundQueue(None, policy="lifo")
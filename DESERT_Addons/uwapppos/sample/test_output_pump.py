@@ -0,0 +1,39 @@
+import gzip
+
+import pytest
+
+import output_pump
+from output_pump import AnsiStripper, RotatingLogWriter, add_output_arguments, check_output_args
+
+
+ADD_ARGUMENTS = [add_output_arguments]
+
+
+def test_zstd_needs_zstandard(parse, monkeypatch):
+    monkeypatch.setattr(output_pump, "zstandard", None)
+    with pytest.raises(ValueError):
+        check_output_args(parse("--log-compression", "zstd"))
+    check_output_args(parse("--log-compression", "gzip"))
+
+
+def test_negative_log_size_rejected(parse):
+    with pytest.raises(ValueError):
+        check_output_args(parse("--log-max-size", "-1"))
+
+
+def test_ansi_sequence_split_across_chunks():
+    stripper = AnsiStripper()
+    assert stripper.strip(b"red \x1b[3") == b"red "
+    assert stripper.strip(b"1mtext\x1b[0m\n") == b"text\n"
+    assert stripper.flush() == b""
+
+
+def test_rotation_keeps_backups(tmp_path):
+    writer = RotatingLogWriter(str(tmp_path / "ns.log"), "gzip", max_bytes=10, backup_count=2)
+    for line in (b"0123456789", b"abcdefghij", b"ABCDEFGHIJ", b"last"):
+        writer.write(line)
+    writer.close()
+    assert gzip.open(tmp_path / "ns.log.gz").read() == b"last"
+    assert gzip.open(tmp_path / "ns.log.gz.1").read() == b"ABCDEFGHIJ"
+    assert gzip.open(tmp_path / "ns.log.gz.2").read() == b"abcdefghij"
+    assert not (tmp_path / "ns.log.gz.3").exists()
@@ -0,0 +1,93 @@
+import json
+import os
+
+import pytest
+
+from results import ResultsStore, summarize_run
+
+NS_LOG = (b"[1700000000]::0.5::2::UWAPPPOS: starting position listener on port 4100\n"
+          b"[1700000000]::12.5::2::UWAPPPOS: setting local node position to (1.5,-2,30)\n"
+          b"[1700000001]::13.25::3::UWAPPPOS: setting local node position to (4,5,6)\n"
+          b"Mean Throughput : 123.5\n")
+
+
+def write_run(path, bitrate: int = 4800, received: int = 8) -> None:
+    os.makedirs(path, exist_ok=True)
+    (path / "ns_run.log").write_bytes(NS_LOG)
+    (path / "uwAppPos.tcl").write_text(f"set opt(bitrate) {bitrate}\nset opt(ack_mode) \"none\"\n"
+                                       f"set opt(port_base) {4000 + bitrate}\n")
+    stats = {"sent": 10, "received": received, "received_bytes": 100 * received, "duration_s": 2.0,
+             "latency": {"p50_us": 5000, "p99_us": 9000, "max_us": 12000},
+             "flows": [{"src": 2, "dst": 3, "sent": 10, "received": received}]}
+    (path / "stats.json").write_text(json.dumps(stats))
+
+
+def test_summary(tmp_path):
+    write_run(tmp_path)
+    summary = summarize_run(str(tmp_path), sorted(os.listdir(tmp_path)))
+    assert summary["position updates"] == 2 and summary["position nodes"] == 2
+    assert summary["position listeners"] == 1
+    assert summary["ns mean throughput"] == 123.5
+    assert summary["delivery ratio"] == 0.8
+    assert summary["throughput [bit/s]"] == 8.0 * 800 / 2.0
+    assert summary["latency p99 [ms]"] == 9.0
+    assert summary["ns error lines"] == 0
+
+
+def test_python_log_lines_across_chunks(tmp_path):
+    write_run(tmp_path)
+    # the third line starts before and ends after the first chunk of 4 MiB
+    filler = b"PYTHON 12:00:00 INFO: " + b"x" * ((1 << 22) - 200) + b"\n"
+    lines = [b"PYTHON 12:00:00 WARNING: slow\n", filler, b"PYTHON 12:00:01 ERROR: lost " + b"y" * 300 + b"\n",
+             b"PYTHON 12:00:02 WARNING: without newline"]
+    (tmp_path / "python.log").write_bytes(b"".join(lines))
+    summary = summarize_run(str(tmp_path), sorted(os.listdir(tmp_path)))
+    assert (summary["python warnings"], summary["python errors"]) == (2, 1)
+
+
+def test_without_throughput_measurement(tmp_path):
+    write_run(tmp_path)
+    stats = json.loads((tmp_path / "stats.json").read_text())
+    stats["duration_s"] = None
+    (tmp_path / "stats.json").write_text(json.dumps(stats))
+    assert "throughput [bit/s]" not in summarize_run(str(tmp_path), sorted(os.listdir(tmp_path)))
+
+
+def test_cache_hit_and_rerun_after_a_change(tmp_path):
+    for i, bitrate in enumerate((4800, 9600)):
+        write_run(tmp_path / "sweep" / f"scenario_{i:03d}", bitrate)
+    store = ResultsStore(str(tmp_path / "sweep"), jobs=1).refresh()
+    assert (store.analyzed, store.cached) == (2, 0)
+    assert os.path.exists(tmp_path / "sweep" / ".results_cache.json")
+    # the port parameters differ per run without being a parameter of the scenario
+    assert store.varying() == ["bitrate"]
+    digests = [run.digest for run in store.runs]
+
+    store = ResultsStore(str(tmp_path / "sweep"), jobs=1).refresh()
+    assert (store.analyzed, store.cached) == (0, 2)
+    assert [run.digest for run in store.runs] == digests
+    assert [run.get("bitrate") for run in store.query(bitrate=[4800, "9600"])] == [4800.0, 9600.0]
+
+    # a rerun of the first scenario
+    write_run(tmp_path / "sweep" / "scenario_000", 4800, received=5)
+    store = ResultsStore(str(tmp_path / "sweep"), jobs=1).refresh()
+    assert (store.analyzed, store.cached) == (1, 1)
+    assert store.runs[0].digest != digests[0] and store.runs[1].digest == digests[1]
+    assert store.runs[0].get("delivery ratio") == 0.5
+    rows = store.compare("bitrate", ["delivery ratio", "throughput [bit/s]"])
+    assert [(row["bitrate"], row["runs"], row["delivery ratio"]) for row in rows] == [(4800.0, 1, 0.5),
+                                                                                     (9600.0, 1, 0.8)]
+    assert rows[0]["throughput [bit/s]"] == pytest.approx(2000.0)
+
+
+def test_touched_run_keeps_its_summary(tmp_path):
+    write_run(tmp_path / "run")
+    store = ResultsStore(str(tmp_path), jobs=1).refresh()
+    digest = store.runs[0].digest
+    st = os.stat(tmp_path / "run" / "stats.json")
+    os.utime(tmp_path / "run" / "stats.json", ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    store = ResultsStore(str(tmp_path), jobs=1).refresh()
+    # hashed again, same content
+    assert store.analyzed == 1 and store.runs[0].digest == digest
+    with open(tmp_path / ".results_cache.json") as f:
+        assert list(json.load(f)["summaries"]) == [digest]
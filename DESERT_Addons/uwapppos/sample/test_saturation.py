@@ -0,0 +1,93 @@
+from argparse import Namespace
+
+import pytest
+
+import saturation
+from saturation import SaturationSearch
+
+
+def search(monkeypatch, capacity: float, max_load: float = 100.0, bisect_steps: int = 4, max_p99=None,
+           row=None) -> SaturationSearch:
+    """SaturationSearch on a link which delivers every message up to capacity [messages/s]"""
+    def run_scenario(index, params, udp, harness_args, out_dir, ports):
+        load = float(harness_args[harness_args.index("--offered-load") + 1])
+        if row is not None:
+            return row(load)
+        ratio = min(1.0, capacity / load)
+        return {"exit code": 0, "delivery ratio": ratio, "latency p99 [ms]": 100.0 / ratio}
+    monkeypatch.setattr(saturation, "run_scenario", run_scenario)
+    args = Namespace(start_load=1.0, factor=2.0, max_load=max_load, bisect_steps=bisect_steps, max_loss=0.05,
+                     max_p99=max_p99, udp=False, out_dir="saturation")
+    return SaturationSearch(0, {"bitrate": 4800}, args, ["-t", "60"], ports=None)
+
+
+def loads(s: SaturationSearch) -> list:
+    return [row["offered load"] for row in s.steps]
+
+
+def test_ramp_and_bisect(monkeypatch):
+    s = search(monkeypatch, capacity=5.0)
+    summary = s.run()
+    # the ramp saturates at 8, the knee is narrowed down between 4 and 8
+    assert loads(s)[:4] == [1.0, 2.0, 4.0, 8.0]
+    assert len(s.steps) == 8 and summary["steps"] == 8
+    assert 4.0 < summary["max sustainable load"] <= 5.0 / 0.95 < summary["knee"] <= 8.0
+    assert summary["knee"] / summary["max sustainable load"] == pytest.approx(2.0 ** (1 / 16))
+    assert summary["result"] == "loss 7.7 %"
+    assert summary["bitrate"] == 4800 and summary["config"] == 0
+    assert s.out_dir.endswith("config_000")
+
+
+def test_latency_limit(monkeypatch):
+    summary = search(monkeypatch, capacity=5.0, max_p99=100.0, bisect_steps=0,
+                     row=lambda load: {"exit code": 0, "delivery ratio": 1.0, "latency p99 [ms]": 20.0 * load}).run()
+    assert summary["max sustainable load"] == 4.0 and summary["knee"] == 8.0
+    assert summary["result"] == "p99 latency 160 ms"
+
+
+def test_not_saturated(monkeypatch):
+    s = search(monkeypatch, capacity=1000.0, max_load=10.0)
+    summary = s.run()
+    assert loads(s) == [1.0, 2.0, 4.0, 8.0]
+    assert summary["max sustainable load"] == 8.0 and "knee" not in summary
+    assert summary["result"] == "not saturated up to 10"
+
+
+def test_saturated_at_the_start_load(monkeypatch):
+    summary = search(monkeypatch, capacity=0.5).run()
+    assert summary["max sustainable load"] is None and summary["steps"] == 1
+    assert summary["result"] == "saturated at the start load: loss 50.0 %"
+
+
+def test_failed_harness_is_not_bisected(monkeypatch):
+    def row(load):
+        if load < 3.0:
+            return {"exit code": 0, "delivery ratio": 1.0, "latency p99 [ms]": 100.0}
+        return {"exit code": 1}
+    s = search(monkeypatch, capacity=5.0, row=row)
+    summary = s.run()
+    assert loads(s) == [1.0, 2.0, 4.0]
+    assert summary["max sustainable load"] == 2.0 and summary["knee"] == 4.0
+    assert summary["result"] == "harness failed with exit code 1"
+
+
+def test_nothing_sent(monkeypatch):
+    def row(load):
+        return {"exit code": 0, "delivery ratio": None if load < 3.0 else 0.5, "latency p99 [ms]": None}
+    s = search(monkeypatch, capacity=5.0, row=row)
+    summary = s.run()
+    # no verdict at 1 and 2, no sustainable load to bisect from
+    assert loads(s) == [1.0, 2.0, 4.0]
+    assert [r["sustainable"] for r in s.steps] == [None, None, False]
+    assert summary["max sustainable load"] is None
+
+
+def test_no_verdict_stops_the_bisection(monkeypatch):
+    def row(load):
+        if 4.0 < load < 8.0:
+            return {"exit code": 0, "delivery ratio": None, "latency p99 [ms]": None}
+        return {"exit code": 0, "delivery ratio": 1.0 if load <= 4.0 else 0.5, "latency p99 [ms]": 100.0}
+    s = search(monkeypatch, capacity=5.0, row=row)
+    summary = s.run()
+    assert len(s.steps) == 5
+    assert summary["max sustainable load"] == 4.0 and summary["knee"] == 8.0
@@ -0,0 +1,58 @@
+import pytest
+
+from shard import SharedStats, SharedTracker
+
+
+@pytest.fixture
+def stats():
+    stats = SharedStats(5, 2)
+    yield stats
+    stats.close()
+
+
+def ready(stats, *node_ids):
+    for node_id in node_ids:
+        stats.nodes["ready_ns"][node_id] = 10 ** 9 + node_id
+
+
+def test_silent_receiver_counts_as_expected(stats):
+    # regression: a ready node which received nothing dropped out of the expected count
+    ready(stats, 1, 2, 3, 4)
+    stats.nodes["sent"][2] = 10
+    stats.nodes["received"][1] = 10
+    stats.nodes["received"][3] = 10
+    summary = stats.summary()
+    assert summary["sent"] == 10
+    assert summary["expected"] == 30
+    assert summary["received"] == 20
+
+
+def test_failed_nodes_are_no_receivers(stats):
+    ready(stats, 1, 2, 3)
+    stats.nodes["failed"][3] = 1
+    stats.nodes["sent"][2] = 4
+    stats.nodes["discarded"][2] = 1
+    summary = stats.summary()
+    assert summary["sent"] == 3
+    assert summary["discarded"] == 1
+    assert summary["expected"] == 3
+
+
+def test_trackers_of_two_workers_are_merged(stats):
+    trackers = [SharedTracker(stats, 0), SharedTracker(stats, 1)]
+    payload = trackers[0].next_payload(2, b"hello")
+    assert trackers[1].on_receive(1, payload) is not None
+    assert trackers[1].on_receive(3, b"not a measurement") is None
+    summary = stats.summary()
+    assert summary["sent"] == 1 and summary["received"] == 2
+    assert summary["unknown_payloads"] == 1
+    assert summary["latency"]["count"] == 1
+    assert summary["received_bytes"] == len(payload) + len(b"not a measurement")
+    assert summary["duration_s"] >= 0.0
+
+
+def test_attach_by_name(stats):
+    other = SharedStats(5, 2, name=stats.name)
+    other.nodes["sent"][2] = 7
+    other.close()
+    assert stats.nodes["sent"][2] == 7
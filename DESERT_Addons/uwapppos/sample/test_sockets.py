@@ -1,22 +1,34 @@
 #!/usr/bin/env python3
 
-import sys
 import os
 from datetime import datetime
-import errno
+import functools
 import logging  
-import re
 import select
-import signal
 import socket
-from string import Template
-import struct
 import subprocess
 import threading
 import time
 from argparse import ArgumentParser
 
-from process_utils import get_process_id_by_name
+from ns_profiler import NsProfiler
+from output_pump import add_output_arguments, check_output_args, pump_from_args
+from journal import PositionReplay, add_replay_arguments, replay_from_args
+from latency import LatencyTracker, add_latency_arguments, report, tracker_from_args
+from log_pipeline import add_logging_arguments, events, setup_logging, stop_logging
+from traffic import TrafficScheduler, add_traffic_arguments, profile_factory
+from node_driver import AsyncNodeDriver, payload_size
+from frame_decoder import FrameDecoder
+from outbound import OutboundQueue, add_queue_arguments, print_queue_summary
+from mobility import PosWorker, add_mobility_arguments, check_mobility_args, dead_reckoning_from_args, engine_from_args
+from ns_standin import add_standin_arguments, parse_tcl_options, standin_command
+from ns_launch import add_launch_arguments, default_cache_dir, launch_command
+from lifecycle import Lifecycle, stop_process
+from startup import Startup, add_startup_arguments, startup_from_args
+from clock import SyncServer, add_clock_arguments, clock_from_args, template_substitutions
+from shard import ShardPool, add_shard_arguments, check_shard_args
+from metrics import add_metrics_arguments, metrics_from_args
+from scenario import CustomTemplate, SCRIPT_DIR, add_scenario_arguments, enter_work_dir, parse_opt_overrides, render_script
 
 try:
     import colorlog
@@ -24,35 +36,12 @@ try:
     handler.setFormatter(colorlog.ColoredFormatter('%(log_color)sPYTHON %(asctime)s %(levelname)s: %(message)s'))
 
     logger = colorlog.getLogger(__file__)
-    logger.addHandler(handler)
+    logging.getLogger().addHandler(handler)
 except Exception as e:
     print(e)
     logger = logging.getLogger(__file__)
     logging.basicConfig(format='PYTHON %(asctime)s.%(msecs)03d %(levelname)s: %(message)s', level=logging.DEBUG, datefmt='%H:%M:%S')
 
-# 7-bit and 8-bit C1 ANSI sequences
-ansi_escape_8bit = re.compile(br'''
-    (?: # either 7-bit C1, two bytes, ESC Fe (omitting CSI)
-        \x1B
-        [@-Z\\-_]
-    |   # or a single 8-bit byte Fe (omitting CSI)
-        [\x80-\x9A\x9C-\x9F]
-    |   # or CSI + control codes
-        (?: # 7-bit CSI, ESC [ 
-            \x1B\[
-        |   # 8-bit CSI, 9B
-            \x9B
-        )
-        [0-?]*  # Parameter bytes
-        [ -/]*  # Intermediate bytes
-        [@-~]   # Final byte
-    )
-''', re.VERBOSE)
-
-
-class CustomTemplate(Template):
-	delimiter = '%$%'
-
 
 HOST = "127.0.0.1"  # The server's hostname or IP address
 UW_APP_PORT_BASE = 4000
@@ -62,12 +51,6 @@ UW_APP_UDP_POS_PORT_BASE = 5000
 last_send_dt = None
 
 
-class RepeatTimer(threading.Timer):  
-    def run(self):
-        while not self.finished.wait(self.interval):  
-            self.function(*self.args,**self.kwargs)  
-
-
 class SingleNode(object):
     def __init__(self, id: int, send_interval: float) -> None:
         """
@@ -79,158 +62,120 @@ class SingleNode(object):
         self.last_send_dt = None
 
 
-def _recv_wait(s: socket.socket, siz: int) -> bytes:
-    """Receive siz data bytes for non-blocking socket"""
-    d = bytes()
-    while len(d) < siz:
-        try:
-            d += s.recv(siz-len(d))
-        except socket.error as e:
-            if e.errno != errno.EAGAIN:
-                raise e
-    return d
-
-def _recv_data(sock_list) -> tuple[bool, bytes]:
-    """Receive AcoSim message with header"""
-    for s in sock_list:
-        header = s.recv(2)            
-        if header == b'':
-            return False, b""
-        if header[0] == 68: # 'D'
-            # data = s.recv(header[1])                         
-            data = _recv_wait(s, header[1])
-            if data:
-                # A readable client socket has data
-                return True, data
-            else:
-                # Interpret empty result as closed connection
-                return False, b""
-    return True, b""
-
-def _send_data_nonblocking(s: socket.socket, id:int, msg: bytes) -> int:
-    global last_send_dt
-    total_sent = 0
-    # data = struct.pack("<cB", b'D', len(msg)) + msg
-    data = msg    
-    while len(data):
-        try:
-            sent = s.send(data)
-            total_sent += sent
-            data = data[sent:]
-        except socket.error as e:
-            if e.errno != errno.EAGAIN:
-                raise e
-            return -total_sent
-    last_send_dt = datetime.now()
-    logger.info(f"Node {id} sent message '{msg.decode()}'")
-    return total_sent
-
-def connect_socket(s: socket.socket, address: tuple, retries: int = 5) -> bool:
-    counter = 0
-    while counter < retries:
+def _recv_frames(s: socket.socket, decoder: FrameDecoder):
+    """Read all available bytes of s and return the complete frames (without header) as memoryviews"""
+    decoder.recv_into(s)
+    return decoder.frames()
+
+class NodeSender(object):
+    def __init__(self, queue: OutboundQueue, id: int, msg: bytes, tracker: LatencyTracker = None) -> None:
+        """
+        Sends the messages of node id, called by the central traffic scheduler.
+        With the block policy a full queue must not hold back the scheduler
+        thread and with it every other node: the due messages are counted as
+        backlog and queued by the worker of the node when its socket drained,
+        see drain().
+        """
+        self.queue = queue
+        self.node_id = id
+        self.msg = msg
+        self.tracker = tracker
+        self.backlog = 0
+        self._stall_start = None
+        self._lock = threading.Lock()
+
+    def _put(self) -> bool:
+        """Queue a message, the measurement header and the message are sent by one sendmsg()"""
+        global last_send_dt
+        parts = self.tracker.next_message(self.node_id, self.msg) if self.tracker is not None else [self.msg]
+        if not self.queue.put(parts, wait=False):
+            return False
+        last_send_dt = datetime.now()
+        events.sent(self.node_id, parts)
+        return True
+
+    def __call__(self) -> bool:
+        with self._lock:
+            if self.queue.policy == "block" and (self.backlog or self.queue.full(len(self.msg))):
+                if not self.backlog:
+                    self._stall_start = time.monotonic()
+                self.backlog += 1
+                return True
+            return self._put()
+
+    def drain(self) -> None:
+        """Queue the backlog as far as the queue takes it, called by the worker after a flush"""
+        with self._lock:
+            while self.backlog and not self.queue.full(len(self.msg)):
+                self.backlog -= 1
+                self._put()
+            if not self.backlog and self._stall_start is not None:
+                self.queue.record_stall(time.monotonic() - self._stall_start)
+                self._stall_start = None
+
+def connect_socket(s: socket.socket, address: tuple, id: int, startup: Startup) -> bool:
+    """Connect with backoff until the startup deadline, the retries are woken up by the listener start message of the node"""
+    error = None
+    for delay in startup.delays(id):
         try:
             s.connect(address)
-            return True  
-        except socket.error as error:
-            print(f"Connection ot {address} failed, reason: {error}")
-            print(f"Attempt {counter} of {retries}")
-            counter += 1
-        time.sleep(1.0)
+            return True
+        except socket.error as e:
+            error = e
+            logger.debug(f"Connection to {address} failed, reason: {e}, retry in {1e3 * delay:.0f} ms")
+        startup.sleep(id, delay)
+    startup.set_failed(id, f"connection to {address} failed: {error}")
     return False
 
-def recv_send_worker(id: int, send_interval: int):
+def recv_send_worker(id: int, profile, tracker: LatencyTracker = None, scheduler: TrafficScheduler = None,
+                     lifecycle: Lifecycle = None, startup: Startup = None, create_queue=OutboundQueue,
+                     queues: dict = None):
     """ Worker thread, receives (and optionally sends) messages to ns2.
-        Sending is only active when send_interval > 0.0
+        Sending is only active when a traffic profile is given, the messages
+        are queued by the central scheduler as soon as every node is ready and
+        flushed by the worker when the socket becomes writable (see NodeSender).
+        Returns on disconnect or on the shutdown of the lifecycle.
     """
-    global last_send_dt
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:                
         logger.info(f"Node {id}: connecting to {(HOST, UW_APP_PORT_BASE+id)}")
         #s.connect((HOST, UW_APP_PORT_BASE+id))
-        if not connect_socket(s, (HOST, UW_APP_PORT_BASE+id)):
+        if not connect_socket(s, (HOST, UW_APP_PORT_BASE+id), id, startup):
             return
         logger.debug(f"Node {id} connected to {(HOST, UW_APP_PORT_BASE+id)}")
+        startup.set_ready(id)
         s.setblocking(0)
         msg = bytes(f"Message from node {id}", encoding="utf-8")
-        send_timer = RepeatTimer(interval=send_interval, function=_send_data_nonblocking, args=(s,id,msg))
-        if send_interval > 0.0:
-            send_timer.start()
+        queue = create_queue(s, on_discard=functools.partial(tracker.discard, id) if tracker is not None else None)
+        if queues is not None:
+            queues[id] = queue
+        startup.wait()
+        sender = NodeSender(queue, id, msg, tracker)
+        if profile is not None and not startup.stopping:
+            scheduler.add(id, profile, sender)
+        decoder = FrameDecoder()
         while True:
-            readable, _, _ = select.select([s], [], [], 5.0)
-            success, data = _recv_data(readable)
-            if not success:
-                logger.warning(f"Node {id}: disconnected from {(HOST, UW_APP_PORT_BASE+id)}")
+            readable, writable, _ = select.select([s, lifecycle, queue], [s] if queue.pending else [], [])
+            if lifecycle in readable:
                 break
-            if data:
-                n = datetime.now()
-                logger.info(f'{n.strftime("%H:%M:%S")} Node {id} received message (delay: unknown): {data.decode()}')
-        send_timer.cancel()  
-
-
-pos_data = {
-    "geodetic": False,
-    "x": 0.0,
-    "y": 0.0,
-    "z": 100.0,
-}
-speed = { "x": 1.0, "y": 0.0, "z": 1.5 }
-
-STOP_POSITION_WORKER = False
-
-
-def pos_worker(id, host, port):
-    """Worker thread sending the position data"""
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-        logger.info(f"Sending position data for node  {id} to {(host, port)}")
-        s.setblocking(False)
-        last_pos_update = 0.0
-        while not STOP_POSITION_WORKER:            
+            if queue in readable:
+                queue.clear_wakeup()
             try:
-                now_dt = datetime.utcnow()
-                now = time.mktime(now_dt.timetuple()) + now_dt.microsecond / 1e6
-                if last_pos_update > 0.0:
-                    deltaT = now - last_pos_update
-                    if deltaT > 0.0:
-                        pos_data["x"] += deltaT * speed["x"]
-                        pos_data["y"] += deltaT * speed["y"]
-                        pos_data["z"] += deltaT * speed["z"]
-                last_pos_update = now
-                logger.debug(f"Sending position for node {id} ...")
-                packed_data = struct.pack("<?ddd", pos_data["geodetic"], pos_data["x"], pos_data["y"], pos_data["z"])
-                s.sendto(packed_data, (host, port))
-            except Exception as e:
-                logger.error(f"Error sending position data for node {id}: {e}", exc_info=True)
-            time.sleep(5.0)
-        logger.info(f"Sending position data for node  {id} stopped")
-
-
-def output_reader(proc, filename_out, filename_err):
-    remove_ansi_escape_sequences_in_file = True
-    file_out = open(filename_out, 'w')
-    file_err = open(filename_err, 'w')
-    os.set_blocking(proc.stdout.fileno(), False)
-    os.set_blocking(proc.stderr.fileno(), False)
-    while (proc.returncode == None):
-        line = proc.stdout.readline()
-        if line:
-            sys.stdout.buffer.write(line)
-            sys.stdout.flush()
-            if remove_ansi_escape_sequences_in_file:
-                file_out.buffer.write(ansi_escape_8bit.sub(b'', line))
-            else:
-                file_out.buffer.write(line)
-            continue
-        #else:
-        #    break
-        line = proc.stderr.readline()
-        if line:
-            logger.error(line.decode())
-            file_err.buffer.write(line)
-            continue
-        # sleep only if no data was read from both
-        time.sleep(0.2)
-    logger.info("output_reader(): observed process terminated, closing files")
-    file_out.close()
-    file_err.close()
+                if s in writable:
+                    queue.flush()
+                    sender.drain()
+                if s in readable:
+                    for data in _recv_frames(s, decoder):
+                        delay = tracker.on_receive(id, data) if tracker is not None else None
+                        events.received(id, data, delay)
+            except OSError as e:
+                logger.warning(f"Node {id}: connection failed, {e}")
+                break
+            if decoder.closed:
+                logger.warning(f"Node {id}: disconnected from {(HOST, UW_APP_PORT_BASE+id)}")
+                break
+        if profile is not None:
+            scheduler.remove(id)
+        queue.close()
 
 
 # In your destination folder chosen during installation process:
@@ -249,77 +194,223 @@ START_SCRIPT=%$%{START_SCRIPT}
 ns $START_SCRIPT
 """
 
+# run the Python stand-in (ns_standin.py) instead of ns, no DESERT build needed
+standin_script_template = """#!/bin/bash
+
+set -eo pipefail
+
+%$%{STANDIN_COMMAND}
+"""
+
 
 def main():    
+    global UW_APP_PORT_BASE, UW_APP_UDP_POS_PORT_BASE
     argparser = ArgumentParser(description='Run network example with node position updates, see uwAppPos.tmpl for configuration.')
     argparser.add_argument('-n', '--num-nodes', type=int, default=NUM_SEND_NODES, help='Number of sending nodes')
     argparser.add_argument('-t', '--run-time', type=int, default=15, help='Run simulation for given number of seconds')
     argparser.add_argument('-v', '--verbose', action='count', default=0, help="Increase Logger output level, up to three times")
-    argparser.add_argument('-b', '--build-dir', required=True, help='DESERT build directory')
+    argparser.add_argument('-b', '--build-dir', help='DESERT build directory')
+    argparser.add_argument('--ns-standin', action='store_true',
+                           help='Run the Python ns stand-in (ns_standin.py) instead of ns, no DESERT build needed')
+    argparser.add_argument('-e', '--engine', choices=('asyncio', 'threads'), default='asyncio',
+                           help='Node driver: one asyncio event loop for all nodes or one thread per node')
+    add_mobility_arguments(argparser)
+    add_output_arguments(argparser)
+    add_latency_arguments(argparser)
+    add_traffic_arguments(argparser)
+    add_standin_arguments(argparser, prefix='standin-')
+    add_launch_arguments(argparser)
+    add_logging_arguments(argparser)
+    add_replay_arguments(argparser)
+    add_startup_arguments(argparser)
+    add_queue_arguments(argparser)
+    add_shard_arguments(argparser)
+    add_clock_arguments(argparser)
+    add_metrics_arguments(argparser)
+    add_scenario_arguments(argparser, UW_APP_PORT_BASE, UW_APP_UDP_POS_PORT_BASE)
+    argparser.add_argument('--profile-interval', type=float, default=1.0,
+                           help='Sample interval of the ns resource profiler in [s], 0 to disable')
 
     args = argparser.parse_args()
+    if args.build_dir is None and not args.ns_standin:
+        argparser.error("the DESERT build directory -b/--build-dir is required unless --ns-standin is given")
+    UW_APP_PORT_BASE = args.app_port_base
+    UW_APP_UDP_POS_PORT_BASE = args.pos_port_base
+    # the shared batch listener uses the unused port of node 0 of the position port block
+    pos_batch_port = UW_APP_UDP_POS_PORT_BASE if args.pos_batch else 0
     
-    logger.setLevel((logging.ERROR, logging.WARN, logging.INFO, logging.DEBUG)[min(args.verbose, 3)])
+    logging.getLogger().setLevel((logging.ERROR, logging.WARN, logging.INFO, logging.DEBUG)[min(args.verbose, 3)])
+    setup_logging(args)
 
     script = 'uwAppPos'
     # create ns2 tcl script
-    with open(f'{script}.tmpl', 'rt') as f:
-        s = CustomTemplate(f.read())
-        out = s.substitute(TMPL_NO_SENDERS=args.num_nodes,
-                           TMPL_PROTOCOL="tcp",
-                           TMPL_STOPTIME=args.run_time, 
-                           TMPL_APP_PORT_BASE=UW_APP_PORT_BASE, 
-                           TMPL_APP_POS_PORT_BASE=UW_APP_UDP_POS_PORT_BASE)
-        with open(f'{script}.tcl', 'wt') as f1:
-            f1.write(out)
-               
-    # create n2 start script
-    s = CustomTemplate(start_script_template)
-    out = s.substitute(BUILD_DIR=args.build_dir, START_SCRIPT=f'{script}.tcl')
+    enter_work_dir(args)
+    cache_dir = None if args.no_cache else (args.cache_dir or default_cache_dir())
+    try:
+        check_mobility_args(args)
+        check_output_args(args)
+        dead_reckoning = dead_reckoning_from_args(args)
+        check_shard_args(args)
+        clock = clock_from_args(args)
+        tracker = tracker_from_args(args, clock)
+        create_profile = profile_factory(args, args.num_nodes, payload_size(args.num_nodes + 1, tracker))
+        sync = None
+        if clock.virtual:
+            # ns runs without the real-time scheduler in lock-step with the harness
+            sync = SyncServer(clock, args.sync_step, args.sync_settle, host=HOST)
+        render_script(os.path.join(SCRIPT_DIR, f'{script}.tmpl'), f'{script}.tcl',
+                      overrides=parse_opt_overrides(args.opt),
+                      cache_dir=cache_dir,
+                      TMPL_NO_SENDERS=args.num_nodes,
+                      TMPL_PROTOCOL="tcp",
+                      TMPL_STOPTIME=args.run_time,
+                      TMPL_APP_PORT_BASE=UW_APP_PORT_BASE,
+                      TMPL_APP_POS_PORT_BASE=UW_APP_UDP_POS_PORT_BASE,
+                      TMPL_APP_POS_BATCH_PORT=pos_batch_port,
+                      **template_substitutions(clock, sync))
+        tcl_options = parse_tcl_options(f'{script}.tcl')
+        # node 1 is the receiving node, the listener start messages are printed with APPPOS debug_ >= 1
+        startup = startup_from_args(args, range(1, args.num_nodes + 2), announcements=tcl_options["apppos_debug"] >= 1)
+        if sync is not None:
+            # ns is held at the start time of the nodes until they are ready
+            sync.start_time = tcl_options["start"]
+    except (KeyError, ValueError) as e:
+        argparser.error(e.args[0])
+    try:
+        replay = replay_from_args(args)
+    except (OSError, ValueError) as e:
+        argparser.error(f"Cannot replay {args.replay}: {e}")
+    try:
+        metrics, metrics_threads = metrics_from_args(args)
+    except OSError as e:
+        argparser.error(f"Cannot serve the metrics on {args.metrics_host}:{args.metrics_port}: {e}")
+
+    # create n2 start script, with the cache it is only used for manual runs
+    if args.ns_standin:
+        s = CustomTemplate(standin_script_template)
+        out = s.substitute(STANDIN_COMMAND=standin_command(args, f'{script}.tcl'))
+    else:
+        s = CustomTemplate(start_script_template)
+        out = s.substitute(BUILD_DIR=args.build_dir, START_SCRIPT=f'{script}.tcl')
     with open('run.sh', 'wt') as f:
         f.write(out)
+    # ns exit, the run time or SIGINT/SIGTERM stop all workers at once
+    lifecycle = Lifecycle()
+    lifecycle.install_signal_handlers()
+    for t in metrics_threads:
+        lifecycle.add(t).start()
+    if sync is not None:
+        lifecycle.add(sync)
+        sync.start()
     # start process
-    ns_proc = subprocess.Popen(['/bin/bash', './run.sh'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    t1 = threading.Thread(target=output_reader, args=(ns_proc, 'ns_run.log', 'ns_run.err'))
+    try:
+        ns_argv, ns_env = launch_command(args, f'{script}.tcl')
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        argparser.error(f"Cannot load the DESERT environment of {args.build_dir}: {e}")
+    ns_proc = subprocess.Popen(ns_argv, env=ns_env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    ns_start_time = time.monotonic()  # record start time to observe runtime
+    startup.launched(ns_start_time)
+    lifecycle.add(startup)
+    # ns_proc is ns or the shell running run.sh, ns is the last command of run.sh
+    lifecycle.watch_process(ns_proc)
+    t1 = pump_from_args(args, ns_proc)
+    if startup.announcements:
+        t1.add_sink(startup)
     t1.start()
-    
-    ns_start_time = time.time()  # record start time to observe runtime
-
+    metrics.watch_pump(t1)
+    metrics.watch_startup(startup)
+    if args.profile_interval > 0.0:
+        profiler = NsProfiler(ns_proc.pid, 'ns_run.profile.npz', args.profile_interval)
+        profiler.start()
+
+    if replay is not None:
+        # the recorded payloads are sent as they are at the recorded times, the replay takes the place of the tracker
+        tracker = replay
+        create_profile = replay.profile
+    scheduler = lifecycle.add(TrafficScheduler(clock))
     threads = []
-    # threads.append(threading.Thread(target=recv_worker, args=(1,)))
-    threads.append(threading.Thread(target=recv_send_worker, args=(1,0.0)))
-    for i in range(args.num_nodes):
-        print(f"Creating send node {i+2}")
-        threads.append(threading.Thread(target=recv_send_worker, args=(i+2,5.0)))
-    threads.append(threading.Thread(target=pos_worker, args=(1, HOST, UW_APP_UDP_POS_PORT_BASE + 1)))
+    driver = None
+    pool = None
+    pos_worker = None
+    queues = {}
+    metrics.watch_queues(queues)
+    create_queue = functools.partial(OutboundQueue, high_water=args.queue_size, policy=args.queue_policy, wakeup=True)
+    if args.workers > 1:
+        # the shards send the traffic and the positions of their nodes, the pool feeds the startup
+        pool = lifecycle.add(ShardPool(args, "tcp", range(1, args.num_nodes + 2), startup, HOST, UW_APP_PORT_BASE,
+                                       UW_APP_UDP_POS_PORT_BASE, pos_batch_port,
+                                       driver_options={"queue_size": args.queue_size,
+                                                       "queue_policy": args.queue_policy},
+                                       report_interval=args.shard_report_interval))
+        threads.append(pool)
+        metrics.watch_pool(pool)
+    elif args.engine == 'asyncio':
+        driver = lifecycle.add(AsyncNodeDriver("tcp", HOST, UW_APP_PORT_BASE, startup=startup, tracker=tracker,
+                                               scheduler=scheduler, queue_size=args.queue_size,
+                                               queue_policy=args.queue_policy))
+        driver.add_node(1, 0.0)
+        for i in range(args.num_nodes):
+            print(f"Creating send node {i+2}")
+            driver.add_node(i+2, 0.0, profile=create_profile(i+2))
+        threads.append(threading.Thread(target=driver.run, name="AsyncNodeDriver"))
+        metrics.watch_driver(driver)
+        metrics.watch_scheduler(scheduler)
+    else:
+        scheduler.start()
+        metrics.watch_scheduler(scheduler)
+        # threads.append(threading.Thread(target=recv_worker, args=(1,)))
+        threads.append(threading.Thread(target=recv_send_worker, args=(1,None,tracker,scheduler,lifecycle,startup,create_queue,queues)))
+        for i in range(args.num_nodes):
+            print(f"Creating send node {i+2}")
+            threads.append(threading.Thread(target=recv_send_worker,
+                                            args=(i+2,create_profile(i+2),tracker,scheduler,lifecycle,startup,create_queue,queues)))
+    if replay is not None:
+        pos_worker = lifecycle.add(PositionReplay(replay, HOST, UW_APP_UDP_POS_PORT_BASE, pos_batch_port))
+    elif pool is None:
+        engine = engine_from_args(args, args.num_nodes)
+        pos_worker = lifecycle.add(PosWorker(engine, args.pos_interval, HOST, UW_APP_UDP_POS_PORT_BASE,
+                                             pos_batch_port, args.pos_batch_timestamps,
+                                             dead_reckoning, clock))
     for t in threads:
         t.start()
-    try:
-        while len(threads) > 0:
-            time.sleep(1.0)
-            # check if double of run time is elapsed and stop ns2 by SIGTERM
-            if (time.time() - ns_start_time) > 2*args.run_time:
-                logger.info("Double of run time is over, stopping ns2")
-                ns_proc_objects = get_process_id_by_name("ns")
-                for p in ns_proc_objects:
-                    os.kill(p.pid, signal.SIGTERM)
-                ns_start_time = time.time()  # reset start time to not kill the processes again in next loop
-            
-            # stop position worker threads
-            if len(get_process_id_by_name("ns")) == 0:
-                global STOP_POSITION_WORKER
-                STOP_POSITION_WORKER = True
-            
-            for thread in threads:
-                if not thread.is_alive():
-                    thread.join()
-                    threads.remove(thread)            
-        logger.info('All thread connections closed.')
-        ns_proc.terminate()  # terminate bash in which ns was running - this stops the output_reader() thread 
-        t1.join()
-    except KeyboardInterrupt:
-        pass    
-
+    # the position stream starts when every node is ready or failed
+    startup.wait()
+    if pos_worker is not None:
+        metrics.watch_pos_worker(pos_worker)
+        pos_worker.start()
+        threads.append(pos_worker)
+    if sync is not None:
+        sync.release()
+        threads.append(sync)
+    threads.extend(metrics_threads)
+    # stop the traffic when the run time is over, stop ns by SIGTERM if it does not halt
+    lifecycle.supervise(args.run_time, on_run_time=pool.stop_traffic if pool is not None else scheduler.clear,
+                        proc=ns_proc, start=0.0 if clock.virtual else ns_start_time, clock=clock)
+    lifecycle.join(threads)
+    logger.info('All thread connections closed.')
+    stop_process(ns_proc)  # terminate ns or bash in which ns was running if still running - this stops the OutputPump thread
+    t1.join()
+    if args.profile_interval > 0.0:
+        profiler.stop()
+        profiler.join()
+    scheduler.stop()
+    startup.print_summary()
+    if sync is not None:
+        sync.print_summary()
+    if pool is not None:
+        pool.print_summary()
+        report(pool.stats, args)
+        pool.close()
+    else:
+        scheduler.print_summary()
+        print_queue_summary(driver.queues() if driver is not None else queues)
+        pos_worker.print_summary()
+        if replay is not None:
+            replay.print_summary()
+        else:
+            report(tracker, args)
+    stop_logging()
+    lifecycle.close()
 
 if __name__ == '__main__':
     main()
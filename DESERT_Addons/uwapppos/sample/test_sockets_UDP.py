@@ -1,22 +1,30 @@
 #!/usr/bin/env python3
 
-import sys
 import os
-from datetime import datetime
-import errno
+import functools
 import logging
-import re
-import select
-import signal
 import socket
-from string import Template
-import struct
 import subprocess
 import threading
 import time
 from argparse import ArgumentParser
 
-from process_utils import get_process_id_by_name
+from ns_profiler import NsProfiler
+from output_pump import add_output_arguments, check_output_args, pump_from_args
+from journal import PositionReplay, add_replay_arguments, replay_from_args
+from latency import LatencyTracker, add_latency_arguments, report, tracker_from_args
+from log_pipeline import add_logging_arguments, events, setup_logging, stop_logging
+from traffic import TrafficScheduler, add_traffic_arguments, profile_factory
+from node_driver import AsyncNodeDriver, payload_size
+from udp_receiver import MAX_PAYLOAD, UdpReceiver, open_udp_socket
+from mobility import PosWorker, add_mobility_arguments, check_mobility_args, dead_reckoning_from_args, engine_from_args
+from ns_standin import add_standin_arguments, parse_tcl_options, standin_command
+from ns_launch import add_launch_arguments, default_cache_dir, launch_command
+from lifecycle import Lifecycle, stop_process
+from startup import add_startup_arguments, startup_from_args
+from shard import ShardPool, add_shard_arguments, check_shard_args
+from metrics import add_metrics_arguments, metrics_from_args
+from scenario import CustomTemplate, SCRIPT_DIR, add_scenario_arguments, enter_work_dir, parse_opt_overrides, render_script
 
 try:
     import colorlog
@@ -25,41 +33,13 @@ try:
     handler.setFormatter(colorlog.ColoredFormatter('%(log_color)sPYTHON %(asctime)s %(levelname)s: %(message)s'))
 
     logger = colorlog.getLogger(__file__)
-    logger.addHandler(handler)
+    logging.getLogger().addHandler(handler)
 except Exception as e:
     print(e)
     logger = logging.getLogger(__file__)
     logging.basicConfig(format='PYTHON %(asctime)s.%(msecs)03d %(levelname)s: %(message)s', level=logging.DEBUG,
                         datefmt='%H:%M:%S')
 
-file_handler = logging.FileHandler("python.log",mode='w+')
-formatter = logging.Formatter("%(asctime)s - %(threadName)s - %(levelname)s - %(message)s")
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-
-# 7-bit and 8-bit C1 ANSI sequences
-ansi_escape_8bit = re.compile(br'''
-    (?: # either 7-bit C1, two bytes, ESC Fe (omitting CSI)
-        \x1B
-        [@-Z\\-_]
-    |   # or a single 8-bit byte Fe (omitting CSI)
-        [\x80-\x9A\x9C-\x9F]
-    |   # or CSI + control codes
-        (?: # 7-bit CSI, ESC [ 
-            \x1B\[
-        |   # 8-bit CSI, 9B
-            \x9B
-        )
-        [0-?]*  # Parameter bytes
-        [ -/]*  # Intermediate bytes
-        [@-~]   # Final byte
-    )
-''', re.VERBOSE)
-
-
-class CustomTemplate(Template):
-    delimiter = '%$%'
-
 
 HOST = "127.0.0.1"  # The server's hostname or IP address
 UW_APP_PORT_BASE = 4000  # receive port of uwAppPos
@@ -68,138 +48,59 @@ NUM_SEND_NODES = 2
 UW_APP_UDP_POS_PORT_BASE = 6000
 
 
-class RepeatTimer(threading.Timer):
-
-    def run(self):
-        while not self.finished.wait(self.interval):
-            self.function(*self.args, **self.kwargs)
-
-
-class SingleNode(threading.Thread):
-    def __init__(self, node_id: int, send_interval: float) -> None:
+class SingleNode(object):
+    def __init__(self, node_id: int, profile, tracker: LatencyTracker = None, scheduler: TrafficScheduler = None,
+                 receiver: UdpReceiver = None) -> None:
         """
         id: node id
-        send_interval: send interval in [s], set to 0.0 to not send messages
+        profile: traffic profile (see traffic.py), None to not send messages
+        tracker: optional LatencyTracker, messages are sent as measurement payloads
+        scheduler: central TrafficScheduler sending the messages of this node
+        receiver: UdpReceiver serving the socket of this node
         """
-        super().__init__(name=f"NodeThread{node_id}")
         self.node_id = node_id
-        self.send_interval = send_interval
-        self.should_stop = False
-
-
-    def stop(self):
-        """stop the thread."""
-        self.should_stop = True
+        self.profile = profile
+        self.tracker = tracker
+        self.scheduler = scheduler
+        self.receiver = receiver
+        self.socket = None
 
     def send_payload(self, s: socket, msg, address):
-        logger.info(f"Sending '{msg}' to {address}")
-        s.sendto(msg, address)
-
-    def run(self):
-        """ Worker thread, receives (and optionally sends) messages to ns2.
-            Sending is only active when send_interval > 0.0
+        if self.tracker is not None:
+            msg = self.tracker.next_payload(self.node_id, msg)
+        try:
+            s.sendto(msg, address)
+        except (BlockingIOError, ConnectionRefusedError) as e:
+            logger.warning(f"Node {self.node_id}: message dropped, {e}")
+            return
+        events.sent(self.node_id, msg)
+
+    def on_receive(self, data):
+        delay = self.tracker.on_receive(self.node_id, data) if self.tracker is not None else None
+        events.received(self.node_id, data, delay)
+
+    def open(self) -> None:
+        """ Bind the node socket, received messages are dispatched by the receiver
         """
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            logger.info(f"Node {self.node_id}: UDP socket binding to {(HOST, UW_APP_SEND_PORT_BASE + self.node_id)}")
-            s.bind((HOST, UW_APP_SEND_PORT_BASE + self.node_id))
-            s.settimeout(0.2)
-            msg = bytes(f"Message from node {self.node_id}", encoding="utf-8")
-            send_timer = RepeatTimer(interval=self.send_interval,
-                                     function=self.send_payload,
-                                     args=(s, msg, (HOST, UW_APP_PORT_BASE + self.node_id)))
-            if self.send_interval > 0.0:
-                send_timer.start()
-            while not self.should_stop:
-                try:
-                    data, addr = s.recvfrom(1024)  # buffer size is 1024 bytes
-                    if data:
-                        n = datetime.now()
-                        logger.info(
-                            f'{n.strftime("%H:%M:%S")} Node {self.node_id} received message (delay: unknown): {data.decode()}')
-                except TimeoutError:
-                    pass
-            send_timer.cancel()
-
+        logger.info(f"Node {self.node_id}: UDP socket binding to {(HOST, UW_APP_SEND_PORT_BASE + self.node_id)}")
+        self.socket = open_udp_socket((HOST, UW_APP_SEND_PORT_BASE + self.node_id))
+        self.receiver.add(self.socket, self.on_receive)
 
-class PosWorker(threading.Thread):
-    def __init__(self, node_id: int,
-                 send_interval: float,
-                 send_address: tuple,
-                 pos_data: dict,
-                 speed: dict = None) -> None:
+    def start(self) -> None:
+        """ Start sending, only active when a traffic profile is given
         """
-        id: node id
-        send_interval: send interval in [s], set to 0.0 to not send messages
-        """
-        super().__init__(name=f"PosWorker{node_id}")
-        if speed is None:
-            speed = {"x": 1.0, "y": 0.0, "z": 1.5}
-        self.node_id = node_id
-        self.send_interval = send_interval
-        self.should_stop = False
-        self.send_address = send_address
-        self.pos_data = pos_data
-        self.speed = speed
+        msg = bytes(f"Message from node {self.node_id}", encoding="utf-8")
+        if self.profile is not None:
+            self.scheduler.add(self.node_id, self.profile,
+                               functools.partial(self.send_payload, self.socket, msg, (HOST, UW_APP_PORT_BASE + self.node_id)))
 
-    def stop(self):
-        """stop the thread."""
-        self.should_stop = True
-
-    def run(self):
-        """Worker thread sending the position data"""
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            logger.info(f"Sending position data for node  {self.node_id} to {self.send_address}")
-            # s.setblocking(False)
-            last_pos_update = 0.0
-            while not self.should_stop:
-                try:
-                    now_dt = datetime.utcnow()
-                    now = time.mktime(now_dt.timetuple()) + now_dt.microsecond / 1e6
-                    if last_pos_update > 0.0:
-                        dt = now - last_pos_update
-                        if dt > 0.0:
-                            self.pos_data["x"] += dt * self.speed["x"]
-                            self.pos_data["y"] += dt * self.speed["y"]
-                            self.pos_data["z"] += dt * self.speed["z"]
-                    last_pos_update = now
-                    logger.info(f"Sending position for node {self.node_id}: {self.pos_data}")
-                    packed_data = struct.pack("<?ddd", self.pos_data["geodetic"],
-                                              self.pos_data["x"], self.pos_data["y"], self.pos_data["z"])
-                    s.sendto(packed_data, self.send_address)
-                except Exception as e:
-                    logger.error(f"Error sending position data for node {self.node_id}: {e}", exc_info=True)
-                time.sleep(5.0)
-            logger.info(f"Sending position data for node  {self.node_id} stopped")
-
-
-def output_reader(proc, filename_out, filename_err):
-    remove_ansi_escape_sequences_in_file = True
-    file_out = open(filename_out, 'w')
-    file_err = open(filename_err, 'w')
-    os.set_blocking(proc.stdout.fileno(), False)
-    os.set_blocking(proc.stderr.fileno(), False)
-    while proc.returncode is None:
-        line = proc.stdout.readline()
-        if line:
-            sys.stdout.buffer.write(line)
-            sys.stdout.flush()
-            if remove_ansi_escape_sequences_in_file:
-                file_out.buffer.write(ansi_escape_8bit.sub(b'', line))
-            else:
-                file_out.buffer.write(line)
-            continue
-        # else:
-        #    break
-        line = proc.stderr.readline()
-        if line:
-            logger.error(line.decode())
-            file_err.buffer.write(line)
-            continue
-        # sleep only if no data was read from both
-        time.sleep(0.2)
-    logger.info("output_reader(): observed process terminated, closing files")
-    file_out.close()
-    file_err.close()
+    def close(self) -> None:
+        if self.profile is not None:
+            self.scheduler.remove(self.node_id)
+        if self.socket is not None:
+            self.receiver.remove(self.socket)
+            self.socket.close()
+            self.socket = None
 
 
 # In your destination folder chosen during installation process:
@@ -218,8 +119,17 @@ START_SCRIPT=%$%{START_SCRIPT}
 ns $START_SCRIPT
 """
 
+# run the Python stand-in (ns_standin.py) instead of ns, no DESERT build needed
+standin_script_template = """#!/bin/bash
+
+set -eo pipefail
+
+%$%{STANDIN_COMMAND}
+"""
+
 
 def main():
+    global UW_APP_PORT_BASE, UW_APP_SEND_PORT_BASE, UW_APP_UDP_POS_PORT_BASE
     argparser = ArgumentParser(
         description='Run network example with node position updates, see uwAppPos_UDP.tmpl for configuration.')
     argparser.add_argument('-n', '--num-nodes', type=int, default=NUM_SEND_NODES, help='Number of sending nodes')
@@ -227,85 +137,220 @@ def main():
     argparser.add_argument('-t', '--run-time', type=int, default=15, help='Run simulation for given number of seconds')
     argparser.add_argument('-v', '--verbose', action='count', default=0,
                            help="Increase Logger output level, up to three times")
-    argparser.add_argument('-b', '--build-dir', required=True, help='DESERT build directory')
+    argparser.add_argument('-b', '--build-dir', help='DESERT build directory')
+    argparser.add_argument('--ns-standin', action='store_true',
+                           help='Run the Python ns stand-in (ns_standin.py) instead of ns, no DESERT build needed')
+    argparser.add_argument('-e', '--engine', choices=('asyncio', 'threads'), default='asyncio',
+                           help='Node driver: one asyncio event loop for all nodes or one epoll receive thread for all node sockets')
+    add_mobility_arguments(argparser)
+    add_output_arguments(argparser)
+    add_latency_arguments(argparser)
+    add_traffic_arguments(argparser)
+    add_standin_arguments(argparser, prefix='standin-')
+    add_launch_arguments(argparser)
+    add_logging_arguments(argparser)
+    add_replay_arguments(argparser)
+    add_startup_arguments(argparser)
+    add_shard_arguments(argparser)
+    add_metrics_arguments(argparser)
+    add_scenario_arguments(argparser, UW_APP_PORT_BASE, UW_APP_UDP_POS_PORT_BASE, UW_APP_SEND_PORT_BASE)
+    argparser.add_argument('--max-payload', type=int, default=MAX_PAYLOAD,
+                           help='Size of the receive buffers in [bytes], larger datagrams are truncated')
+    argparser.add_argument('--profile-interval', type=float, default=1.0,
+                           help='Sample interval of the ns resource profiler in [s], 0 to disable')
 
     args = argparser.parse_args()
+    if args.build_dir is None and not args.ns_standin:
+        argparser.error("the DESERT build directory -b/--build-dir is required unless --ns-standin is given")
     start_ns = not args.no_ns_start
-    logger.setLevel((logging.ERROR, logging.WARN, logging.INFO, logging.DEBUG)[min(args.verbose, 3)])
+    UW_APP_PORT_BASE = args.app_port_base
+    UW_APP_SEND_PORT_BASE = args.app_send_port_base
+    UW_APP_UDP_POS_PORT_BASE = args.pos_port_base
+    # the shared batch listener uses the unused port of node 0 of the position port block
+    pos_batch_port = UW_APP_UDP_POS_PORT_BASE if args.pos_batch else 0
+    logging.getLogger().setLevel((logging.ERROR, logging.WARN, logging.INFO, logging.DEBUG)[min(args.verbose, 3)])
+    # python.log belongs to the work directory, the harnesses of a sweep do not share one
+    os.makedirs(args.work_dir, exist_ok=True)
+    file_handler = logging.FileHandler(os.path.join(args.work_dir, "python.log"), mode='w+')
+    file_handler.setFormatter(logging.Formatter("%(asctime)s - %(threadName)s - %(levelname)s - %(message)s"))
+    logging.getLogger().addHandler(file_handler)
+    setup_logging(args)
 
     script = 'uwAppPos_UDP'
     # create ns2 tcl script
-    with open(f'{script}.tmpl', 'rt') as f:
-        s = CustomTemplate(f.read())
-        out = s.substitute(TMPL_NO_SENDERS=args.num_nodes,
-                           TMPL_PROTOCOL="udp",
-                           TMPL_STOPTIME=args.run_time,
-                           TMPL_APP_SEND_HOST=HOST,
-                           TMPL_APP_PORT_BASE=UW_APP_PORT_BASE,
-                           TMPL_APP_SEND_PORT_BASE=UW_APP_SEND_PORT_BASE,
-                           TMPL_APP_POS_PORT_BASE=UW_APP_UDP_POS_PORT_BASE)
-        with open(f'{script}.tcl', 'wt') as f1:
-            f1.write(out)
-
-    # create n2 start script
-    s = CustomTemplate(start_script_template)
-    out = s.substitute(BUILD_DIR=args.build_dir, START_SCRIPT=f'{script}.tcl')
+    enter_work_dir(args)
+    cache_dir = None if args.no_cache else (args.cache_dir or default_cache_dir())
+    try:
+        check_mobility_args(args)
+        check_output_args(args)
+        dead_reckoning = dead_reckoning_from_args(args)
+        render_script(os.path.join(SCRIPT_DIR, f'{script}.tmpl'), f'{script}.tcl',
+                      overrides=parse_opt_overrides(args.opt),
+                      cache_dir=cache_dir,
+                      TMPL_NO_SENDERS=args.num_nodes,
+                      TMPL_PROTOCOL="udp",
+                      TMPL_STOPTIME=args.run_time,
+                      TMPL_APP_SEND_HOST=HOST,
+                      TMPL_APP_PORT_BASE=UW_APP_PORT_BASE,
+                      TMPL_APP_SEND_PORT_BASE=UW_APP_SEND_PORT_BASE,
+                      TMPL_APP_POS_PORT_BASE=UW_APP_UDP_POS_PORT_BASE,
+                      TMPL_APP_POS_BATCH_PORT=pos_batch_port)
+        # node 1 is the receiving node, UDP nodes have nothing to connect to, without ns output or
+        # listener start messages (APPPOS debug_ >= 1) a node is ready when its socket is bound
+        startup = startup_from_args(args, range(1, args.num_nodes + 2),
+                                    announcements=start_ns and parse_tcl_options(f'{script}.tcl')["apppos_debug"] >= 1)
+        check_shard_args(args)
+        tracker = tracker_from_args(args)
+        create_profile = profile_factory(args, args.num_nodes, payload_size(args.num_nodes + 1, tracker))
+    except (KeyError, ValueError) as e:
+        argparser.error(e.args[0])
+    try:
+        replay = replay_from_args(args)
+    except (OSError, ValueError) as e:
+        argparser.error(f"Cannot replay {args.replay}: {e}")
+    try:
+        metrics, metrics_threads = metrics_from_args(args)
+    except OSError as e:
+        argparser.error(f"Cannot serve the metrics on {args.metrics_host}:{args.metrics_port}: {e}")
+
+    # create n2 start script, with the cache it is only used for manual runs
+    if args.ns_standin:
+        s = CustomTemplate(standin_script_template)
+        out = s.substitute(STANDIN_COMMAND=standin_command(args, f'{script}.tcl'))
+    else:
+        s = CustomTemplate(start_script_template)
+        out = s.substitute(BUILD_DIR=args.build_dir, START_SCRIPT=f'{script}.tcl')
     with open('run.sh', 'wt') as f:
         f.write(out)
+    # ns exit, the run time or SIGINT/SIGTERM stop all workers at once
+    lifecycle = Lifecycle()
+    lifecycle.install_signal_handlers()
+    for t in metrics_threads:
+        lifecycle.add(t).start()
+    ns_proc = None
     if start_ns:
         # start process
-        ns_proc = subprocess.Popen(['/bin/bash', './run.sh'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        t1 = threading.Thread(target=output_reader, args=(ns_proc, 'ns_run.log', 'ns_run.err'))
+        try:
+            ns_argv, ns_env = launch_command(args, f'{script}.tcl')
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            argparser.error(f"Cannot load the DESERT environment of {args.build_dir}: {e}")
+        ns_proc = subprocess.Popen(ns_argv, env=ns_env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # ns_proc is ns or the shell running run.sh, ns is the last command of run.sh
+        lifecycle.watch_process(ns_proc)
+        t1 = pump_from_args(args, ns_proc)
+        if startup.announcements:
+            t1.add_sink(startup)
         t1.start()
-        ns_start_time = time.time()  # record start time to observe runtime
-
+        metrics.watch_pump(t1)
+        if args.profile_interval > 0.0:
+            profiler = NsProfiler(ns_proc.pid, 'ns_run.profile.npz', args.profile_interval)
+            profiler.start()
+    ns_start_time = time.monotonic()  # record start time to observe runtime
+    startup.launched(ns_start_time)
+    lifecycle.add(startup)
+    metrics.watch_startup(startup)
+
+    if replay is not None:
+        # the recorded payloads are sent as they are at the recorded times, the replay takes the place of the tracker
+        tracker = replay
+        create_profile = replay.profile
+    scheduler = lifecycle.add(TrafficScheduler())
     threads = []
-    threads.append(SingleNode(1, 0.0))
-    for i in range(args.num_nodes):
-        print(f"Creating send node {i + 2}")
-        threads.append(SingleNode(i + 2, 5.0))
-    threads.append(PosWorker(1,
-                             5.0,
-                             (HOST, UW_APP_UDP_POS_PORT_BASE + 1),
-                             {
-                                 "geodetic": False,
-                                 "x": 0.0,
-                                 "y": 0.0,
-                                 "z": 100.0,
-                             }
-                             ))
+    nodes = []
+    driver = None
+    pool = None
+    pos_worker = None
+    if args.workers > 1:
+        # the shards send the traffic and the positions of their nodes, the pool feeds the startup
+        pool = lifecycle.add(ShardPool(args, "udp", range(1, args.num_nodes + 2), startup, HOST, UW_APP_PORT_BASE,
+                                       UW_APP_UDP_POS_PORT_BASE, pos_batch_port, UW_APP_SEND_PORT_BASE,
+                                       driver_options={"max_payload": args.max_payload},
+                                       report_interval=args.shard_report_interval))
+        threads.append(pool)
+        metrics.watch_pool(pool)
+    elif args.engine == 'asyncio':
+        driver = lifecycle.add(AsyncNodeDriver("udp", HOST, UW_APP_PORT_BASE, UW_APP_SEND_PORT_BASE, startup=startup,
+                                               tracker=tracker, scheduler=scheduler, max_payload=args.max_payload))
+        driver.add_node(1, 0.0)
+        for i in range(args.num_nodes):
+            print(f"Creating send node {i + 2}")
+            driver.add_node(i + 2, 0.0, profile=create_profile(i + 2))
+        threads.append(threading.Thread(target=driver.run, name="AsyncNodeDriver"))
+        metrics.watch_driver(driver)
+        metrics.watch_scheduler(scheduler)
+    else:
+        # one receive thread for all node sockets, the messages are sent by the scheduler thread
+        receiver = lifecycle.add(UdpReceiver(args.max_payload))
+        nodes.append(SingleNode(1, None, tracker, scheduler, receiver))
+        for i in range(args.num_nodes):
+            print(f"Creating send node {i + 2}")
+            nodes.append(SingleNode(i + 2, create_profile(i + 2), tracker, scheduler, receiver))
+        for node in nodes:
+            node.open()
+            if not startup.announcements:
+                startup.set_ready(node.node_id)
+        scheduler.start()
+        metrics.watch_scheduler(scheduler)
+        threads.append(receiver)
+    if replay is not None:
+        pos_worker = lifecycle.add(PositionReplay(replay, HOST, UW_APP_UDP_POS_PORT_BASE, pos_batch_port))
+    elif pool is None:
+        engine = engine_from_args(args, args.num_nodes)
+        pos_worker = lifecycle.add(PosWorker(engine,
+                                             args.pos_interval,
+                                             HOST,
+                                             UW_APP_UDP_POS_PORT_BASE,
+                                             pos_batch_port,
+                                             args.pos_batch_timestamps,
+                                             dead_reckoning))
     for t in threads:
         t.start()
-    try:
-        while len(threads) > 0:
-            time.sleep(1.0)
-            if start_ns:
-                # check if double of run time is elapsed and stop ns2 by SIGTERM
-                if (time.time() - ns_start_time) > 2 * args.run_time:
-                    logger.info("Double of run time is over, stopping ns2")
-                    ns_proc_objects = get_process_id_by_name("ns")
-                    for p in ns_proc_objects:
-                        os.kill(p.pid, signal.SIGTERM)
-                    ns_start_time = time.time()  # reset start time to not kill the processes again in next loop
-
-                # stop position worker threads
-                if len(get_process_id_by_name("ns")) == 0:
-                    global STOP_POSITION_WORKER
-                    STOP_POSITION_WORKER = True
-                    for thread in threads:
-                        thread.stop()
-
-                for thread in threads:
-                    if not thread.is_alive():
-                        thread.join()
-                        threads.remove(thread)
-        logger.info('All thread connections closed.')
-        if start_ns:
-            ns_proc.terminate()  # terminate bash in which ns was running - this stops the output_reader() thread 
-            t1.join()
-    except KeyboardInterrupt:
-        pass
-
+    for node in nodes:
+        # ns receives on the node port after the listener start message of the node
+        if node.node_id in startup.ready:
+            continue
+        if startup.wait_announced(node.node_id):
+            startup.set_ready(node.node_id)
+        else:
+            startup.set_failed(node.node_id, "no listener start message in the ns output")
+    # traffic and position stream start when every node is ready or failed
+    startup.wait()
+    for node in nodes:
+        if node.node_id in startup.ready and not startup.stopping:
+            node.start()
+    if pos_worker is not None:
+        metrics.watch_pos_worker(pos_worker)
+        pos_worker.start()
+        threads.append(pos_worker)
+    threads.extend(metrics_threads)
+    # stop the traffic when the run time is over, stop ns by SIGTERM if it does not halt
+    lifecycle.supervise(args.run_time, on_run_time=pool.stop_traffic if pool is not None else scheduler.clear,
+                        proc=ns_proc, start=ns_start_time)
+    lifecycle.join(threads)
+    for node in nodes:
+        node.close()
+    logger.info('All thread connections closed.')
+    if start_ns:
+        stop_process(ns_proc)  # terminate ns or bash in which ns was running if still running - this stops the OutputPump thread
+        t1.join()
+        if args.profile_interval > 0.0:
+            profiler.stop()
+            profiler.join()
+    scheduler.stop()
+    startup.print_summary()
+    if pool is not None:
+        pool.print_summary()
+        report(pool.stats, args)
+        pool.close()
+    else:
+        scheduler.print_summary()
+        pos_worker.print_summary()
+        if replay is not None:
+            replay.print_summary()
+        else:
+            report(tracker, args)
+    stop_logging()
+    lifecycle.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+from startup import MAX_PENDING_LINE, Startup, add_startup_arguments, startup_from_args
+
+ADD_ARGUMENTS = [add_startup_arguments]
+
+OUTPUT = (b"[1700000000]::0::UWAPPPOS: initializing geodetic reference to (45,12)\n"
+          b"[1700000000]::0::2::UWAPPPOS: starting position listener on port 4102\n"
+          b"[1700000000]::0::3::UWAPPPOS: starting position listener on port 4103\n"
+          b"[1700000000]::0::9::UWAPPPOS: starting position listener on port 4109\n")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 40, len(OUTPUT)])
+def test_announcements_split_across_chunks(chunk_size):
+    startup = Startup([2, 3], announcements=True)
+    for i in range(0, len(OUTPUT), chunk_size):
+        startup(OUTPUT[i:i + chunk_size])
+    # node 9 is not driven by the harness
+    assert sorted(startup.announced) == [2, 3]
+
+
+def test_incomplete_line_is_not_matched():
+    startup = Startup([2], announcements=True)
+    startup(b"[1700000000]::0::2::UWAPPPOS: starting position listener on port 41")
+    assert not startup.announced
+    startup(b"02\n")
+    assert list(startup.announced) == [2]
+
+
+def test_pending_line_is_bounded():
+    startup = Startup([2], announcements=True)
+    startup(b"x" * (10 * MAX_PENDING_LINE))
+    assert len(startup._pending) == MAX_PENDING_LINE
+
+
+def test_announcement_wakes_up_the_retries():
+    startup = Startup([2], announcements=True)
+    heard = []
+    startup.add_listener(heard.append)
+    timer = threading.Timer(0.05, startup, (OUTPUT,))
+    timer.start()
+    t0 = time.monotonic()
+    assert not startup.sleep(2, 10.0)
+    assert time.monotonic() - t0 < 5.0
+    timer.join()
+    assert heard == [2]
+    assert startup.wait_announced(2)
+    # announced once
+    startup(OUTPUT)
+    assert heard == [2]
+
+
+def test_backoff_delays():
+    startup = Startup([2], timeout=60.0, initial_delay=0.01, max_delay=0.1)
+    delays = startup.delays(2)
+    assert [next(delays) for _ in range(6)] == pytest.approx([0.01, 0.02, 0.04, 0.08, 0.1, 0.1])
+    assert startup.attempts[2] == 6
+    startup.stop()
+    assert list(delays) == []
+    assert startup.sleep(2, 10.0)
+
+
+def test_backoff_ends_at_the_deadline():
+    startup = Startup([2], timeout=0.1, initial_delay=0.04, max_delay=1.0)
+    delays = []
+    for delay in startup.delays(2):
+        delays.append(delay)
+        time.sleep(delay)
+    # the last delay is cut to the deadline
+    assert delays[0] == pytest.approx(0.04) and delays[1] < 0.08
+    assert startup.remaining() == 0.0
+    assert not startup.wait_announced(2)
+
+
+def test_wait_until_every_node_is_ready_or_failed():
+    startup = Startup([2, 3])
+    startup.set_ready(2)
+    assert not startup.done()
+    startup.set_failed(3, "connection refused")
+    assert startup.done() and not startup.wait()
+    startup.print_summary()
+
+
+def test_startup_arguments(parse):
+    startup = startup_from_args(parse("--startup-timeout", "5", "--connect-backoff", "0.1", "1"), [2, 3])
+    assert (startup.timeout, startup.initial_delay, startup.max_delay) == (5.0, 0.1, 1.0)
+    assert not startup.announcements
+    for argv in (("--startup-timeout", "0"), ("--connect-backoff", "0", "1"), ("--connect-backoff", "1", "0.5")):
+        with pytest.raises(ValueError):
+            startup_from_args(parse(*argv), [2])
@@ -0,0 +1,50 @@
+import pytest
+
+from sweep import PortAllocator, delivery_ratio, expand_grid, max_num_nodes, parse_grid
+
+
+def test_parse_and_expand_grid():
+    grid = parse_grid(["n=2,4", "txpower=130"])
+    assert grid == {"n": ["2", "4"], "txpower": ["130"]}
+    assert expand_grid(grid) == [{"n": "2", "txpower": "130"}, {"n": "4", "txpower": "130"}]
+    with pytest.raises(ValueError):
+        parse_grid(["n"])
+
+
+def test_num_nodes_from_grid_and_harness_arguments():
+    # regression: a harness -n outside the grid was ignored and the port blocks overlapped
+    assert max_num_nodes([{"n": "2"}], ["-n", "10", "--no-cache"]) == 10
+    assert max_num_nodes([{"num_nodes": "12"}], ["--num-nodes=3"]) == 12
+    assert max_num_nodes([], ["-n10"]) == 10
+    assert max_num_nodes([{"txpower": "130"}], []) == 2
+    with pytest.raises(ValueError):
+        max_num_nodes([], ["-n", "many"])
+
+
+def test_port_blocks_do_not_overlap():
+    ports = PortAllocator(20000, 12)
+    blocks = [ports.acquire() for _ in range(3)]
+    ranges = []
+    for block in blocks:
+        app, pos, send = ports.ports(block)
+        assert pos - app == send - pos == 12
+        ranges.append(range(app, send + 12))
+    used = [port for r in ranges for port in r]
+    assert len(used) == len(set(used))
+    ports.release(blocks[0])
+    # a released block is reused last
+    assert ports.acquire() not in blocks
+
+
+def test_port_allocator_needs_room():
+    with pytest.raises(ValueError):
+        PortAllocator(65000, 200)
+
+
+def test_delivery_ratio_of_broadcast():
+    stats = {"sent": 10, "received": 15, "flows": [{"src": 2, "dst": 1, "sent": 5}, {"src": 2, "dst": 3, "sent": 5},
+                                                  {"src": 3, "dst": 1, "sent": 5}]}
+    # node 2 sends to 1 and 3, node 3 only to 1
+    assert delivery_ratio(stats) == 1.0
+    assert delivery_ratio({"sent": 10, "received": 6, "expected": 20, "flows": []}) == 0.3
+    assert delivery_ratio({"sent": 0, "received": 0, "flows": []}) is None
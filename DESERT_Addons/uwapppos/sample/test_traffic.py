@@ -0,0 +1,97 @@
+import pytest
+
+from traffic import (BurstProfile, ConstantProfile, PoissonProfile, TraceProfile, TrafficScheduler, add_traffic_arguments,
+                     load_trace, profile_factory, send_interval_from_args)
+
+
+ADD_ARGUMENTS = [add_traffic_arguments]
+
+
+def test_zero_interval_does_not_schedule(parse):
+    # regression: -i 0 kept the node due for ever, pop_due() never returned
+    create = profile_factory(parse("-i", "0"), 3, 10)
+    assert create(2) is None
+    assert profile_factory(parse("-i", "0", "--traffic", "poisson"), 3, 10)(2) is None
+
+
+def test_negative_interval_rejected(parse):
+    with pytest.raises(ValueError):
+        profile_factory(parse("-i", "-1"), 3, 10)
+
+
+@pytest.mark.parametrize("create", [lambda: ConstantProfile(0.0), lambda: PoissonProfile(-1.0, None),
+                                    lambda: BurstProfile(0.0, 1.0, 1.0), lambda: BurstProfile(1.0, 0.0, 1.0)])
+def test_profiles_need_advancing_deadlines(create):
+    with pytest.raises(ValueError):
+        create()
+
+
+def test_trace_needs_trace_file(parse, tmp_path):
+    with pytest.raises(ValueError):
+        profile_factory(parse("--traffic", "trace"), 3, 10)
+    with pytest.raises(ValueError):
+        profile_factory(parse("--traffic", "trace", "--traffic-trace", str(tmp_path / "missing.csv")), 3, 10)
+
+
+def test_load_trace_per_node(parse, tmp_path):
+    trace = tmp_path / "trace.csv"
+    trace.write_text("# node,time\nnode,time\n2,0.5\n3,1.0\n2,0.25\n")
+    assert load_trace(str(trace)) == {2: [0.5, 0.25], 3: [1.0]}
+    create = profile_factory(parse("--traffic", "trace", "--traffic-trace", str(trace)), 2, 10)
+    profile = create(2)
+    assert isinstance(profile, TraceProfile)
+    assert [profile.first(10.0), profile.next(None), profile.next(None)] == [10.25, 10.5, None]
+
+
+def test_deadlines_do_not_drift(clock):
+    scheduler = TrafficScheduler(clock)
+    scheduler.add(2, ConstantProfile(1.0), callback="node 2")
+    scheduler.add(3, ConstantProfile(1.5), callback="node 3")
+    assert scheduler.next_deadline() == 1.0
+    assert scheduler.pop_due(0.9) == []
+    # late by 0.4 s, the next deadline stays on the grid of the interval
+    assert scheduler.pop_due(1.4) == [(2, "node 2")]
+    assert scheduler.next_deadline() == 1.5
+    assert sorted(scheduler.pop_due(3.0)) == [(2, "node 2"), (2, "node 2"), (3, "node 3"), (3, "node 3")]
+    assert scheduler.next_deadline() == 4.0
+    assert scheduler.sent == {2: 3, 3: 2}
+    assert scheduler.lateness_max == pytest.approx(1.5)
+
+
+def test_clear_and_remove_unschedule(clock):
+    scheduler = TrafficScheduler(clock)
+    scheduler.add(2, ConstantProfile(1.0))
+    scheduler.add(3, ConstantProfile(1.0))
+    scheduler.remove(2)
+    assert scheduler.pop_due(1.0) == [(3, None)]
+    scheduler.clear()
+    assert scheduler.next_deadline() is None
+    assert scheduler.pop_due(100.0) == []
+
+
+def test_burst_pauses_between_bursts():
+    profile = BurstProfile(1.0, 2.5, 10.0)
+    deadlines = [profile.first(0.0)]
+    for _ in range(3):
+        deadlines.append(profile.next(deadlines[-1]))
+    assert deadlines == [1.0, 2.0, 12.5, 13.5]
+
+
+def test_burst_offered_load_is_the_cycle_mean(parse):
+    # 2 msg/s over 4 nodes, sent during 10 s of each 30 s cycle
+    args = parse("--traffic", "burst", "--offered-load", "2", "--burst-on", "10", "--burst-off", "20")
+    assert send_interval_from_args(args, 4, 10) == pytest.approx(2.0 / 3.0)
+    profile = profile_factory(args, 4, 10)(2)
+    deadline = profile.first(0.0)
+    sent = 0
+    while deadline < 300.0:
+        sent += 1
+        deadline = profile.next(deadline)
+    assert sent == pytest.approx(0.5 * 300.0, rel=0.05)
+
+
+def test_offered_load_rejected_with_trace(parse, tmp_path):
+    trace = tmp_path / "trace.csv"
+    trace.write_text("0.5\n")
+    with pytest.raises(ValueError):
+        profile_factory(parse("--traffic", "trace", "--traffic-trace", str(trace), "--offered-load", "1"), 2, 10)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from mobility import POSITION_DTYPE
+from trajectory import TrajectoryPlayer, convert_csv, write_trajectory
+
+
+@pytest.fixture
+def track(tmp_path):
+    """Two nodes in shuffled rows, node 3 starts later and is geodetic"""
+    csv = tmp_path / "track.csv"
+    rows = ["time,node_id,x,y,z,geodetic",
+            "10,2,100,0,-10,0", "0,2,0,0,-10,0", "5,3,45.0,12.0,0,1", "20,2,100,100,-10,0", "15,3,45.5,12.0,0,1"]
+    csv.write_text("\n".join(rows) + "\n")
+    trj = tmp_path / "track.trj"
+    # chunks smaller than the file exercise the chunked conversion
+    assert convert_csv(str(csv), str(trj), chunk_rows=2) == 5
+    return str(trj)
+
+
+def test_convert_sorts_per_node(track):
+    player = TrajectoryPlayer(track)
+    assert list(player.node_ids) == [2, 3]
+    assert list(player.geodetic) == [False, True]
+    assert list(player.nodes["start"]) == [0, 3]
+    assert list(player.columns["t"]) == [0.0, 10.0, 20.0, 5.0, 15.0]
+    assert list(player.columns["x"]) == [0.0, 100.0, 100.0, 45.0, 45.5]
+    assert (player.t_begin, player.t_end) == (0.0, 20.0)
+    assert player.recorded_interval() == 10.0
+
+
+def test_playback_interpolates(track):
+    player = TrajectoryPlayer(track, rate=2.0)
+    # before the first sample of node 3 it holds that sample
+    assert player.pos[1] == pytest.approx([45.0, 12.0, 0.0])
+    player.step(2.5)
+    assert player.time == 5.0
+    assert player.pos[0] == pytest.approx([50.0, 0.0, -10.0])
+    assert player.pos[1] == pytest.approx([45.0, 12.0, 0.0])
+    player.step(2.5)
+    assert player.pos[0] == pytest.approx([100.0, 0.0, -10.0])
+    assert player.pos[1] == pytest.approx([45.25, 12.0, 0.0])
+    assert not player.finished
+    # after the last sample the last positions are held
+    player.step(100.0)
+    assert player.finished
+    assert player.pos == pytest.approx(np.array([[100.0, 100.0, -10.0], [45.5, 12.0, 0.0]]))
+    records = np.frombuffer(player.pack(), dtype=POSITION_DTYPE)
+    assert len(records) == 2
+
+
+def test_cursor_window_fallback(tmp_path):
+    # a jump over more than the 64 samples of the search window
+    trj = str(tmp_path / "long.trj")
+    t = np.arange(1000.0)
+    write_trajectory(trj, t, np.full(1000, 2), 2.0 * t, np.zeros(1000), np.zeros(1000), chunk_rows=128)
+    player = TrajectoryPlayer(trj)
+    player.step(10.5)
+    assert player.pos[0, 0] == pytest.approx(21.0)
+    player.step(500.25)
+    assert player.pos[0, 0] == pytest.approx(2.0 * 510.75)
+    player.step(0.5)
+    assert player.pos[0, 0] == pytest.approx(2.0 * 511.25)
+
+
+def test_not_a_trajectory(tmp_path):
+    bogus = tmp_path / "bogus.trj"
+    bogus.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        TrajectoryPlayer(str(bogus))
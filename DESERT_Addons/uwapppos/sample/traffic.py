@@ -0,0 +1,306 @@
+import heapq
+import logging
+import threading
+
+import numpy as np
+
+from clock import WALL_CLOCK
+
+logger = logging.getLogger(__name__)
+
+
+def check_interval(interval: float) -> None:
+    """The deadlines of a profile must advance, an interval <= 0 would keep a node due for ever"""
+    if interval <= 0.0:
+        raise ValueError(f"The send interval of a traffic profile must be > 0, not {interval}")
+
+
+def check_burst(on_time: float, off_time: float) -> None:
+    if on_time <= 0.0 or off_time < 0.0:
+        raise ValueError("The burst on time must be > 0 and the off time >= 0")
+
+
+class ConstantProfile(object):
+    def __init__(self, interval: float) -> None:
+        """Send every interval [s], the first message one interval after start"""
+        check_interval(interval)
+        self.interval = interval
+
+    def first(self, start: float):
+        return start + self.interval
+
+    def next(self, deadline: float):
+        return deadline + self.interval
+
+
+class PoissonProfile(object):
+    def __init__(self, interval: float, rng: np.random.Generator) -> None:
+        """Exponentially distributed inter-arrival times with mean interval [s] (like PoissonTraffic_ of uwApplication)"""
+        check_interval(interval)
+        self.interval = interval
+        self.rng = rng
+
+    def first(self, start: float):
+        return start + self.rng.exponential(self.interval)
+
+    def next(self, deadline: float):
+        return deadline + self.rng.exponential(self.interval)
+
+
+class BurstProfile(object):
+    def __init__(self, interval: float, on_time: float, off_time: float) -> None:
+        """Send every interval [s] during on_time [s], then pause for off_time [s]"""
+        check_interval(interval)
+        check_burst(on_time, off_time)
+        self.interval = interval
+        self.on_time = on_time
+        self.off_time = off_time
+        self.start = 0.0
+
+    def _in_burst(self, t: float) -> float:
+        cycle = self.on_time + self.off_time
+        k, offset = divmod(t - self.start, cycle)
+        if offset < self.on_time:
+            return t
+        return self.start + (k + 1) * cycle
+
+    def first(self, start: float):
+        self.start = start
+        return self._in_burst(start + self.interval)
+
+    def next(self, deadline: float):
+        return self._in_burst(deadline + self.interval)
+
+
+class TraceProfile(object):
+    def __init__(self, times) -> None:
+        """Send at the given times [s] relative to the start"""
+        self.times = sorted(times)
+        self.index = 0
+        self.start = 0.0
+
+    def first(self, start: float):
+        self.start = start
+        self.index = 0
+        return self.next(None)
+
+    def next(self, deadline):
+        if self.index >= len(self.times):
+            return None
+        t = self.start + self.times[self.index]
+        self.index += 1
+        return t
+
+
+def load_trace(filename: str) -> dict:
+    """
+    Read a traffic trace with one send time [s] per line, optionally preceded by
+    the node id (node_id,time). Returns node id (None for all nodes) -> list of times.
+    """
+    traces = {}
+    try:
+        f = open(filename, "rt")
+    except OSError as e:
+        raise ValueError(f"Cannot read the traffic trace {filename}: {e}")
+    with f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split(",")
+            try:
+                if len(fields) == 1:
+                    traces.setdefault(None, []).append(float(fields[0]))
+                else:
+                    traces.setdefault(int(fields[0]), []).append(float(fields[1]))
+            except ValueError:
+                continue  # header
+    return traces
+
+
+class TrafficScheduler(threading.Thread):
+    def __init__(self, clock=WALL_CLOCK) -> None:
+        """
+        Central send scheduler for all nodes on the monotonic clock, or on the
+        simulation time of a VirtualClock (see clock.py).
+        Deadlines are absolute, the next deadline of a node is computed from its
+        previous deadline and not from the time the message was actually sent,
+        so the send rate does not drift.
+
+        Can run as thread calling the callback of each node, or be polled with
+        next_deadline() / pop_due() from an event loop.
+        """
+        super().__init__(name="TrafficScheduler")
+        self._heap = []
+        self._profiles = {}
+        self._callbacks = {}
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self.should_stop = False
+        self.start_time = None
+        self.end_time = None
+        self.sent = {}
+        self.lateness_max = 0.0
+        self.lateness_sum = 0.0
+
+    def add(self, node_id: int, profile, callback=None, start: float = None) -> None:
+        """Schedule node_id with the given profile, callback() is called at each deadline when running as thread"""
+        now = self.clock.now()
+        if self.start_time is None:
+            self.start_time = now
+        with self._lock:
+            self._profiles[node_id] = profile
+            self._callbacks[node_id] = callback
+            self.sent.setdefault(node_id, 0)
+            deadline = profile.first(now if start is None else start)
+            if deadline is not None:
+                heapq.heappush(self._heap, (deadline, node_id))
+        self._wakeup.set()
+
+    def remove(self, node_id: int) -> None:
+        with self._lock:
+            self._profiles.pop(node_id, None)
+            self._callbacks.pop(node_id, None)
+
+    def clear(self) -> None:
+        """Unschedule all nodes, e.g. when the run time is over, the thread keeps running until stop()"""
+        with self._lock:
+            self._profiles.clear()
+            self._callbacks.clear()
+            self._heap.clear()
+        if self.end_time is None:
+            self.end_time = self.clock.now()
+        self._wakeup.set()
+
+    def next_deadline(self):
+        """Next deadline on the clock or None if nothing is scheduled"""
+        with self._lock:
+            while self._heap and self._heap[0][1] not in self._profiles:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> list:
+        """Return the (node_id, callback) of all nodes with a deadline <= now and schedule their next deadline"""
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, node_id = heapq.heappop(self._heap)
+                profile = self._profiles.get(node_id)
+                if profile is None:
+                    continue
+                late = now - deadline
+                self.lateness_sum += late
+                self.lateness_max = max(self.lateness_max, late)
+                self.sent[node_id] += 1
+                due.append((node_id, self._callbacks[node_id]))
+                next_deadline = profile.next(deadline)
+                if next_deadline is not None:
+                    heapq.heappush(self._heap, (next_deadline, node_id))
+        return due
+
+    def stop(self):
+        """stop the thread."""
+        self.should_stop = True
+        self._wakeup.set()
+
+    def run(self):
+        while not self.should_stop:
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else deadline - self.clock.now()
+            if timeout is None or timeout > 0.0:
+                self._wakeup.wait(timeout)
+                self._wakeup.clear()
+                continue
+            for node_id, callback in self.pop_due(self.clock.now()):
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"Node {node_id}: error sending message: {e}", exc_info=True)
+
+    def summary(self) -> dict:
+        end = self.end_time if self.end_time is not None else self.clock.now()
+        elapsed = end - self.start_time if self.start_time is not None else 0.0
+        total = sum(self.sent.values())
+        return {
+            "messages": total,
+            "elapsed": elapsed,
+            "offered_load": total / elapsed if elapsed > 0.0 else 0.0,
+            "lateness_mean": self.lateness_sum / total if total else 0.0,
+            "lateness_max": self.lateness_max,
+        }
+
+    def print_summary(self) -> None:
+        s = self.summary()
+        print(f"Traffic: {s['messages']} messages in {s['elapsed']:.1f} s, offered load {s['offered_load']:.3f} msg/s, "
+              f"send lateness mean {1e3 * s['lateness_mean']:.2f} ms max {1e3 * s['lateness_max']:.2f} ms")
+
+
+def add_traffic_arguments(argparser) -> None:
+    group = argparser.add_argument_group('traffic')
+    group.add_argument('--traffic', choices=('constant', 'poisson', 'burst', 'trace'), default='constant',
+                       help='Traffic profile of the sending nodes')
+    group.add_argument('-i', '--send-interval', type=float, default=5.0,
+                       help='Mean send interval per node in [s], 0 to not send, ignored if --offered-load is given')
+    group.add_argument('--offered-load', type=float, default=None,
+                       help='Aggregate offered load of all sending nodes, see --load-unit. With --traffic burst '
+                            'it is the mean over the burst cycle, not usable with --traffic trace')
+    group.add_argument('--load-unit', choices=('msg', 'bit'), default='msg',
+                       help='Unit of --offered-load: messages/s or bits/s')
+    group.add_argument('--burst-on', type=float, default=10.0, help='Burst profile: on time in [s]')
+    group.add_argument('--burst-off', type=float, default=20.0, help='Burst profile: off time in [s]')
+    group.add_argument('--traffic-trace', default=None,
+                       help='Trace profile: file with send times [s] per line, optionally as node_id,time')
+
+
+def send_interval_from_args(args, num_senders: int, payload_size: int) -> float:
+    """
+    Mean send interval of one node in [s], 0 if the nodes do not send. With the
+    burst profile it is the interval during the on time.
+    """
+    if args.offered_load is None:
+        if args.send_interval < 0.0:
+            raise ValueError("The send interval must be >= 0, 0 to not send")
+        return args.send_interval
+    if args.traffic == 'trace':
+        raise ValueError("--offered-load cannot be used with --traffic trace, the trace gives the send times")
+    if args.offered_load <= 0.0:
+        raise ValueError("The offered load must be > 0")
+    rate = args.offered_load / max(1, num_senders)
+    if args.load_unit == 'bit':
+        rate /= 8.0 * payload_size
+    if args.traffic == 'burst':
+        # the nodes only send during the on time, the load is the mean over the burst cycle
+        check_burst(args.burst_on, args.burst_off)
+        rate *= (args.burst_on + args.burst_off) / args.burst_on
+    return 1.0 / rate
+
+
+def profile_factory(args, num_senders: int, payload_size: int):
+    """
+    Return a function node_id -> traffic profile according to the command line,
+    None for nodes which do not send (send interval 0). Raises ValueError for
+    invalid traffic options, call it before ns is started.
+    """
+    if args.traffic == 'burst':
+        check_burst(args.burst_on, args.burst_off)
+    interval = send_interval_from_args(args, num_senders, payload_size)
+    rng = np.random.default_rng(getattr(args, 'seed', None))
+    if args.traffic == 'trace' and not args.traffic_trace:
+        raise ValueError("--traffic trace needs a trace file with --traffic-trace")
+    traces = load_trace(args.traffic_trace) if args.traffic == 'trace' else {}
+    if args.traffic == 'trace' and not traces:
+        raise ValueError(f"The traffic trace {args.traffic_trace} contains no send times")
+
+    def create(node_id: int):
+        if args.traffic == 'trace':
+            return TraceProfile(traces.get(node_id, traces.get(None, [])))
+        if interval == 0.0:
+            # like the receiving node, which is added with send interval 0.0
+            return None
+        if args.traffic == 'poisson':
+            return PoissonProfile(interval, rng)
+        if args.traffic == 'burst':
+            return BurstProfile(interval, args.burst_on, args.burst_off)
+        return ConstantProfile(interval)
+    return create
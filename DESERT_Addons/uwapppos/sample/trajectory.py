@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Recorded vehicle trajectories for position playback.
+
+Trajectory file layout (little endian, all sections 8 byte aligned):
+    header      magic "UWTRJ001", uint64 number of nodes, uint64 number of samples
+    node table  per node: int64 node_id, uint64 first sample, uint64 sample count, uint64 geodetic flag
+    columns     float64 t[samples], x[samples], y[samples], z[samples]
+Samples are sorted by node and time, so the samples of one node are contiguous.
+For geodetic tracks x is latitude and y is longitude in [deg].
+
+Convert a CSV file with the columns time,node_id,x,y,z[,geodetic] with:
+    python3 trajectory.py convert track.csv track.trj
+"""
+
+import logging
+import os
+import struct
+from argparse import ArgumentParser
+
+import numpy as np
+
+from mobility import POSITION_DTYPE, pack_positions
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"UWTRJ001"
+HEADER_STRUCT = struct.Struct("<8sQQ")
+NODE_DTYPE = np.dtype([("node_id", "<i8"), ("start", "<u8"), ("count", "<u8"), ("geodetic", "<u8")])
+COLUMNS = ("t", "x", "y", "z")
+
+
+def write_trajectory(filename: str, t, node_id, x, y, z, geodetic=None, chunk_rows: int = 1000000) -> None:
+    """
+    Write samples (arrays of equal length, may be memory-mapped) into a trajectory
+    file. Only the sort keys t and node_id and the permutation are held in memory,
+    the columns are permuted and written in chunks of chunk_rows samples.
+    """
+    t = np.asarray(t, dtype="<f8")
+    node_id = np.asarray(node_id, dtype="<i8")
+    if geodetic is None:
+        geodetic = np.zeros(len(t), dtype=bool)
+    geodetic = np.asarray(geodetic, dtype=bool)
+    order = np.lexsort((t, node_id))
+    ids, counts = np.unique(node_id, return_counts=True)
+    first = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+    nodes = np.zeros(len(ids), dtype=NODE_DTYPE)
+    nodes["node_id"] = ids
+    nodes["start"] = first
+    nodes["count"] = counts
+    nodes["geodetic"] = geodetic[order[first]]
+    with open(filename, "wb") as f:
+        f.write(HEADER_STRUCT.pack(MAGIC, len(ids), len(t)))
+        f.write(nodes.tobytes())
+        for column in (t, x, y, z):
+            for i in range(0, len(order), chunk_rows):
+                f.write(np.asarray(column[order[i:i + chunk_rows]], dtype="<f8").tobytes())
+
+
+def convert_csv(csv_filename: str, trj_filename: str, geodetic: bool = False, chunk_rows: int = 1000000) -> int:
+    """
+    Convert a CSV file with header and the columns time,node_id,x,y,z[,geodetic]
+    into a trajectory file, returns the number of samples.
+    The CSV file is read in chunks into a temporary memory-mapped file before sorting.
+    """
+    tmp_filename = trj_filename + ".tmp"
+    rows = 0
+    with open(csv_filename, "rt") as f, open(tmp_filename, "wb") as tmp:
+        header = f.readline().strip().split(",")
+        num_columns = len(header)
+        if num_columns < 5:
+            raise ValueError(f"{csv_filename}: expected columns time,node_id,x,y,z[,geodetic], got {header}")
+        while True:
+            chunk = np.loadtxt(f, delimiter=",", max_rows=chunk_rows, ndmin=2, dtype="<f8")
+            if chunk.size == 0:
+                break
+            tmp.write(np.ascontiguousarray(chunk[:, :6] if num_columns > 5 else
+                                           np.hstack((chunk, np.full((len(chunk), 1), float(geodetic))))).tobytes())
+            rows += len(chunk)
+            if len(chunk) < chunk_rows:
+                break
+    try:
+        data = np.memmap(tmp_filename, dtype="<f8", mode="r", shape=(rows, 6))
+        write_trajectory(trj_filename, data[:, 0], data[:, 1].astype(np.int64),
+                         data[:, 2], data[:, 3], data[:, 4], data[:, 5] != 0.0, chunk_rows)
+        del data
+    finally:
+        os.remove(tmp_filename)
+    return rows
+
+
+class TrajectoryPlayer(object):
+    def __init__(self, filename: str, rate: float = 1.0) -> None:
+        """
+        Play back a trajectory file. The file is mapped with numpy.memmap, so only
+        the pages around the current playback time are read.
+        Provides the same interface as MobilityEngine (node_ids, pos, step(), pack())
+        and can be driven by PosWorker.
+
+        rate: playback speed, 1.0 plays at the recorded rate
+        """
+        self.filename = filename
+        self.rate = rate
+        with open(filename, "rb") as f:
+            magic, num_nodes, num_samples = HEADER_STRUCT.unpack(f.read(HEADER_STRUCT.size))
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a trajectory file")
+        offset = HEADER_STRUCT.size
+        self.nodes = np.memmap(filename, dtype=NODE_DTYPE, mode="r", offset=offset, shape=(num_nodes,))
+        offset += NODE_DTYPE.itemsize * num_nodes
+        self.columns = {}
+        for name in COLUMNS:
+            self.columns[name] = np.memmap(filename, dtype="<f8", mode="r", offset=offset, shape=(num_samples,))
+            offset += 8 * num_samples
+        self.node_ids = np.array(self.nodes["node_id"], dtype=np.int64)
+        self.geodetic = np.array(self.nodes["geodetic"], dtype=bool)
+        self._start = np.array(self.nodes["start"], dtype=np.int64)
+        self._count = np.array(self.nodes["count"], dtype=np.int64)
+        t = self.columns["t"]
+        self.t_begin = min(t[s] for s in self._start) if num_nodes else 0.0
+        self.t_end = max(t[s + c - 1] for s, c in zip(self._start, self._count)) if num_nodes else 0.0
+        self.time = self.t_begin
+        self._cursor = np.zeros(num_nodes, dtype=np.int64)
+        self.pos = np.zeros((num_nodes, 3))
+        self._records = np.zeros(num_nodes, dtype=POSITION_DTYPE)
+        self.finished = False
+        self._interpolate()
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    def recorded_interval(self) -> float:
+        """Median sample interval of the first node in [s]"""
+        if len(self) == 0 or self._count[0] < 2:
+            return 1.0
+        s = self._start[0]
+        t = np.asarray(self.columns["t"][s:s + min(self._count[0], 1000)])
+        return float(np.median(np.diff(t)))
+
+    def _interpolate(self) -> None:
+        t = self.columns["t"]
+        for i, (start, count) in enumerate(zip(self._start, self._count)):
+            # cursor only moves forward, search in a small window first
+            c = self._cursor[i]
+            window = t[start + c:start + min(count, c + 64)]
+            k = int(np.searchsorted(window, self.time, side="right"))
+            if k == len(window) and c + k < count:
+                k = int(np.searchsorted(t[start + c:start + count], self.time, side="right"))
+            j = max(0, c + k - 1)
+            self._cursor[i] = j
+            a = start + j
+            if j + 1 < count and t[a] <= self.time:
+                w = (self.time - t[a]) / (t[a + 1] - t[a])
+            else:
+                w = 0.0
+            b = a + 1 if j + 1 < count else a
+            for axis, name in enumerate(("x", "y", "z")):
+                col = self.columns[name]
+                self.pos[i, axis] = col[a] + w * (col[b] - col[a])
+
+    def step(self, dt: float) -> None:
+        """Advance the playback time by dt * rate"""
+        if dt <= 0.0:
+            return
+        self.time += dt * self.rate
+        if self.time >= self.t_end and not self.finished:
+            self.finished = True
+            logger.info(f"Trajectory playback of {self.filename} finished, holding last positions")
+        self._interpolate()
+
+    def pack(self) -> memoryview:
+        """Return the PositionData records of all nodes as one buffer"""
+        return pack_positions(self._records, self.geodetic, self.pos)
+
+
+def main():
+    argparser = ArgumentParser(description='Convert and inspect trajectory files for position playback.')
+    subparsers = argparser.add_subparsers(dest='command', required=True)
+    p = subparsers.add_parser('convert', help='Convert CSV (time,node_id,x,y,z[,geodetic]) into a trajectory file')
+    p.add_argument('csv', help='CSV input file')
+    p.add_argument('trj', help='Trajectory output file')
+    p.add_argument('-g', '--geodetic', action='store_true', help='x/y are latitude/longitude if the CSV has no geodetic column')
+    p = subparsers.add_parser('info', help='Show the content of a trajectory file')
+    p.add_argument('trj', help='Trajectory file')
+    args = argparser.parse_args()
+
+    if args.command == 'convert':
+        rows = convert_csv(args.csv, args.trj, args.geodetic)
+        print(f"Converted {rows} samples into {args.trj}")
+    else:
+        player = TrajectoryPlayer(args.trj)
+        print(f"{args.trj}: {len(player)} node(s), {player.t_end - player.t_begin:.1f} s, "
+              f"sample interval {player.recorded_interval():.3f} s")
+        for n in player.nodes:
+            print(f"  node {n['node_id']}: {n['count']} samples{' (geodetic)' if n['geodetic'] else ''}")
+
+
+if __name__ == '__main__':
+    main()
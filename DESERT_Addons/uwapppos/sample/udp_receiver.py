@@ -0,0 +1,101 @@
+import logging
+import selectors
+import socket
+import threading
+
+logger = logging.getLogger(__name__)
+
+# PSDU of the uwAppPos templates, no payload delivered by ns is larger
+MAX_PAYLOAD = 1400
+
+# datagrams read from one socket per wakeup before the next socket is served
+MAX_BATCH = 64
+
+# report truncated datagrams with the real size (Linux)
+MSG_TRUNC = getattr(socket, "MSG_TRUNC", 0)
+
+
+def open_udp_socket(local_address: tuple, rcvbuf: int = 1 << 20) -> socket.socket:
+    """Non-blocking UDP socket bound to local_address, with a receive buffer large enough for bursts"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        s.bind(local_address)
+    except OSError:
+        s.close()
+        raise
+    s.setblocking(False)
+    return s
+
+
+def drain_datagrams(s: socket.socket, buf: memoryview, handler, max_batch: int = MAX_BATCH) -> int:
+    """
+    Read up to max_batch pending datagrams of s into buf and call handler(data)
+    for each, data is a memoryview into buf only valid during the call.
+    Returns the number of datagrams read.
+    """
+    count = 0
+    truncated = 0
+    size = len(buf)
+    for _ in range(max_batch):
+        try:
+            n = s.recv_into(buf, size, MSG_TRUNC)
+        except (BlockingIOError, InterruptedError):
+            break
+        except ConnectionRefusedError:
+            # ICMP port unreachable of a previous send
+            continue
+        if n > size:
+            truncated += 1
+            n = size
+        count += 1
+        handler(buf[:n])
+    if truncated:
+        logger.warning(f"{truncated} datagram(s) truncated to {size} bytes, increase the maximum payload size")
+    return count
+
+
+class UdpReceiver(threading.Thread):
+    def __init__(self, max_payload: int = MAX_PAYLOAD) -> None:
+        """
+        One receive loop for the UDP sockets of all nodes: the sockets are
+        registered with epoll (selectors.DefaultSelector) and all pending
+        datagrams are drained per wakeup into a preallocated buffer with
+        recv_into and dispatched to the handler of the socket.
+        """
+        super().__init__(name="UdpReceiver")
+        self._buffer = memoryview(bytearray(max_payload))
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        self.should_stop = False
+        self.received = 0
+
+    def add(self, s: socket.socket, handler) -> None:
+        """Dispatch the datagrams of s to handler(data), data is only valid during the call"""
+        self._selector.register(s, selectors.EVENT_READ, handler)
+
+    def remove(self, s: socket.socket) -> None:
+        try:
+            self._selector.unregister(s)
+        except (KeyError, ValueError):
+            pass
+
+    def stop(self):
+        """stop the thread."""
+        self.should_stop = True
+        try:
+            self._wakeup_w.send(b"\0")
+        except OSError:
+            pass
+
+    def run(self):
+        while not self.should_stop:
+            for key, _ in self._selector.select():
+                if key.data is None:
+                    continue
+                self.received += drain_datagrams(key.fileobj, self._buffer, key.data)
+        self._selector.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
@@ -47,6 +47,9 @@ Module/UW/APPPOS set EXP_ID_ 				1
 # Timeout of select() call to check if bytes are waiting in [us] (must be < 1 000 000)
 Module/UW/APPPOS set SocketReadTimeout      10000
 Module/UW/APPPOS set PositionReceivePort    5101
+# Port of the shared listener for batch position datagrams of all nodes (see position_data.h),
+# 0 to receive the positions of each node on its PositionReceivePort
+Module/UW/APPPOS set BatchPositionPort      0
 
 # If geodetic positions are used in position updates, 
 # a reference coordinate on sea surface (x=0,y=0) is needed.
@@ -40,6 +40,7 @@ uwAppPosModule::uwAppPosModule() : uwApplicationModule()
 {
 	bind("SocketReadTimeout", &m_SocketReadTimeout);
 	bind("PositionReceivePort", &m_PositionReceivePort);
+	bind("BatchPositionPort", &m_BatchPositionPort);
 #ifdef ENABLE_GEODETIC_POSITION
 	bind("ReferenceCoordinateLatitude", &m_RefCoordLat);
 	bind("ReferenceCoordinateLongitude", &m_RefCoordLon);
@@ -67,7 +68,15 @@ int uwAppPosModule::command(int argc, const char *const *argv)
 			struct timeval tv;
 			tv.tv_sec = 0;
 			tv.tv_usec = m_SocketReadTimeout;
-			m_PositionListener = new PositionListener(this, m_PositionReceivePort, tv);
+			if (m_BatchPositionPort > 0)
+			{
+				// one shared listener for the batch datagrams of all nodes
+				m_BatchRegistered = BatchPositionListener::Register(this, m_BatchPositionPort, tv);
+				if (m_BatchRegistered && debug_ >= 1)
+					LOG_MSG_INFO("[" << getEpoch() << "]::" << NOW << "::" << GetNodeID() << "::UWAPPPOS: starting position listener on port " << m_BatchPositionPort);
+			}
+			else
+				m_PositionListener = new PositionListener(this, m_PositionReceivePort, tv);
 			if (m_PositionListener)
 			{
 				if (debug_ >= 1)
@@ -80,6 +89,13 @@ int uwAppPosModule::command(int argc, const char *const *argv)
 		}
 		if (strcasecmp(argv[1], "stop") == 0)
 		{
+			if (m_BatchRegistered)
+			{
+				if (debug_ >= 1)
+					LOG_MSG_INFO(getEpoch() << "::" << NOW << "::" << GetNodeID() << "::UWAPPPOS: stopping position listener");
+				BatchPositionListener::Unregister(this, m_BatchPositionPort);
+				m_BatchRegistered = false;
+			}
 			if (m_PositionListener)
 			{
 				if (m_PositionListener->Running())
@@ -61,6 +61,10 @@ protected:
 	unsigned int m_SocketReadTimeout{50000};
 	/** Position receive port number for UDP socket */
 	unsigned int m_PositionReceivePort;
+	/** Port of the shared listener for batch position datagrams of all nodes, 0 to use PositionReceivePort */
+	unsigned int m_BatchPositionPort{0};
+	/** True if the module is registered with the BatchPositionListener of m_BatchPositionPort */
+	bool m_BatchRegistered{false};
 
 #ifdef ENABLE_GEODETIC_POSITION
 	/** Reference coordinate used to convert geodetic position data into cartesian data (north, east)*/